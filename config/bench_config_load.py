@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+'''
+Offline benchmark of master configuration loading.
+
+Loads master.py (and so project_builders.py) against stubbed buildbot / twisted /
+pullrequest modules, without running master. Measures wall time, peak RSS and
+number of gc-tracked objects for whole load and for each SetOfBuildersWithSchedulers
+registration, and compares results with stored baseline.
+
+Usage (from "config" directory, with the same Python as master):
+
+    python bench_config_load.py                     # run and compare with baseline
+    python bench_config_load.py --update-baseline   # store current results as baseline
+    python bench_config_load.py --repeat 5 --tolerance 0.3
+
+Each repetition is executed in separate process (cold import). Exit code is 1 if
+some value exceeds baseline by more than tolerance.
+'''
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+CONFIG_DIR = os.path.abspath(os.path.dirname(__file__))
+BASELINE_FILE = os.path.join(CONFIG_DIR, 'bench_config_load.baseline.json')
+
+#
+# Stubs
+#
+class _StubMeta(type):
+    ''' Unknown class attributes are generated as nested stub classes (namespaces like plugins.util) '''
+
+    def __getattr__(cls, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        nested = _StubMeta(name, (_Stub,), {})
+        setattr(cls, name, nested)
+        return nested
+
+
+class _Stub(object):
+    ''' Accepts any constructor arguments, any unknown method is no-op '''
+
+    __metaclass__ = _StubMeta
+
+    def __init__(self, *args, **kwargs):
+        self._stub_args = args
+        self._stub_kwargs = kwargs
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: None
+
+
+class PropertiesMixin:  # old-style class, same as in buildbot 0.8
+    pass
+
+
+class BuilderConfig(_Stub):
+
+    def __init__(self, name=None, **kwargs):
+        _Stub.__init__(self, name=name, **kwargs)
+        self.builddir = kwargs.get('builddir', None) or \
+            ''.join([c if c.isalnum() or c in '-_.' else '_' for c in name])
+
+
+class BuildSlave(_Stub):
+
+    def __init__(self, name, password, **kwargs):
+        _Stub.__init__(self, **kwargs)
+        self.slavename = name
+
+
+def _identity(fn):
+    return fn
+
+
+class _DefGen_Return(BaseException):
+
+    def __init__(self, value):
+        self.value = value
+
+
+def _returnValue(value):
+    raise _DefGen_Return(value)
+
+
+class _StubModule(types.ModuleType):
+    ''' Unknown attributes are generated as stub classes '''
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        cls = _StubMeta(name, (_Stub,), {})
+        setattr(self, name, cls)
+        return cls
+
+
+_STEP_CLASSES = {
+    'buildbot.steps.shell': ['ShellCommand', 'SetPropertyFromCommand', 'Compile', 'Configure', 'Test', 'WarningCountingShellCommand'],
+    'buildbot.steps.slave': ['RemoveDirectory', 'MakeDirectory', 'CopyDirectory', 'SetPropertiesFromEnv', 'FileExists'],
+    'buildbot.steps.master': ['MasterShellCommand', 'SetProperty', 'LogRenderable'],
+    'buildbot.steps.transfer': ['FileUpload', 'DirectoryUpload', 'FileDownload', 'StringDownload', 'JSONStringDownload'],
+}
+
+_STUB_ROOTS = ['buildbot', 'twisted', 'github', 'pullrequest']
+
+
+def installStubs():
+    '''
+    Registers stub modules in sys.modules. Should be called before import of any config module.
+    '''
+    def module(name, **attrs):
+        if name in sys.modules:
+            m = sys.modules[name]
+        else:
+            m = _StubModule(name)
+            sys.modules[name] = m
+            if '.' in name:
+                (parent, child) = name.rsplit('.', 1)
+                setattr(module(parent), child, m)
+        for k, v in attrs.items():
+            setattr(m, k, v)
+        return m
+
+    for root in _STUB_ROOTS:
+        for name in list(sys.modules.keys()):
+            if name == root or name.startswith(root + '.'):
+                del sys.modules[name]
+
+    module('buildbot.config', BuilderConfig=BuilderConfig)
+    module('buildbot.buildslave', BuildSlave=BuildSlave)
+    module('buildbot.process.properties', PropertiesMixin=PropertiesMixin, renderer=_identity)
+    module('buildbot.status.results',
+           SUCCESS=0, WARNINGS=1, FAILURE=2, SKIPPED=3, EXCEPTION=4, RETRY=5, CANCELLED=6,
+           Results=['success', 'warnings', 'failure', 'skipped', 'exception', 'retry', 'cancelled'])
+    module('buildbot.util', json=json)
+    for name in ['buildbot.interfaces', 'buildbot.process.builder', 'buildbot.process.build',
+                 'buildbot.process.buildrequest', 'buildbot.process.factory', 'buildbot.process.buildstep',
+                 'buildbot.process.remotecommand', 'buildbot.sourcestamp', 'buildbot.steps.source.git',
+                 'buildbot.steps.trigger', 'buildbot.schedulers.forcesched', 'buildbot.schedulers.timed',
+                 'buildbot.schedulers.triggerable', 'buildbot.plugins', 'buildbot.master']:
+        module(name)
+    for name, classes in _STEP_CLASSES.items():
+        m = module(name)
+        m.__all__ = list(classes)
+        for c in classes:
+            getattr(m, c)
+
+    module('twisted.internet.defer', inlineCallbacks=_identity, returnValue=_returnValue,
+           _DefGen_Return=_DefGen_Return)
+    module('twisted.internet', reactor=_Stub())
+    module('twisted.internet.task')
+    module('twisted.python.components', registerAdapter=lambda *args: None)
+    module('twisted.python.log', err=lambda *args, **kwargs: None, msg=lambda *args, **kwargs: None)
+    module('twisted.python.logfile')
+    module('twisted.web.static')
+    module('twisted.application.service')
+
+    module('github')
+    for name in ['pullrequest.context', 'pullrequest.utils', 'pullrequest.account',
+                 'pullrequest.webstatus', 'pullrequest.service']:
+        module(name)
+
+    import constants
+    if 'buildbot_passwords' not in sys.modules:
+        module('buildbot_passwords', worker=dict([(w, 'xxx') for w in constants.worker.keys()]))
+    if 'devices' not in sys.modules:
+        module('devices', devices=[])
+
+    os.environ.setdefault('GITHUB_APIKEY', '')
+
+
+#
+# Measurement
+#
+def _getPeakRSS():
+    ''' peak RSS, KB (Linux) '''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measureConfigLoad():
+    '''
+    Loads master.py in current process, returns dictionary with results
+    '''
+    sys.path.insert(0, CONFIG_DIR)
+    installStubs()
+
+    import factory_builders_aggregator
+    sets = []
+    Register = factory_builders_aggregator.SetOfBuildersWithSchedulers.Register
+
+    def RegisterWrapper(self):
+        objects_before = len(gc.get_objects())
+        start_time = time.time()
+        res = Register(self)
+        wall_time = time.time() - start_time
+        sets.append(dict(
+            name=self.nameprefix + str(self.branch),
+            time=wall_time,
+            builders=len(res[0]),
+            schedulers=len(res[1]),
+            objects=len(gc.get_objects()) - objects_before,
+            rss=_getPeakRSS(),
+        ))
+        return res
+    factory_builders_aggregator.SetOfBuildersWithSchedulers.Register = RegisterWrapper
+
+    objects_before = len(gc.get_objects())
+    start_time = time.time()
+    namespace = dict(__file__=os.path.join(CONFIG_DIR, 'master.py'), __name__='__config__')
+    execfile(namespace['__file__'], namespace)
+    wall_time = time.time() - start_time
+    config = namespace['BuildmasterConfig']
+    return dict(
+        total=dict(
+            time=wall_time,
+            builders=len(config['builders']),
+            schedulers=len(config['schedulers']),
+            objects=len(gc.get_objects()) - objects_before,
+            rss=_getPeakRSS(),
+        ),
+        sets=sets,
+    )
+
+
+def runIsolated(verbose=False):
+    ''' run measurement in separate process (cold import) '''
+    (fd, resultFile) = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call([sys.executable, os.path.abspath(__file__), '--child', resultFile],
+                                  cwd=CONFIG_DIR, stdout=None if verbose else devnull)
+        with open(resultFile) as f:
+            return json.load(f)
+    finally:
+        os.remove(resultFile)
+
+
+def _median(values):
+    values = sorted(values)
+    n = len(values)
+    if n % 2 == 1:
+        return values[n // 2]
+    return (values[n // 2 - 1] + values[n // 2]) / 2.0
+
+
+def aggregate(runs):
+    ''' median of each value over runs '''
+    def merge(items):
+        res = dict(items[0])
+        for key in ['time', 'objects', 'rss']:
+            res[key] = _median([i[key] for i in items])
+        return res
+    sets = []
+    for i in range(len(runs[0]['sets'])):
+        sets.append(merge([r['sets'][i] for r in runs]))
+    return dict(total=merge([r['total'] for r in runs]), sets=sets, runs=len(runs))
+
+
+# differences below these values are measurement noise
+NOISE_LEVEL = dict(time=0.005, objects=50, rss=1024)
+
+
+def compare(result, baseline, tolerance):
+    ''' returns list of regressions (text messages) '''
+    regressions = []
+
+    def check(name, cur, ref):
+        for key in ['builders', 'schedulers']:
+            if cur.get(key) != ref.get(key):
+                regressions.append('%s: %s changed %s -> %s' % (name, key, ref.get(key), cur.get(key)))
+        for key in ['time', 'objects', 'rss']:
+            if ref.get(key) and cur[key] > ref[key] * (1 + tolerance) and cur[key] - ref[key] > NOISE_LEVEL[key]:
+                regressions.append('%s: %s %s -> %s (+%d%%)' % (name, key, _fmt(key, ref[key]), _fmt(key, cur[key]),
+                                   int((cur[key] / float(ref[key]) - 1) * 100)))
+
+    check('total', result['total'], baseline['total'])
+    baseline_sets = dict([(s['name'], s) for s in baseline['sets']])
+    for s in result['sets']:
+        if s['name'] in baseline_sets:
+            check(s['name'], s, baseline_sets[s['name']])
+        else:
+            regressions.append('%s: new set of builders' % s['name'])
+    return regressions
+
+
+def _fmt(key, value):
+    if key == 'time':
+        return '%.1fms' % (value * 1000)
+    if key == 'rss':
+        return '%.1fMB' % (value / 1024.0)
+    return str(value)
+
+
+def report(result):
+    print('%-40s %10s %9s %11s %10s %10s' % ('Set of builders', 'time', 'builders', 'schedulers', 'objects', 'peak RSS'))
+    for s in result['sets'] + [dict(result['total'], name='TOTAL')]:
+        print('%-40s %10s %9d %11d %10d %10s' % (s['name'], _fmt('time', s['time']), s['builders'], s['schedulers'],
+                                                s['objects'], _fmt('rss', s['rss'])))
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Offline benchmark of buildbot master configuration loading')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs (median is used)')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline file')
+    parser.add_argument('--update-baseline', action='store_true', help='store results as new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative regression')
+    parser.add_argument('--output', help='write results into JSON file')
+    parser.add_argument('--verbose', action='store_true', help='show configuration output')
+    parser.add_argument('--child', metavar='RESULT_FILE', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = measureConfigLoad()
+        with open(args.child, 'w') as f:
+            json.dump(result, f)
+        return 0
+
+    result = aggregate([runIsolated(args.verbose) for _ in range(max(1, args.repeat))])
+    report(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+        print('Baseline is updated: %s' % args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('Baseline is not found: %s (use --update-baseline)' % args.baseline)
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(result, baseline, args.tolerance)
+    if regressions:
+        print('Regressions (tolerance %d%%):' % int(args.tolerance * 100))
+        for r in regressions:
+            print('  ' + r)
+        return 1
+    print('No regressions against baseline (tolerance %d%%)' % int(args.tolerance * 100))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+'''
+Prioritization of pending build requests (c['prioritizeBuilders'] and BuilderConfig(nextBuild=...)).
+
+Requests are ordered by class (precommit, nightly, weekly - from builder tags, see CommonFactory.getTags()
+and SetOfBuildersWithSchedulers), then by predicted build duration (shortest first).
+Waiting time is subtracted from the sort key (aging), so long/weekly builds are not starved.
+'''
+import calendar
+import time
+
+from twisted.internet import defer
+
+from constants import trace
+import duration_store
+
+# builder name -> (timestamp, predicted duration)
+_durationCache = {}
+
+
+class BuildPriorityPolicy(object):
+
+    # sort key offsets in seconds: weekly request waits 8 hours more than precommit one with the same duration
+    CLASS_DELAY = dict(precommit=0, force=0, nightly=4 * 3600, weekly=8 * 3600)
+    DEFAULT_CLASS = 'nightly'
+    DURATION_WEIGHT = 1.0  # sort key seconds per second of predicted duration
+    AGING_WEIGHT = 2.0  # sort key seconds per second of waiting
+    DEFAULT_DURATION = 30 * 60  # no build history
+    HISTORY_BUILDS = 5  # fallback to build status history if duration_store has no data
+    HISTORY_TTL = 30 * 60
+
+    def getBuilderClass(self, tags):
+        tags = tags or []
+        for c in ['precommit', 'weekly', 'nightly']:
+            if c in tags:
+                return c
+        return self.DEFAULT_CLASS
+
+    def getRequestClass(self, breq, builderClass):
+        scheduler = None
+        try:
+            scheduler = breq.properties.getProperty('scheduler', None)
+        except AttributeError:
+            pass
+        if scheduler and str(scheduler).startswith('force'):
+            return 'force'  # manual build requests are interactive
+        return builderClass
+
+    def getPredictedDuration(self, bldr):
+        name = bldr.name
+        now = time.time()
+        cached = _durationCache.get(name, None)
+        if cached is not None and now - cached[0] < self.HISTORY_TTL:
+            return cached[1]
+        duration = None
+        try:
+            duration = duration_store.getStore().getP50(name)
+        except Exception as e:
+            trace('Can\'t read build durations of %s: %s' % (name, e))
+        if duration is not None:
+            _durationCache[name] = (now, duration)
+            return duration
+        durations = []
+        try:
+            for b in bldr.builder_status.generateFinishedBuilds(num_builds=self.HISTORY_BUILDS):
+                (start, end) = b.getTimes()
+                if start and end:
+                    durations.append(end - start)
+        except Exception as e:
+            trace('Can\'t read build history of %s: %s' % (name, e))
+        duration = sorted(durations)[len(durations) // 2] if durations else self.DEFAULT_DURATION
+        _durationCache[name] = (now, duration)
+        return duration
+
+    def getSortKey(self, requestClass, duration, submittedAt, now):
+        waiting = max(0, now - submittedAt) if submittedAt else 0
+        return self.CLASS_DELAY.get(requestClass, 0) + self.DURATION_WEIGHT * duration - self.AGING_WEIGHT * waiting
+
+    @defer.inlineCallbacks
+    def prioritizeBuilders(self, master, builders):
+        now = time.time()
+        keys = []
+        for bldr in builders:
+            submittedAt = yield bldr.getOldestRequestTime()
+            if submittedAt is None:
+                keys.append((1, 0, bldr.name, bldr))  # no pending requests
+                continue
+            if hasattr(submittedAt, 'utctimetuple'):  # datetime from DB (UTC)
+                submittedAt = calendar.timegm(submittedAt.utctimetuple())
+            builderClass = self.getBuilderClass(getattr(bldr.config, 'tags', None))
+            key = self.getSortKey(builderClass, self.getPredictedDuration(bldr), submittedAt, now)
+            keys.append((0, key, bldr.name, bldr))
+        keys.sort()
+        defer.returnValue([k[-1] for k in keys])
+
+    def nextBuild(self, bldr, requests):
+        if len(requests) <= 1:
+            return requests[0] if requests else None
+        now = time.time()
+        builderClass = self.getBuilderClass(getattr(bldr.config, 'tags', None))
+        duration = self.getPredictedDuration(bldr)
+        keys = [(self.getSortKey(self.getRequestClass(r, builderClass), duration, r.submittedAt, now), r.submittedAt, i)
+                for (i, r) in enumerate(requests)]
+        return requests[min(keys)[-1]]
+
+
+defaultPolicy = BuildPriorityPolicy()
@@ -9,7 +9,128 @@ from buildbot.process.properties import PropertiesMixin
 from twisted.internet import defer
 from twisted.python import components
 
-import copy
+import hashlib
+import re
+import types
+import weakref
+
+import worker_selection
+import build_priority
+import duration_store
+import concurrency_controller
+import supersede
+import worker_reservation
+
+# Registered builders of previous configuration load: name -> (fingerprint, BuilderConfig).
+# project_builders.py is reloaded on reconfig (see master.py), this module is not.
+_registeredBuilders = {}
+
+_RegexType = type(re.compile(''))
+_SimpleTypes = set([type(None), bool, int, long, float, str, unicode])
+
+
+def _stableRepr(value, depth=0):
+    ''' repr() without object addresses and with sorted dictionaries '''
+    if type(value) in _SimpleTypes:
+        return repr(value)
+    if depth > 8:
+        return '...'
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = [_stableRepr(v, depth + 1) for v in value]
+        if isinstance(value, (set, frozenset)):
+            items = sorted(items)
+        return '%s[%s]' % (type(value).__name__, ', '.join(items))
+    if isinstance(value, dict):
+        items = sorted(['%s: %s' % (_stableRepr(k, depth + 1), _stableRepr(v, depth + 1)) for (k, v) in value.items()])
+        return '{%s}' % ', '.join(items)
+    if isinstance(value, (types.FunctionType, types.MethodType, type, types.ClassType)):
+        return '<%s.%s>' % (getattr(value, '__module__', '?'), getattr(value, '__name__', '?'))
+    if isinstance(value, _RegexType):
+        return '<re %s>' % repr(value.pattern)
+    cls = getattr(value, '__class__', type(value))
+    attrs = getattr(value, '__dict__', None)
+    if attrs is not None:
+        return '<%s.%s %s>' % (cls.__module__, cls.__name__, _stableRepr(attrs, depth + 1))
+    return '<%s.%s>' % (cls.__module__, cls.__name__)
+
+
+class BuildStateField(object):
+    '''
+    Builder attribute which is changed during build.
+
+    Builder definition (registered builder object) keeps the initial value.
+    Per-build instance (see BuilderNewStyle.createBuildInstance()) stores
+    modified value in its BuildState object, other attributes are read from definition.
+    '''
+
+    _NO_DEFAULT = object()
+
+    def __init__(self, name, default=_NO_DEFAULT):
+        self.name = name
+        self.default = default
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            if self.default is self._NO_DEFAULT:
+                return self
+            return self.default
+        d = obj.__dict__
+        if self.name in d:  # builder definition
+            return d[self.name]
+        state = d.get('bb_state', None)
+        if state is not None:
+            try:
+                return getattr(state, self.name)
+            except AttributeError:
+                return getattr(d['bb_definition'], self.name)
+        if self.default is self._NO_DEFAULT:
+            raise AttributeError(self.name)
+        return self.default
+
+    def __set__(self, obj, value):
+        state = obj.__dict__.get('bb_state', None)
+        if state is not None:
+            setattr(state, self.name, value)
+        else:
+            obj.__dict__[self.name] = value
+
+    def __delete__(self, obj):
+        state = obj.__dict__.get('bb_state', None)
+        if state is not None:
+            delattr(state, self.name)
+        else:
+            del obj.__dict__[self.name]
+
+
+class BuildState(object):
+    '''
+    Mutable per-build fields of builder. Subclasses with __slots__ are generated
+    for each builder class from its BuildStateField attributes.
+    '''
+    __slots__ = ('__weakref__',)
+
+    @staticmethod
+    def getClass(builderClass):
+        stateClass = builderClass.__dict__.get('_buildStateClass', None)
+        if stateClass is None:
+            fields = set()
+            for c in builderClass.__mro__:
+                for v in vars(c).values():
+                    if isinstance(v, BuildStateField):
+                        fields.add(v.name)
+            stateClass = type(builderClass.__name__ + 'BuildState', (BuildState,), dict(__slots__=tuple(sorted(fields))))
+            builderClass._buildStateClass = stateClass
+        return stateClass
+
+
+# Build states of running builds. It should be empty on idle master, otherwise there is a leak
+_activeBuildStates = weakref.WeakKeyDictionary()  # state -> builder name
+
+
+def getActiveBuildStates():
+    ''' Returns names of builders with alive per-build state objects '''
+    return sorted(_activeBuildStates.values())
+
 
 class _BuildStepDummyFactory():
 
@@ -28,7 +149,7 @@ class BuildFactoryWrapper(BuildFactory):
 
 
     def newBuild(self, requests):
-        clone = copy.copy(self.me_)
+        clone = self.me_.createBuildInstance()
         clone.bb_requests = requests
         assert clone.factorySteps is None
         clone.factorySteps = []
@@ -51,6 +172,14 @@ class BuildFactoryWrapper(BuildFactory):
                 return self.me_.runCleanup()
 
 
+            def buildFinished(self, text, results):
+                supersede.buildFinished(self)
+                worker_reservation.getReservations().buildFinished(self.getSlaveName(), self)
+                res = Build.buildFinished(self, text, results)
+                duration_store.recordBuild(self.build_status, self.getSlaveName())
+                return res
+
+
         self.buildClass = BuildWrapper
 
         self.workdir = clone.workdir
@@ -68,18 +197,27 @@ class BuildFactoryWrapper(BuildFactory):
 
 class BuilderNewStyle(object, PropertiesMixin):
 
-    bb_requests = None  # list of buildbot.process.buildrequest.BuildRequest
-    bb_build = None  #: :type bb_build: buildbot.process.Build
+    bb_requests = BuildStateField('bb_requests', None)  # list of buildbot.process.buildrequest.BuildRequest
+    bb_build = BuildStateField('bb_build', None)  #: :type bb_build: buildbot.process.Build
 
     workdir = '.'
+    workerSelectionPolicy = worker_selection.defaultPolicy  # None - buildbot default (random worker)
+    buildPriorityPolicy = build_priority.defaultPolicy  # None - buildbot default (oldest request first)
+    buildWeight = 1.0  # relative resource usage, see concurrency_controller.py
 
-    factorySteps = None  # old-style static steps
+    factorySteps = BuildStateField('factorySteps', None)  # old-style static steps
+    steps = BuildStateField('steps')
 
     def __code_completion_helper__(self):
         if __debug__:
             self.bb_requests = BuildRequest()
             self.bb_build = Build()
 
+    def __new__(cls, *args, **kwargs):
+        self = object.__new__(cls)
+        self.init_params = (args, dict(kwargs))  # ctor parameters "as is", used by getFingerprint()
+        return self
+
     def __init__(self, **kwargs):
         if not hasattr(self, 'builderName'):
             self.builderName = kwargs.pop('builderName', None)
@@ -93,6 +231,27 @@ class BuilderNewStyle(object, PropertiesMixin):
         assert len(kwargs.keys()) == 0, 'Unknown parameters: ' + ' '.join(kwargs.keys())
 
 
+    def createBuildInstance(self):
+        '''
+        Returns object for new build. It has the same class and reads the builder
+        definition attributes, but changes of BuildStateField attributes are stored
+        in own BuildState object and other changes are stored in own __dict__.
+        '''
+        assert not 'bb_definition' in self.__dict__, 'Per-build instance can\'t be cloned'
+        clone = object.__new__(type(self))
+        state = BuildState.getClass(type(self))()
+        clone.__dict__['bb_definition'] = self
+        clone.__dict__['bb_state'] = state
+        _activeBuildStates[state] = self.getName()
+        return clone
+
+    def __getattr__(self, name):
+        # called for missing attributes only: per-build instance reads builder definition
+        d = self.__dict__
+        if not 'bb_definition' in d or name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(d['bb_definition'], name)
+
     def onNewBuild(self):
         '''
         It is called for cloned self object.
@@ -107,6 +266,16 @@ class BuilderNewStyle(object, PropertiesMixin):
 
     @defer.inlineCallbacks
     def run_(self):
+        if self.workerSelectionPolicy is not None:
+            self.workerSelectionPolicy.buildStarted(self.bb_build.builder, self.bb_build.getSlaveName(),
+                                                    self.bb_requests[0] if self.bb_requests else None)
+        cacheState = worker_selection.getCacheState(self.getName(), self.bb_build.getSlaveName())
+        if cacheState is not None:
+            self.setProperty('worker_cache', cacheState, 'Worker selection')
+        worker_reservation.getReservations().buildStarted(self.bb_build.getSlaveName(), self.bb_build)
+        supersede.buildStarted(self.bb_build)
+        if getattr(self.bb_build, 'stopped', False):
+            return  # superseded
         yield self.runPrepare()
         yield self.run()
         pass
@@ -170,21 +339,67 @@ class BuilderNewStyle(object, PropertiesMixin):
         if buildworker:
             if not isinstance(buildworker, (list, tuple)):
                 buildworker = str(buildworker).split(',')
-            return builder.slave.slavename in buildworker
+            if builder.slave.slavename not in buildworker:
+                return False
+        if worker_reservation.getReservations().isReserved(builder.slave.slavename):
+            print('canStartBuild: {} on {}: worker is reserved'.format(self.getName(), builder.slave.slavename))
+            return False
+        runningBuilders = [sb.builder_name for sb in builder.slave.slavebuilders.values() if sb.isBusy() and sb is not builder]
+        if not concurrency_controller.getController().canStartBuild(builder.slave.slavename, self.getName(), runningBuilders):
+            print('canStartBuild: {} on {}: worker is busy ({})'.format(self.getName(), builder.slave.slavename, ', '.join(runningBuilders)))
+            return False
         return True
 
+    def nextSlave(self, bldr, slavebuilders):
+        return self.workerSelectionPolicy.nextSlave(bldr, slavebuilders)
+
+    def nextBuild(self, bldr, requests):
+        requests = supersede.filterRequests(bldr, requests)
+        if self.buildPriorityPolicy is None:
+            return requests[0] if requests else None
+        return self.buildPriorityPolicy.nextBuild(bldr, requests)
+
+    def getFingerprint(self, name, slavenames, tags, properties):
+        '''
+        Stable hash of builder descriptor: class, ctor parameters, workers, tags and properties
+        '''
+        cls = type(self)
+        desc = _stableRepr([
+            '%s.%s' % (cls.__module__, cls.__name__),
+            self.init_params, name, slavenames, sorted(tags), properties, self.locks
+        ])
+        return hashlib.sha1(desc).hexdigest()
+
     def register(self):
         assert not hasattr(self, 'bb_config')
         self.initConstants()
+        name = self.getName()
+        slavenames = self.getSlaves()
+        tags = list(set(self.getTags()))
+        properties = self.getFactoryProperties(props=self.builder_properties)
+        concurrency_controller.getController().registerBuilder(name, self.buildWeight)
+        fingerprint = self.getFingerprint(name, slavenames, tags, properties)
+        registered = _registeredBuilders.get(name, None)
+        if registered is not None and registered[0] == fingerprint:
+            # unchanged builder: buildbot keeps it as is on reconfig, callbacks are bound to the new descriptor
+            self.bb_config = registered[1]
+            self.bb_config.factory.me_ = self
+            self.bb_config.canStartBuild = self.canStartBuild
+            self.bb_config.nextSlave = self.nextSlave if self.workerSelectionPolicy is not None else None
+            self.bb_config.nextBuild = self.nextBuild
+            return self.bb_config
         self.bb_config = BuilderConfig(
-            name=self.getName(),
-            slavenames=self.getSlaves(),
+            name=name,
+            slavenames=slavenames,
             factory=self.getFactory(),
             mergeRequests=False,
-            tags=list(set(self.getTags())),
-            properties=self.getFactoryProperties(props=self.builder_properties),
+            tags=tags,
+            properties=properties,
             canStartBuild = self.canStartBuild,
+            nextSlave = self.nextSlave if self.workerSelectionPolicy is not None else None,
+            nextBuild = self.nextBuild,
             locks=self.locks)
+        _registeredBuilders[name] = (fingerprint, self.bb_config)
         return self.bb_config
 
     #
@@ -207,6 +422,23 @@ class BuilderNewStyle(object, PropertiesMixin):
         return self.bb_build.addStep(step, insertPosition, addToQueue)
 
 
+    @defer.inlineCallbacks
+    def reserveWorker(self, reason):
+        '''
+        Wait for exclusive use of the worker: other builds are finished, new builds are not started.
+        Released by releaseWorker() or on build finish.
+
+        It is Deferred call, use yield!
+        '''
+        wait = yield worker_reservation.getReservations().reserve(
+                self.bb_build.getSlaveName(), self.bb_build, '%s: %s' % (self.getName(), reason))
+        self.setProperty('exclusive_wait', int(wait), 'Worker reservation')
+
+
+    def releaseWorker(self):
+        worker_reservation.getReservations().release(self.bb_build.getSlaveName(), self.bb_build)
+
+
     def processStep(self, step):
         '''
         Process specified step
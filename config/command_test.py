@@ -1,18 +1,27 @@
+import re
+
+from buildbot.process.buildstep import LogLineObserver
 from buildbot.steps.shell import ShellCommand
 from buildbot.status.results import SUCCESS, FAILURE
 
 class CommandTest(ShellCommand):
     def __init__(self, stage=None, module=None, moduleset=None, **kwargs):
         ShellCommand.__init__(self, **kwargs)
+        self.addLogObserver('stdio', PeakMemoryObserver())
         self.testsLogs = {}
         self.testsPassed = []
         self.testsFailed = []
+        self.testsFlaky = []  # failed test cases which are passed on re-run (see CommandTestCPP)
         self.all_tests_passed = False
         self.disabledTestsCount = 0
+        self.peakRSS = None  # bytes, see test_scheduler.MEMORY_SCRIPT
+        self.testsDurations = {}  # test -> ms
 
     def createSummary(self, log):
-        if len(self.testsFailed) > 0 or len(self.testsPassed) > 0:
+        if len(self.testsFailed) > 0 or len(self.testsPassed) > 0 or len(self.testsFlaky) > 0:
             self.addHTMLLog('tests summary', self.createTestsSummary())
+        if len(self.testsDurations) > 0:
+            self.addCompleteLog('tests durations', ''.join(['%d ms\t%s\n' % (ms, name) for (name, ms) in self.getSlowestTests()]))
 
     def describe(self, done=False):
         if done:
@@ -31,12 +40,19 @@ class CommandTest(ShellCommand):
             return "<br/>".join(self.testsLogs[id])
         return ""
 
-    def addFinishedTest(self, name, log = [], passed = True):
+    def addFinishedTest(self, name, log = [], passed = True, duration = None):
         if passed:
             self.testsPassed.append(name)
         else:
             self.testsFailed.append(name)
             self.testsLogs[name] = list(log)
+        if duration is not None:
+            self.testsDurations[name] = duration
+
+    def getSlowestTests(self, count=None):
+        ''' List of (test, ms), the slowest first '''
+        res = sorted(self.testsDurations.items(), key=lambda t: (-t[1], t[0]))
+        return res[:count] if count is not None else res
 
     def evaluateCommand(self, cmd):
         r = ShellCommand.evaluateCommand(self, cmd)
@@ -54,9 +70,12 @@ class CommandTest(ShellCommand):
         # Create a string with your html report and return it
         passed = len(self.testsPassed)
         failed = len(self.testsFailed)
+        flaky = len(self.testsFlaky)
         s = ""
-        s += "Total tests:  " + str(passed + failed) + "<br>"
+        s += "Total tests:  " + str(passed + failed + flaky) + "<br>"
         s += "Tests failed: " + str(failed) + "<br>"
+        if flaky > 0:
+            s += "Tests flaky (passed on re-run): " + str(flaky) + "<br>"
         s += "Tests passed: " + str(passed) + "<br>"
         if (self.disabledTestsCount > 0):
             s += "Disabled: %d" % self.disabledTestsCount + "<br><br>"
@@ -89,4 +108,19 @@ class CommandTest(ShellCommand):
         else:
             s += '<font color="red" size=+1> Exception has been thrown. Please see stdio log. </font>'
 
+        if len(self.testsDurations) > 0:
+            s += "Slowest tests (first 10): <br>"
+            s += "<ul>"
+            for (testname, ms) in self.getSlowestTests(10):
+                s += "<li>%s: %.1f s\n" % (testname, ms / 1000.0)
+            s += "</ul><br>"
+
         return s
+
+class PeakMemoryObserver(LogLineObserver):
+    peak_rss = re.compile(r'^TEST-PEAK-RSS (\d+)')  # test_scheduler.MEMORY_MARKER
+
+    def errLineReceived(self, line):
+        result = self.peak_rss.search(line.strip())
+        if result:
+            self.step.peakRSS = int(result.group(1))
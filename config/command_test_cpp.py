@@ -1,22 +1,38 @@
 import re
 
-from buildbot.process.buildstep import LogLineObserver
-from buildbot.status.results import SUCCESS, FAILURE
+from twisted.internet import defer
+
+from buildbot.process.buildstep import LogLineObserver, RemoteShellCommand
+from buildbot.status.results import SUCCESS, WARNINGS, FAILURE
 from command_test import CommandTest
+import test_flakiness
 
 class CommandTestCPP(CommandTest):
-    def __init__(self, **kwargs):
+    def __init__(self, retryFailedTests=0, **kwargs):
+        '''
+        retryFailedTests - max number of failed test cases which are re-run with --gtest_filter (0 - no re-run).
+                           Step result is WARNINGS ("flaky") if all of them pass on re-run.
+        '''
         CommandTest.__init__(self, **kwargs)
         self.addLogObserver('stdio', GoogleUnitTestsObserver())
         self.addLogObserver('stdio', ValgrindObserver())
+        self.addLogObserver('re-run', GoogleUnitTestsObserver(rerun=True))
         self.caseCount = 0
         self.testCount = 0
         self.valgrindSummary = ""
         self.valgrindErrors = 0
         self.valgrindLog = []
+        self.retryFailedTests = retryFailedTests
+        self.rerunPassed = []
+        self.rerunFailed = []
+        self.rerun_tests_passed = False
+        self.flakyTests = {}  # test -> flaky runs during last days (see test_flakiness.py)
+        self.testsSummaryDeferred = False
 
     def createSummary(self, log):
-        CommandTest.createSummary(self, log)
+        self.testsSummaryDeferred = self.canRerunFailedTests()  # tests summary is created after re-run
+        if not self.testsSummaryDeferred:
+            CommandTest.createSummary(self, log)
         if len(self.valgrindSummary) > 0 or len(self.valgrindLog) > 0:
             self.addHTMLLog('valgrind summary', "<pre>%s</pre>" % "\n".join(self.valgrindLog))
 
@@ -26,10 +42,16 @@ class CommandTestCPP(CommandTest):
             res.insert(1, "cases (tests): %d (%d) ;" % (self.caseCount, self.testCount))
             if self.valgrindErrors > 0:
                 res.append("valgrind issues: %d ;" % self.valgrindErrors)
+            if self.testsFlaky:
+                res.append("flaky (passed on re-run): %d ;" % len(self.testsFlaky))
         return res
 
     def evaluateCommand(self, cmd):
         r = CommandTest.evaluateCommand(self, cmd)
+        if r == FAILURE and self.canRerunFailedTests():
+            return self.rerunFailedTests(cmd)
+        if self.testsSummaryDeferred:
+            CommandTest.createSummary(self, None)
         if r != SUCCESS:
             return r
         if self.valgrindErrors > 0:
@@ -37,19 +59,81 @@ class CommandTestCPP(CommandTest):
         else:
             return SUCCESS
 
+    @staticmethod
+    def getTestCaseName(name):
+        return name.split(' [')[0]  # strip parameters of failed perf tests
+
+    def canRerunFailedTests(self):
+        ''' Only completed gtest runs with a few failed test cases are re-run (no crashes / timeouts) '''
+        failed = set([self.getTestCaseName(t) for t in self.testsFailed])
+        return self.all_tests_passed and self.valgrindErrors == 0 and 0 < len(failed) <= self.retryFailedTests and \
+            isinstance(self.command, (str, unicode, list))
+
+    def getRerunCommand(self, tests):
+        ''' Command with --gtest_filter of failed test cases, XML results are written into separate file '''
+        def update(arg):
+            return re.sub(r'(--gtest_output=xml:\S+?)(\.xml)?(?=\s|$)', lambda m: m.group(1) + '-rerun.xml', arg)
+        gtestFilter = '--gtest_filter=' + ':'.join(tests)
+        if isinstance(self.command, list):
+            return [update(arg) for arg in self.command] + [gtestFilter]
+        return update(self.command) + ' ' + gtestFilter  # the last --gtest_filter is used by gtest
+
+    @defer.inlineCallbacks
+    def rerunFailedTests(self, cmd):
+        tests = sorted(set([self.getTestCaseName(t) for t in self.testsFailed]))
+        kwargs = self.buildCommandKwargs(None)
+        kwargs['command'] = self.getRerunCommand(tests)
+        kwargs['env'] = dict([(k, v) for (k, v) in (kwargs.get('env', None) or {}).items()
+                              if k not in ['GTEST_SHARD_INDEX', 'GTEST_TOTAL_SHARDS']])  # run all re-run tests
+        kwargs['logfiles'] = {}
+        rerun = RemoteShellCommand(**kwargs)
+        rerun.useLog(self.addLog('re-run'), True, 'stdio')
+        try:
+            yield self.runCommand(rerun)
+        except Exception as e:
+            self.addCompleteLog('re-run error', str(e))
+            CommandTest.createSummary(self, None)
+            defer.returnValue(FAILURE)
+        passed = set([self.getTestCaseName(t) for t in self.rerunPassed])
+        failed = set([self.getTestCaseName(t) for t in self.rerunFailed])
+        flaky = [t for t in tests if t in passed and t not in failed]
+        self.flakyTests = test_flakiness.recordReruns(self, flaky, [t for t in tests if t not in flaky])
+        # test cases which are passed on re-run are not counted as failed
+        self.testsFlaky = [t for t in self.testsFailed if self.getTestCaseName(t) in flaky]
+        self.testsFailed = [t for t in self.testsFailed if self.getTestCaseName(t) not in flaky]
+        CommandTest.createSummary(self, None)
+        if flaky:
+            self.addHTMLLog('flaky tests', self.createFlakyTestsSummary())
+        if rerun.rc == 0 and self.rerun_tests_passed and not self.testsFailed:
+            defer.returnValue(WARNINGS)
+        defer.returnValue(FAILURE)
+
+    def createFlakyTestsSummary(self):
+        s = "Failed test cases are passed on re-run (--gtest_filter):<br><ul>"
+        for test in sorted(set([self.getTestCaseName(t) for t in self.testsFlaky])):
+            count = self.flakyTests.get(test, 0)
+            s += "<li>%s" % test
+            if count >= test_flakiness.FlakinessStore.REPEAT_MIN_FLAKES:
+                s += " <font color='red'>(repeatedly flaky: %d times during last %d days)</font>" % (
+                        count, test_flakiness.FlakinessStore.REPEAT_DAYS)
+            s += '\n'
+        s += "</ul>"
+        return s
+
 class GoogleUnitTestsObserver(LogLineObserver):
     test_started = re.compile(r'\[ RUN      \] (\S+)')
-    test_failed =       re.compile(r'\[  FAILED  \] (\S+) \(\d+ ms\)')
-    test_failed_perf =  re.compile(r'\[  FAILED  \] (\S+), where GetParam\(\) = \((.+)\) \(\d+ ms\)')
-    test_passed =  re.compile(r'\[       OK \] (\S+) \(\d+ ms\)')
+    test_failed =       re.compile(r'\[  FAILED  \] (\S+) \((\d+) ms\)')
+    test_failed_perf =  re.compile(r'\[  FAILED  \] (\S+), where GetParam\(\) = \((.+)\) \((\d+) ms\)')
+    test_passed =  re.compile(r'\[       OK \] (\S+) \((\d+) ms\)')
 
     test_stat_success = re.compile(r'\[  PASSED  \] \d+ (?:test|tests)\.')
     test_stat_total = re.compile(r'\[==========\] (\d+) (?:test|tests) from (\d+) test (?:case|cases) ran\. \((\d+) ms total\)')
     test_stat_disabled = re.compile(r'YOU HAVE (\d+) DISABLED TEST')
 
-    def __init__(self):
+    def __init__(self, rerun=False):
         LogLineObserver.__init__(self)
         self.testLog = []
+        self.rerun = rerun  # re-run of failed test cases (CommandTestCPP.rerunFailedTests)
 
     def outLineReceived(self, line):
         # Test start
@@ -62,22 +146,34 @@ class GoogleUnitTestsObserver(LogLineObserver):
         result = self.test_failed.search(line) or self.test_failed_perf.search(line)
         if result:
             name = result.groups()[0]
-            if len(result.groups()) > 1:
+            if len(result.groups()) > 2:
                 name += " [" + result.groups()[1] + "]"
-            self.step.addFinishedTest(name, self.testLog, passed=False)
+            if self.rerun:
+                self.step.rerunFailed.append(name)
+            else:
+                self.step.addFinishedTest(name, self.testLog, passed=False, duration=int(result.groups()[-1]))
             return
 
         # Test passed
         result = self.test_passed.search(line)
         if result:
             name = result.group(1)
-            self.step.addFinishedTest(name, self.testLog, passed=True)
+            if self.rerun:
+                self.step.rerunPassed.append(name)
+            else:
+                self.step.addFinishedTest(name, self.testLog, passed=True, duration=int(result.group(2)))
             return
 
         # Determine if tests passed
         result = self.test_stat_success.search(line)
         if result:
-            self.step.all_tests_passed = True
+            if self.rerun:
+                self.step.rerun_tests_passed = True
+            else:
+                self.step.all_tests_passed = True
+            return
+
+        if self.rerun:
             return
 
         # Gather disabled tests count
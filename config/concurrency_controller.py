@@ -0,0 +1,150 @@
+'''
+Adaptive per-worker concurrency (builds and parallel tests).
+
+Limits are configured via constants.worker_concurrency as (min, max) bounds.
+Effective values start from constants.worker settings and are changed by resource samples
+(load average and available memory), which are reported by the 'worker load' build step:
+- pressure (high load per CPU or low free memory) decreases build capacity and tests parallelism,
+- idle worker increases them back up to configured maximum.
+
+Build capacity is compared with sum of weights of running builds (BuilderNewStyle.buildWeight),
+so several light builds (docs) can share a worker while heavy builds (coverage) can't.
+'''
+import json
+import time
+
+import constants
+from constants import trace
+
+# Python script for worker (it runs buildbot slave, so Python interpreter is available there)
+SAMPLE_SCRIPT = r'''
+import json, os, sys
+res = {}
+try:
+    res['load'] = os.getloadavg()[0]
+except (AttributeError, OSError):
+    pass
+try:
+    with open('/proc/meminfo') as f:
+        mem = dict([(l.split(':')[0], int(l.split()[1])) for l in f if len(l.split()) >= 2])
+    res['mem_total'] = mem['MemTotal'] * 1024
+    res['mem_available'] = mem.get('MemAvailable', mem.get('MemFree', 0)) * 1024
+except (IOError, KeyError, ValueError):
+    pass
+sys.stderr.write('BUILD-PROP worker_load=' + json.dumps(res) + '\n')
+'''
+
+SAMPLE_PROPERTY = 'ci-worker_load'  # see buildprops_observer.py
+
+
+class WorkerState(object):
+
+    def __init__(self, name, bounds):
+        self.name = name
+        settings = constants.worker.get(name, {})
+        properties = settings.get('properties', {})
+        self.cpus = properties.get('CPUs', 1)
+        self.buildBounds = bounds.get('max_builds', (settings.get('max_builds', 1),) * 2)
+        self.testBounds = bounds.get('parallel_tests', None)
+        self.capacity = float(_clamp(settings.get('max_builds', 1), self.buildBounds))
+        parallelTests = properties.get('parallel_tests-default', properties.get('parallel_tests', None))
+        self.parallelTests = _clamp(parallelTests, self.testBounds) if self.testBounds and parallelTests else None
+        self.lastSample = None
+        self.lastSampleTime = None
+
+
+def _clamp(value, bounds):
+    return max(bounds[0], min(bounds[1], value))
+
+
+class ConcurrencyController(object):
+
+    HIGH_LOAD_PER_CPU = 1.5
+    LOW_LOAD_PER_CPU = 0.5
+    LOW_MEMORY = 0.15  # available / total
+    HIGH_MEMORY = 0.4
+    CAPACITY_STEP = 0.5
+
+    def __init__(self, config=None):
+        self.config = constants.worker_concurrency if config is None else config
+        self.workers = {}
+        self.builderWeights = {}  # builder name -> weight
+
+    def isEnabled(self, worker):
+        return worker in self.config
+
+    def getWorker(self, worker):
+        state = self.workers.get(worker, None)
+        if state is None:
+            state = self.workers[worker] = WorkerState(worker, self.config[worker])
+        return state
+
+    def registerBuilder(self, name, weight):
+        self.builderWeights[name] = weight
+
+    def getBuilderWeight(self, name):
+        return self.builderWeights.get(name, 1.0)
+
+    def addSample(self, worker, sample):
+        if not self.isEnabled(worker) or not sample:
+            return
+        if isinstance(sample, basestring):
+            sample = json.loads(sample)
+        state = self.getWorker(worker)
+        state.lastSample = sample
+        state.lastSampleTime = time.time()
+
+        pressure = False
+        idle = True
+        load = sample.get('load', None)
+        if load is not None:
+            loadPerCPU = load / float(state.cpus)
+            pressure = pressure or loadPerCPU > self.HIGH_LOAD_PER_CPU
+            idle = idle and loadPerCPU < self.LOW_LOAD_PER_CPU
+        if sample.get('mem_total', None):
+            memory = sample.get('mem_available', 0) / float(sample['mem_total'])
+            pressure = pressure or memory < self.LOW_MEMORY
+            idle = idle and memory > self.HIGH_MEMORY
+
+        (capacity, parallelTests) = (state.capacity, state.parallelTests)
+        if pressure:
+            state.capacity = max(float(state.buildBounds[0]), state.capacity - self.CAPACITY_STEP)
+            if state.parallelTests is not None:
+                state.parallelTests = _clamp(state.parallelTests - 1, state.testBounds)
+        elif idle:
+            state.capacity = min(float(state.buildBounds[1]), state.capacity + self.CAPACITY_STEP)
+            if state.parallelTests is not None:
+                state.parallelTests = _clamp(state.parallelTests + 1, state.testBounds)
+        if (capacity, parallelTests) != (state.capacity, state.parallelTests):
+            trace('Concurrency of %s: builds capacity %.1f -> %.1f, parallel tests %s -> %s (sample: %s)' % (
+                    worker, capacity, state.capacity, parallelTests, state.parallelTests, sample))
+
+    def canStartBuild(self, worker, builderName, runningBuilders):
+        ''' runningBuilders - names of builders with running builds on the worker '''
+        if not self.isEnabled(worker) or not runningBuilders:
+            return True
+        state = self.getWorker(worker)
+        weight = sum([self.getBuilderWeight(n) for n in runningBuilders]) + self.getBuilderWeight(builderName)
+        return weight <= state.capacity + 1e-6
+
+    def getParallelTests(self, worker, default):
+        if not self.isEnabled(worker):
+            return default
+        parallelTests = self.getWorker(worker).parallelTests
+        return parallelTests if parallelTests is not None else default
+
+    def getMaxBuilds(self, worker, default):
+        ''' Upper bound for BuildSlave(max_builds=...) '''
+        if not self.isEnabled(worker):
+            return default
+        return self.getWorker(worker).buildBounds[1]
+
+
+_controller = None
+
+
+def getController():
+    global _controller
+    if _controller is None:
+        _controller = ConcurrencyController()
+    return _controller
@@ -14,6 +14,11 @@ worker = {  # worker passwords are stored in the other place
     'windows-pack' : { 'max_builds' : 1, 'properties' : { 'CPUs' : 1, 'parallel_tests' : 1 } },
 }
 
+worker_concurrency = {  # adaptive (min, max) limits, see concurrency_controller.py
+    'linux-1' : { 'max_builds' : (1, 2), 'parallel_tests' : (1, 3) },
+    'linux-2' : { 'max_builds' : (1, 2), 'parallel_tests' : (2, 4) },
+}
+
 PLATFORM_ANY = 'any'
 PLATFORM_DEFAULT = 'default'
 PLATFORM_SKYLAKE = 'skl'
@@ -0,0 +1,177 @@
+'''
+Historical durations of builds and build steps.
+
+Durations are stored into SQLite database next to buildbot state.sqlite
+(one row per finished step, BUILD step name for the whole build).
+Peak RSS of test steps is stored into the same database (see test_scheduler.MemoryAdmission),
+as well as durations of the slowest test cases of test steps (see CommandTest.getSlowestTests).
+
+    import duration_store
+    duration_store.getStore().getPercentiles('precommit_linux64', 'test_core')  # {50: ..., 90: ...}
+'''
+import os
+import time
+
+from constants import trace
+import history_store
+
+DB_PATH = os.environ.get('BUILDBOT_DURATIONS_DB', '/data/db/durations.sqlite')
+BUILD = '__build__'  # step name for whole build duration
+
+
+class DurationStore(history_store.SQLiteStore):
+
+    HISTORY_LIMIT = 50  # last N records are used for percentiles
+    KEEP_DAYS = 180
+
+    def __init__(self, path=DB_PATH):
+        history_store.SQLiteStore.__init__(self, path)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS durations (
+            id INTEGER PRIMARY KEY,
+            builder TEXT NOT NULL,
+            step TEXT NOT NULL,
+            worker TEXT,
+            buildnumber INTEGER,
+            result INTEGER,
+            finished_at REAL NOT NULL,
+            duration REAL NOT NULL,
+            worker_cache TEXT)''')  # see worker_selection.py
+        columns = [r[1] for r in self.db.execute('PRAGMA table_info(durations)')]
+        if 'worker_cache' not in columns:  # database from previous version
+            self.db.execute('ALTER TABLE durations ADD COLUMN worker_cache TEXT')
+        self.db.execute('CREATE INDEX IF NOT EXISTS durations_builder_step ON durations (builder, step, finished_at)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS durations_step ON durations (step, finished_at)')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS peak_memory (
+            id INTEGER PRIMARY KEY,
+            builder TEXT NOT NULL,
+            step TEXT NOT NULL,
+            worker TEXT,
+            finished_at REAL NOT NULL,
+            peak_rss INTEGER NOT NULL)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS peak_memory_builder_step ON peak_memory (builder, step, finished_at)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS peak_memory_step ON peak_memory (step, finished_at)')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS test_durations (
+            id INTEGER PRIMARY KEY,
+            builder TEXT NOT NULL,
+            step TEXT NOT NULL,
+            test TEXT NOT NULL,
+            buildnumber INTEGER,
+            finished_at REAL NOT NULL,
+            duration REAL NOT NULL)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS test_durations_builder_step ON test_durations (builder, step, finished_at)')
+        self.db.commit()
+        self.submit(self._cleanup)
+
+    def _cleanup(self):
+        for table in ['durations', 'peak_memory', 'test_durations']:
+            self.execute('DELETE FROM %s WHERE finished_at < ?' % table, [(time.time() - self.KEEP_DAYS * 24 * 3600,)])
+
+    def record(self, builder, step, duration, worker=None, buildnumber=None, result=None, finishedAt=None, workerCache=None):
+        self.recordMany([(builder, step, duration, worker, buildnumber, result, finishedAt, workerCache)])
+
+    def recordMany(self, rows):
+        ''' rows: list of (builder, step, duration, worker, buildnumber, result, finishedAt, workerCache) '''
+        now = time.time()
+        self.submit(self.execute, 'INSERT INTO durations (builder, step, duration, worker, buildnumber, result, finished_at, worker_cache) '
+                                  'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    [tuple(r[:6]) + (r[6] or now, r[7]) for r in rows])
+
+    def getDurations(self, builder=None, step=BUILD, worker=None, limit=None, results=(0, 1), workerCache=None):
+        '''
+        Last durations (newest first). builder=None - all builders.
+        By default only SUCCESS/WARNINGS results are used (failed steps are usually shorter).
+        '''
+        query = 'SELECT duration FROM durations WHERE step = ?'
+        args = [step]
+        if builder is not None:
+            query += ' AND builder = ?'
+            args.append(builder)
+        if worker is not None:
+            query += ' AND worker = ?'
+            args.append(worker)
+        if workerCache is not None:
+            query += ' AND worker_cache = ?'
+            args.append(workerCache)
+        if results is not None:
+            query += ' AND result IN (%s)' % ', '.join(['?'] * len(results))
+            args += list(results)
+        query += ' ORDER BY finished_at DESC LIMIT ?'
+        args.append(limit or self.HISTORY_LIMIT)
+        return [r[0] for r in self.query(query, args)]
+
+    def getBuilds(self, since, until):
+        ''' Builds finished in [since, until): list of (builder, worker, finished_at, duration, result) '''
+        return self.query('SELECT builder, worker, finished_at, duration, result FROM durations '
+                          'WHERE step = ? AND finished_at >= ? AND finished_at < ? ORDER BY finished_at',
+                          (BUILD, since, until))
+
+    def recordPeakMemory(self, builder, step, peakRSS, worker=None, finishedAt=None):
+        self.submit(self.execute, 'INSERT INTO peak_memory (builder, step, worker, finished_at, peak_rss) VALUES (?, ?, ?, ?, ?)',
+                    [(builder, step, worker, finishedAt or time.time(), int(peakRSS))])
+
+    def getPeakMemory(self, builder=None, step=BUILD, limit=None):
+        ''' 90th percentile of last peak RSS values of step (bytes) or None. builder=None - all builders '''
+        query = 'SELECT peak_rss FROM peak_memory WHERE step = ?'
+        args = [step]
+        if builder is not None:
+            query += ' AND builder = ?'
+            args.append(builder)
+        query += ' ORDER BY finished_at DESC LIMIT ?'
+        args.append(limit or self.HISTORY_LIMIT)
+        values = sorted([r[0] for r in self.query(query, args)])
+        return history_store.percentile(values, 90) if values else None
+
+    def recordTestDurations(self, builder, step, tests, buildnumber=None, finishedAt=None):
+        ''' tests: list of (test, duration) '''
+        finishedAt = finishedAt or time.time()
+        self.submit(self.execute, 'INSERT INTO test_durations (builder, step, test, buildnumber, finished_at, duration) '
+                                  'VALUES (?, ?, ?, ?, ?, ?)',
+                    [(builder, step, test, buildnumber, finishedAt, duration) for (test, duration) in tests])
+
+    def getSlowestTests(self, builder, step, limit=10, days=30):
+        ''' Slowest test cases of step during last days: list of (test, average duration, builds) '''
+        return self.query('SELECT test, AVG(duration), COUNT(*) FROM test_durations '
+                          'WHERE builder = ? AND step = ? AND finished_at >= ? '
+                          'GROUP BY test ORDER BY AVG(duration) DESC LIMIT ?',
+                          (builder, step, time.time() - days * 24 * 3600, limit))
+
+    def getPercentiles(self, builder=None, step=BUILD, percentiles=(50, 90), **kwargs):
+        ''' Returns {percentile: duration} or None if there is no history '''
+        durations = sorted(self.getDurations(builder, step, **kwargs))
+        if not durations:
+            return None
+        return dict([(p, history_store.percentile(durations, p)) for p in percentiles])
+
+    def getP50(self, builder=None, step=BUILD, **kwargs):
+        res = self.getPercentiles(builder, step, (50,), **kwargs)
+        return res[50] if res else None
+
+    def getP90(self, builder=None, step=BUILD, **kwargs):
+        res = self.getPercentiles(builder, step, (90,), **kwargs)
+        return res[90] if res else None
+
+
+def getStore(path=DB_PATH):
+    return history_store.getStore(DurationStore, path)
+
+
+def recordBuild(build_status, worker=None):
+    ''' Store durations of finished build and its steps, errors are logged only '''
+    try:
+        builder = build_status.getBuilder().getName()
+        number = build_status.getNumber()
+        workerCache = build_status.getProperties().getProperty('worker_cache', None)
+        rows = []
+        for step in build_status.getSteps():
+            (start, end) = step.getTimes()
+            if start is None or end is None:
+                continue  # skipped or not started step
+            rows.append((builder, step.getName(), end - start, worker, number, step.getResults()[0], end, workerCache))
+        (start, end) = build_status.getTimes()
+        end = end or time.time()
+        if start is not None:
+            rows.append((builder, BUILD, end - start, worker, number, build_status.getResults(), end, workerCache))
+        getStore().recordMany(rows)
+    except:
+        import traceback
+        trace('Can\'t store build durations: %s' % traceback.format_exc())
@@ -1,4 +1,6 @@
+import inspect
 import os
+import time
 
 import constants
 from constants import trace
@@ -8,7 +10,7 @@ from constants import trace
 #     variate=[
 #         dict(branch=['master', '2.4']),
 #         dict(isWin=[True, False]),
-#         dict(is64=lambda params: [True, False] if params['isWin'] else [True]),
+#         dict(is64=lambda isWin, **params: [True, False] if isWin else [True]),
 #     ])
 # will provide:
 # {'is64': True, 'isPrecommit': False, 'branch': 'master', 'isWin': True}
@@ -18,36 +20,144 @@ from constants import trace
 # {'is64': False, 'isPrecommit': False, 'branch': '2.4', 'isWin': True}
 # {'is64': True, 'isPrecommit': False, 'branch': '2.4', 'isWin': False}
 #
+# Variate callables receive already assigned parameters (init_params and previous
+# variate entries) as keyword arguments and return list of values.
+# Results are cached by values of parameters which callable really reads:
+# named arguments and params.get('name') / params['name'] lookups.
+# Variate entries are checked as soon as their inputs are known, so empty
+# value lists cut whole subtree instead of being discovered on each leaf.
+#
 def ParametersGenerator(init_params, variate):
-    from pprint import pprint
-    pprint(init_params)
-    pprint(variate)
-    size = len(variate)
-    state = size * [-1]
-    pos = 0
-    while True:
-        if pos == -1:
-            break
-        if pos == 0:
-            params = init_params.copy()
-        vset = variate[pos]
-        assert len(vset.keys()) == 1
-        pname = vset.keys()[0]
-        pval = vset[pname]
-        if hasattr(pval, '__call__'):
-            pval = pval(**params)
-        elif (hasattr(pval, '__name__') and pval.__name__ == '<lambda>'):
-            pval = pval(params)
-        state[pos] += 1
-        if (state[pos] >= len(pval)):
-            state[pos] = -1
-            pos -= 1
-            continue
-        params[pname] = pval[state[pos]]
-        if pos == size - 1:
+    return ParametersExpander(init_params, variate).generate()
+
+
+def _getCallableDependencies(fn, names):
+    '''
+    Returns set of parameter names which can be read by variate callable
+    or None if it can't be determined (no caching for such callables).
+    '''
+    code = getattr(fn, '__code__', None)
+    if code is None:
+        return None
+    try:
+        (args, varargs, keywords, defaults) = inspect.getargspec(fn)[:4]
+    except TypeError:
+        return None
+    if varargs is not None:
+        return None
+    deps = set(args)
+    if keywords is not None:
+        # kwargs dictionary is accessed via constant keys
+        codes = [code]
+        while codes:
+            c = codes.pop()
+            for const in c.co_consts:
+                if hasattr(const, 'co_consts'):
+                    codes.append(const)
+                elif isinstance(const, str) and const in names:
+                    deps.add(const)
+    return deps
+
+
+class ParametersExpander(object):
+
+    def __init__(self, init_params, variate):
+        self.init_params = init_params
+        self.variate = []
+        for vset in variate:
+            assert len(vset.keys()) == 1
+            pname = list(vset.keys())[0]
+            self.variate.append((pname, vset[pname]))
+        self.cache = {}
+        self.nodes = 0  # evaluated (partial) combinations
+        self.calls = 0  # variate callables invocations
+        self.cacheHits = 0
+        self.results = 0
+
+        # visible parameters: init_params + previous variate entries
+        size = len(self.variate)
+        names = set(init_params.keys())
+        self.deps = []
+        self.earliest = []  # position after which all inputs are assigned
+        for pos in range(size):
+            (pname, pval) = self.variate[pos]
+            if hasattr(pval, '__call__'):
+                deps = _getCallableDependencies(pval, names)
+            else:
+                deps = set()
+            if deps is not None:
+                deps = tuple(sorted(deps & names))
+                earliest = 0
+                for p in range(pos):
+                    if self.variate[p][0] in deps:
+                        earliest = p + 1
+            else:
+                earliest = pos
+            self.deps.append(deps)
+            self.earliest.append(earliest)
+            names.add(pname)
+        self.lookahead = [[] for _ in range(size + 1)]
+        for pos in range(size):
+            if self.earliest[pos] < pos:
+                self.lookahead[self.earliest[pos]].append(pos)
+
+
+    def getValues(self, pos, params):
+        (pname, pval) = self.variate[pos]
+        if not hasattr(pval, '__call__'):
+            return pval
+        deps = self.deps[pos]
+        key = None
+        if deps is not None:
+            key = (pos,) + tuple(params.get(n, None) for n in deps)
+            try:
+                res = self.cache.get(key, None)
+            except TypeError:  # unhashable parameter value
+                key = None
+                res = None
+            if res is not None:
+                self.cacheHits += 1
+                return res
+        self.calls += 1
+        res = pval(**params)
+        if key is not None:
+            self.cache[key] = res
+        return res
+
+
+    def isDeadBranch(self, pos, params):
+        for p in self.lookahead[pos]:
+            if len(self.getValues(p, params)) == 0:
+                return True
+        return False
+
+
+    def generate(self):
+        start_time = time.time()
+        params = self.init_params.copy()
+        if not self.isDeadBranch(0, params):
+            for res in self._generate(0, params):
+                self.results += 1
+                yield res
+        trace("ParametersGenerator: %d builders (%d combinations, %d calls, %d cached) in %.1f ms: %s" %
+                (self.results, self.nodes, self.calls, self.cacheHits, (time.time() - start_time) * 1000,
+                 ', '.join([v[0] for v in self.variate])))
+
+
+    def _generate(self, pos, params):
+        if pos == len(self.variate):
             yield params.copy()
-        else:
-            pos += 1
+            return
+        pname = self.variate[pos][0]
+        for value in self.getValues(pos, params):
+            self.nodes += 1
+            params[pname] = value
+            if not self.isDeadBranch(pos + 1, params):
+                for res in self._generate(pos + 1, params):
+                    yield res
+        params.pop(pname, None)
+        if pname in self.init_params:
+            params[pname] = self.init_params[pname]
 
 
 class SetOfBuilders(object):
@@ -107,6 +217,8 @@ class SetOfBuildersWithSchedulers():
         self.nightlyHour = kwargs.pop('nightlyHour', None)
         self.nightlyMinute = kwargs.pop('nightlyMinute', None)
         self.dayOfWeek = kwargs.pop('dayOfWeek', "*")
+        self.nightlyPlanner = kwargs.pop('nightlyPlanner', None)  # see nightly_planner.py
+        self.nightlyWindow = kwargs.pop('nightlyWindow', 60)  # minutes
         self.builders = kwargs.pop('builders', None)
         assert self.builders
         assert self.branch or self.genTrigger
@@ -135,6 +247,13 @@ class SetOfBuildersWithSchedulers():
 
         builderNames = [b.bb_config.name for b in builders]
 
+        if self.genNightly:
+            # used by build_priority policy
+            scheduleTag = 'nightly' if self.dayOfWeek == '*' else 'weekly'
+            for b in builders:
+                if scheduleTag not in b.bb_config.tags:
+                    b.bb_config.tags.append(scheduleTag)
+
         schedulers = []
 
         from buildbot.schedulers.forcesched import ForceScheduler
@@ -158,12 +277,28 @@ class SetOfBuildersWithSchedulers():
                                              codebases=codebase.getCodebase()))
         if self.genNightly and not os.environ.get('DEBUG', False) and not os.environ.get('BUILDBOT_MANUAL', False):
             pref = 'nightly_' if self.dayOfWeek == '*' else 'daily_%s_' % self.dayOfWeek
-            builderNamesNightly = [b.bb_config.name for b in builders if getattr(b, 'schedulerNightly', None) != False]
-            schedulers.append(Nightly(hour='*' if self.nightlyHour is None else self.nightlyHour,
-                                      minute=0 if self.nightlyMinute is None else self.nightlyMinute,
-                                      dayOfWeek = self.dayOfWeek,
-                                      name=self.nameprefix + pref + branch, builderNames=builderNamesNightly,
-                                      codebases=codebase.getCodebase(), branch=None))
+            nightlyBuilders = [b for b in builders if getattr(b, 'schedulerNightly', None) != False]
+            builderNamesNightly = [b.bb_config.name for b in nightlyBuilders]
+            if self.nightlyPlanner is None or self.nightlyHour is None:
+                schedulers.append(Nightly(hour='*' if self.nightlyHour is None else self.nightlyHour,
+                                          minute=0 if self.nightlyMinute is None else self.nightlyMinute,
+                                          dayOfWeek = self.dayOfWeek,
+                                          name=self.nameprefix + pref + branch, builderNames=builderNamesNightly,
+                                          codebases=codebase.getCodebase(), branch=None))
+            else:
+                plan = self.nightlyPlanner.plan(nightlyBuilders, self.nightlyHour, self.nightlyMinute or 0,
+                                                self.nightlyWindow, self.dayOfWeek)
+                for (start, names) in sorted(plan.items()):
+                    dayOfWeek = self.dayOfWeek
+                    if start >= 24 * 60 and dayOfWeek != '*':
+                        dayOfWeek = (int(dayOfWeek) + 1) % 7
+                    name = self.nameprefix + pref + branch
+                    if start != min(plan.keys()):  # the first scheduler keeps original name
+                        name += '-%02d%02d' % ((start // 60) % 24, start % 60)
+                    schedulers.append(Nightly(hour=(start // 60) % 24, minute=start % 60,
+                                              dayOfWeek=dayOfWeek,
+                                              name=name, builderNames=names,
+                                              codebases=codebase.getCodebase(), branch=None))
         if self.genTrigger:
             schedulers.append(Triggerable(name=self.nameprefix + 'trigger' + ('_' + branch if branch is not None else ''),
                 builderNames=builderNames, codebases=codebase.getCodebase()))
@@ -1,4 +1,5 @@
 import datetime
+import json
 import os
 import re
 
@@ -22,12 +23,17 @@ from command_test_cpp import CommandTestCPP
 from command_test_java import CommandTestJava
 from command_test_py import CommandTestPy
 
-from builder_newstyle import BuilderNewStyle
+from builder_newstyle import BuilderNewStyle, BuildStateField
 
 from build_utils import *
 from constants import PLATFORM_ANY, PLATFORM_DEFAULT, PLATFORM_SKYLAKE, PLATFORM_SKYLAKE_X, PLATFORM_ROCKETLAKE
 
 from buildprops_observer import BuildPropertiesObserver
+import concurrency_controller
+import duration_store
+import perf_history
+import test_impact
+import test_scheduler
 
 # for separate 'python2' and 'pyhton3' tests
 def isPythonTest(t):
@@ -85,26 +91,43 @@ validBranches = [
 
 class CommonFactory(BuilderNewStyle):
 
-    SRC_OPENCV = 'opencv'
-    SRC_OPENCV_EXT = 'opencv_extra'
-    SRC_OPENCV_CONTRIB = 'opencv_contrib'
+    SRC_OPENCV = BuildStateField('SRC_OPENCV', 'opencv')
+    SRC_OPENCV_EXT = BuildStateField('SRC_OPENCV_EXT', 'opencv_extra')
+    SRC_OPENCV_CONTRIB = BuildStateField('SRC_OPENCV_CONTRIB', 'opencv_contrib')
+
+    # changed by runPrepare() and other build steps
+    env = BuildStateField('env')
+    cmakepars = BuildStateField('cmakepars')
+    buildImage = BuildStateField('buildImage')
+    compiler = BuildStateField('compiler')
+    cmake_generator = BuildStateField('cmake_generator')
+    cmake_platform = BuildStateField('cmake_platform')
+    isDebug = BuildStateField('isDebug')
+    buildWithContrib = BuildStateField('buildWithContrib')
+    runTestsBigData = BuildStateField('runTestsBigData')
+    suppressions = BuildStateField('suppressions')
+    prepareStageAdded = BuildStateField('prepareStageAdded')
+    testShardMerges = BuildStateField('testShardMerges', None)  # merge steps of sharded tests, see addTestShardSteps()
+    testFailFast = BuildStateField('testFailFast', None)  # see setupTestFailFast()
 
     plainRunName = ''
+    TEST_RETRY_MAX = 5  # failed gtest cases to re-run, see getTestRetries()
+    TESTS_DURATIONS_STORED = 50  # the slowest test cases of each test step, see recordTestDurations()
+    TEST_FAILFAST_DEFAULT = 3  # failed test steps for 'test_failfast=ON', see getTestFailFast()
 
     def __repr__(self):
-        d = self.__dict__
         name = '?'
         try:
             name = self.getName()
         except:
             pass
         return 'Builder: ' + name + \
-            ' branch=' + str(d.get('branch', '?')) + \
-            ' useName=' + str(d.get('useName', '?')) + \
-            ' osType=' + str(d.get('osType', '?')) + \
-            ' compiler=' + str(d.get('compiler', '?')) + \
-            ' is64=' + str(d.get('is64', '?')) + \
-            ' buildShared=' + str(d.get('buildShared', '?')) + \
+            ' branch=' + str(getattr(self, 'branch', '?')) + \
+            ' useName=' + str(getattr(self, 'useName', '?')) + \
+            ' osType=' + str(getattr(self, 'osType', '?')) + \
+            ' compiler=' + str(getattr(self, 'compiler', '?')) + \
+            ' is64=' + str(getattr(self, 'is64', '?')) + \
+            ' buildShared=' + str(getattr(self, 'buildShared', '?')) + \
             ''
 
     def __init__(self, **kwargs):
@@ -303,7 +326,8 @@ class CommonFactory(BuilderNewStyle):
             self.runTestsBigData = bool(bigData)
 
         if self.runTestsBigData:
-            self.setProperty('parallel_tests', 1)  # avoid running of OOM killer
+            if not self.isAdaptiveParallelTests():
+                self.setProperty('parallel_tests', 1)  # avoid running of OOM killer
             self.env['BUILD_BIGDATA'] = '1'  # create docker container (Linux) with relaxed memory limits
 
         disable_ipp_prop = self.getProperty('disable_ipp', default=None)
@@ -466,7 +490,9 @@ class CommonFactory(BuilderNewStyle):
             yield self.after_build_steps()
             if self.runTests and bool(self.getProperty('ci-run_tests', default=True)):
                 yield self.determineTests()
-                yield self.testAll()
+                runTests = yield self.selectImpactedTests()
+                if runTests:
+                    yield self.testAll()
             yield self.after_tests_steps()
 
         if self.bb_build.result == SUCCESS and self.isPrecommit != True:
@@ -564,9 +590,24 @@ class CommonFactory(BuilderNewStyle):
                 haltOnFailure=True)
         step.addLogObserver('stdio', BuildPropertiesObserver(self))
         yield self.processStep(step)
+        yield self.sampleWorkerLoad()
         self.initializePostProcess()
 
 
+    @defer.inlineCallbacks
+    def sampleWorkerLoad(self, force=False):
+        controller = concurrency_controller.getController()
+        worker = self.getProperty('slavename', default=None)
+        if not controller.isEnabled(worker) and not force:
+            return
+        step = ShellCommand(name='worker load', descriptionDone=' ', description=' ',
+                command=['python', '-c', concurrency_controller.SAMPLE_SCRIPT], workdir='.',
+                haltOnFailure=False, flunkOnFailure=False, warnOnFailure=False)
+        step.addLogObserver('stdio', BuildPropertiesObserver(self))
+        yield self.processStep(step)
+        controller.addSample(worker, self.getProperty(concurrency_controller.SAMPLE_PROPERTY, default=None))
+
+
     @defer.inlineCallbacks
     def checkout_sources(self, process_extra=True, process_contrib=True):
         getDescriptionOptions = {
@@ -842,6 +883,8 @@ class CommonFactory(BuilderNewStyle):
             common_env['BUILDBOT_COMMAND_EXCLUSIVE'] = '1'
         if self.runTestsBigData:
             common_env['BUILDBOT_COMMAND_EXCLUSIVE'] = '1'
+        if common_env.get('BUILDBOT_COMMAND_EXCLUSIVE', None) == '1' and listOfTests:
+            yield self.reserveWorker('big data tests' if self.runTestsBigData else 'perf tests')
 
         testPrefix = 'perf' if isPerf else 'test';
         for test in listOfTests:
@@ -876,7 +919,7 @@ class CommonFactory(BuilderNewStyle):
                     testFilter = yield interpolateParameter(_testFilter, props)
 
                     moduleTestCommandPrefix = self.getModuleAccuracyTestCommandPrefix(test) if not isPerf else self.getModulePerfTestCommandPrefix(test)
-                    cmd = self.envCmd + (moduleTestCommandPrefix if moduleTestCommandPrefix else '')
+                    cmd = moduleTestCommandPrefix if moduleTestCommandPrefix else ''
                     if not isPythonTest(test):
                         cmd += ('python %s' % " ".join(run_py))
                         moduleTestFilter = self.getModuleAccuracyTestFilter(test) if not isPerf else self.getModulePerfTestFilter(test)
@@ -899,7 +942,9 @@ class CommonFactory(BuilderNewStyle):
                         # runner is 'python2' or 'python3' same as test
                         cmd += ('%(runner)s ../%(path)s/modules/python/test/test.py --repo ../%(path)s %(data)s -v 2>&1' % \
                                 {'path': self.SRC_OPENCV, 'data': pythonDataOption, 'runner': test})
-                    defer.returnValue(cmd)
+                    if self.isTestMemoryTracked():
+                        defer.returnValue(self.envCmdList + ['python', '-c', test_scheduler.MEMORY_SCRIPT, cmd])
+                    defer.returnValue(self.envCmd + cmd)
                 return command
 
             args = dict(name=hname, workdir=builddir,
@@ -924,6 +969,17 @@ class CommonFactory(BuilderNewStyle):
                     args['lazylogfiles'] = True
                 step = CommandTestJava(**args)
             else:
+                args['retryFailedTests'] = self.getTestRetries(isPerf, env.get('BUILDBOT_COMMAND_EXCLUSIVE', None) == '1')
+                shards = 1
+                # Windows: shard env / merge script are not verified with buildenv.cmd wrapper
+                if uploadDir is None and not self.androidABI and self.osType != OSType.WINDOWS and \
+                        env.get('BUILDBOT_COMMAND_EXCLUSIVE', None) != '1' and \
+                        valueToBool(self.getProperty('test_sharding', default=True)):
+                    shards = test_scheduler.getShardCount(self.getName(), hname, self.getParallelTests())
+                if shards > 1:
+                    steps.extend(self.addTestShardSteps(args, shards, resultsFileOnSlave,
+                            lambda shardResultsFile, test=test: getCommand(test, testFilter, shardResultsFile)))
+                    continue
                 step = CommandTestCPP(**args)
             if step is not None:
                 steps.append(step)
@@ -947,35 +1003,301 @@ class CommonFactory(BuilderNewStyle):
                             workdir=builddir,
                             slavesrc=resultsFileOnSlave, masterdest=getDestination(test, uploadDir), mode=0644,
                             haltOnFailure=haltOnFailure, doStepIf=doStepIfModule, hideStepIf=hideStepIfDefault)
+                        if testPrefix == 'perf':
+                            uploadStep.addCompletionCallback(self.ingestPerfResults)
                         self.addStep(uploadStep, teststep)
                     return testStepCompletionCallback
                 step.addCompletionCallback(getCompletionCallback())
 
         defer.returnValue(steps)
 
+    def ingestPerfResults(self, uploadStep, results):
+        ''' Queue uploaded perf XML for perf_history database '''
+        if results not in [SUCCESS, WARNINGS]:
+            return
+        revision = self.getProperty('got_revision', default=None)
+        if isinstance(revision, dict):
+            revision = revision.get('opencv', None)
+        info = dict(builder=self.getName(), platform=self.getProperty('platform', default=None),
+                    revision=revision or self.getProperty('revision', default=None),
+                    buildnumber=self.getProperty('buildnumber', default=None),
+                    pullrequest=self.getProperty('pullrequest', default=None))
+        perf_history.getStore().enqueue(uploadStep.masterdest, info)
+
+    def addTestShardSteps(self, args, count, resultsFileOnSlave, getCommand):
+        '''
+        Split gtest module step into shard steps (GTEST_SHARD_INDEX / GTEST_TOTAL_SHARDS).
+        Merge step (one XML and tests summary) is executed by processTestShardMerges().
+        '''
+        steps = []
+        shardFiles = []
+        for i in range(count):
+            name = test_scheduler.getShardStepName(args['name'], i, count)
+            shardFile = '%s-shard%d.xml' % (os.path.splitext(resultsFileOnSlave)[0], i + 1)
+            env = dict(args['env'], GTEST_SHARD_INDEX=str(i), GTEST_TOTAL_SHARDS=str(count))
+            steps.append(CommandTestCPP(**dict(args, name=name, description=name, descriptionDone=name,
+                                               command=getCommand(shardFile), env=env, logfiles={})))
+            shardFiles.append(shardFile)
+        name = args['name'] + '-merged'
+        merge = CommandTestCPP(**dict(args, name=name, description=name, descriptionDone=name, retryFailedTests=0,
+                                      command=['python', '-c', test_scheduler.MERGE_SCRIPT, resultsFileOnSlave] + shardFiles))
+        self.testShardMerges = (self.testShardMerges or []) + [merge]
+        print('Test {}: {} shards'.format(args['name'], count))
+        return steps
+
+    @defer.inlineCallbacks
+    def processTestShardMerges(self):
+        steps = self.testShardMerges or []
+        self.testShardMerges = None
+        if self.testFailFast and self.testFailFast['reason']:
+            steps = []  # shards may be cancelled
+        if steps:
+            yield self.bb_build.processStepsInParallel(steps, len(steps))
+
+    def getTestRetries(self, isPerf=False, exclusive=False):
+        '''
+        Max number of failed gtest cases which are re-run in the same step (see CommandTestCPP).
+        Enabled by default for precommit accuracy tests, perf and exclusive (big data) steps are not re-run.
+        '''
+        if isPerf or exclusive:
+            return 0
+        retries = self.getProperty('test_retry', default=self.TEST_RETRY_MAX if self.isPrecommit else 0)
+        try:
+            return max(0, int(retries))
+        except ValueError:
+            return self.TEST_RETRY_MAX if valueToBool(retries) else 0
+
+    def isTestMemoryTracked(self):
+        ''' Peak RSS of test steps is measured on worker (test_scheduler.MEMORY_SCRIPT) '''
+        return self.osType != OSType.WINDOWS and not self.androidABI
+
+    def isAdaptiveParallelTests(self):
+        return self.isTestMemoryTracked() and valueToBool(self.getProperty('parallel_tests_adaptive', default=True))
+
+    def getAdaptiveTestSlots(self):
+        ''' Explicit 'parallel_tests' property (builder / PR parameter) or number of worker CPUs '''
+        slots = self.getProperty('parallel_tests', None)
+        if slots is None:
+            slots = max(int(self.getProperty('CPUs', default=1)), int(self.getParallelTests()))
+        return int(slots)
+
+    @defer.inlineCallbacks
+    def processTestSteps(self, steps, parallel_N, adaptiveSlots=None, devices=None, cpuSlots=None):
+        '''
+        Run test steps in parallel with memory admission (test_scheduler.MemoryAdmission) if available memory
+        of worker is known, otherwise by parallel_N steps. Peak RSS of steps is stored into durations DB.
+        devices - {step: OpenCL device}, steps of the same device are not run together (test_scheduler.DeviceAdmission)
+        cpuSlots - limit of CPU-only steps (devices only) with memory admission
+        '''
+        for step in steps:
+            step.addCompletionCallback(self.recordTestStepMemory)
+            step.addCompletionCallback(self.recordTestDurations)
+        sample = None
+        if len(steps) > 1 and self.isAdaptiveParallelTests():
+            yield self.sampleWorkerLoad(force=True)
+            sample = self.getProperty(concurrency_controller.SAMPLE_PROPERTY, default=None)
+            if isinstance(sample, basestring):
+                sample = json.loads(sample)
+        slots = adaptiveSlots or self.getAdaptiveTestSlots()
+        admission = None
+        if sample and sample.get('mem_available', None):
+            admission = test_scheduler.MemoryAdmission(self.getName(), sample['mem_available'], slots,
+                    defaultMemory=None if self.runTestsBigData else test_scheduler.MemoryAdmission.DEFAULT_STEP_MEMORY)
+            print('Running {} tests in parallel (memory admission: {} MiB, up to {} steps)'.format(
+                    len(steps), int(admission.budget) >> 20, admission.slots))
+        if devices is not None:
+            if admission is None:
+                (slots, cpuSlots) = (parallel_N, None)  # no memory admission: all steps are limited by parallel_N
+            admission = test_scheduler.DeviceAdmission(devices, slots, admission, cpuSlots=cpuSlots)
+            print('Running {} tests in parallel (OpenCL devices: {}, up to {} steps)'.format(
+                    len(steps), ', '.join(sorted(set([d for d in devices.values() if d]))) or 'none', admission.slots))
+        if admission is None:
+            print('Running {} tests in parallel ({})'.format(len(steps), parallel_N))
+            yield self.bb_build.processStepsInParallel(steps, parallel_N)
+            return
+        yield self.processStepsWithAdmission(steps, admission)
+
+    def processStepsWithAdmission(self, steps, admission):
+        ''' Returns Deferred, it is fired when all steps are finished (errback with the first failure) '''
+        d = defer.Deferred()
+        pending = list(steps)
+        failures = []
+        def schedule():
+            while True:
+                step = admission.select(pending)
+                if step is None:
+                    break
+                pending.remove(step)
+                admission.admit(step)
+                stepDeferred = defer.maybeDeferred(self.processStep, step)
+                stepDeferred.addErrback(failures.append)
+                stepDeferred.addBoth(lambda _, step=step: finished(step))
+            if not pending and not admission.running and not d.called:
+                if failures:
+                    d.errback(failures[0])
+                else:
+                    d.callback(None)
+        def finished(step):
+            admission.release(step)
+            schedule()
+        schedule()
+        return d
+
+    def recordTestStepMemory(self, teststep, results):
+        peakRSS = getattr(teststep, 'peakRSS', None)
+        if peakRSS is None:
+            return
+        try:
+            duration_store.getStore().recordPeakMemory(self.getName(), teststep.name, peakRSS,
+                                                       worker=self.getProperty('slavename', default=None))
+        except Exception as e:
+            print('Can\'t store peak memory of {}: {}'.format(teststep.name, e))
+
+    def recordTestDurations(self, teststep, results):
+        tests = teststep.getSlowestTests(self.TESTS_DURATIONS_STORED) if hasattr(teststep, 'getSlowestTests') else []
+        if not tests:
+            return
+        try:
+            duration_store.getStore().recordTestDurations(self.getName(), teststep.name,
+                    [(name, ms / 1000.0) for (name, ms) in tests], buildnumber=self.getProperty('buildnumber', default=None))
+        except Exception as e:
+            print('Can\'t store tests durations of {}: {}'.format(teststep.name, e))
+
+    def getTestFailFast(self):
+        ''' Number of failed test steps which cancels pending test steps, 0 - fail-fast is disabled (default) '''
+        value = self.getProperty('test_failfast', default=None)
+        if isinstance(value, bool):
+            return self.TEST_FAILFAST_DEFAULT if value else 0
+        try:
+            return max(0, int(value))
+        except (TypeError, ValueError):
+            return self.TEST_FAILFAST_DEFAULT if valueToBool(value) else 0
+
+    def setupTestFailFast(self, steps):
+        '''
+        Fail-fast: pending test steps are skipped after 'test_failfast' failed steps
+        or if a test step doesn't run any test (missing / broken test binary).
+        '''
+        limit = self.getTestFailFast()
+        self.testFailFast = None
+        if not limit:
+            return
+        self.testFailFast = dict(limit=limit, failed=[], cancelled=[], reason=None)
+        for step in steps:
+            step.addCompletionCallback(self.onTestStepCompleted)
+            def doStepIf(s, _doStepIf=step.doStepIf):
+                state = self.testFailFast
+                if state and state['reason']:
+                    state['cancelled'].append(s.name)
+                    return False
+                return _doStepIf(s) if callable(_doStepIf) else _doStepIf
+            step.doStepIf = doStepIf
+
+    def onTestStepCompleted(self, teststep, results):
+        state = self.testFailFast
+        if not state or state['reason'] or results not in [FAILURE, EXCEPTION]:
+            return
+        state['failed'].append(teststep.name)
+        if isinstance(teststep, CommandTestCPP) and not teststep.all_tests_passed and \
+                not teststep.testsPassed and not teststep.testsFailed:
+            reason = '{}: no tests were run'.format(teststep.name)
+        elif len(state['failed']) >= state['limit']:
+            reason = 'failed test steps: {}'.format(', '.join(state['failed']))
+        else:
+            return
+        state['reason'] = reason
+        print('Test fail-fast: {}, pending test steps are cancelled'.format(reason))
+        self.setProperty('test_failfast_reason', reason, 'Test fail-fast')
+        self.releaseWorker()
+
+    def getParallelTests(self):
+        parallel_N = self.getProperty('parallel_tests', None)
+        if parallel_N is None:
+            parallel_N = concurrency_controller.getController().getParallelTests(self.getProperty('slavename', default=None), 4)
+        return parallel_N
+
     @defer.inlineCallbacks
     def determineTests(self):
-        exe = "%s python %s" % (self.envCmd, self.getRunPy())
-        exe = exe.strip()
         p = {
-            "tests_performance": "--list_short",
-            "tests_accuracy": "--list_short -a",
-            "tests_performance_main": "--list_short_main",
-            "tests_accuracy_main": "--list_short_main -a"
+            "tests_performance": ["--list_short"],
+            "tests_accuracy": ["--list_short", "-a"],
+            "tests_performance_main": ["--list_short_main"],
+            "tests_accuracy_main": ["--list_short_main", "-a"]
         }
-        for prop, args in p.items():
-            def extract(rc, stdout, stderr):
-                if rc == 0:
-                    return {prop: " ".join(sorted(str(stderr).split()))}
-                else:
-                    return {prop: ""}
-            yield self.processStep(
-                SetPropertyFromCommand(
-                    command = "%s %s" % (exe, args),
-                    extract_fn = extract,
-                    workdir = "build",
-                    env=self.env,
-                    hideStepIf=hideStepIfSuccessSkipFn))
+        if self.osType == OSType.WINDOWS:
+            # multi-line 'python -c' script is not passed reliably through buildenv.cmd wrapper
+            exe = ("%s python %s" % (self.envCmd, self.getRunPy())).strip()
+            for (prop, args) in sorted(p.items()):
+                def extract(rc, stdout, stderr, prop=prop):
+                    if rc == 0:
+                        return {prop: " ".join(sorted(str(stderr).split()))}
+                    else:
+                        return {prop: ""}
+                yield self.processStep(
+                    SetPropertyFromCommand(
+                        command = "%s %s" % (exe, ' '.join(args)),
+                        extract_fn = extract,
+                        workdir = "build",
+                        env=self.env,
+                        hideStepIf=hideStepIfSuccessSkipFn))
+            return
+        def extract(rc, stdout, stderr):
+            lists = test_scheduler.parseDiscoveryOutput(stdout) if rc == 0 else None
+            return dict([(prop, str((lists or {}).get(prop, ""))) for prop in p.keys()])
+        # all lists in one command, cached in build directory (key: binaries and cmake parameters)
+        cacheFile = '.test_lists.json' if valueToBool(self.getProperty('test_discovery_cache', default=True)) else ''
+        params = json.dumps(self.cmakepars, sort_keys=True, default=str)
+        yield self.processStep(
+            SetPropertyFromCommand(
+                name = "determine tests",
+                command = self.envCmdList + ['python', '-c', test_scheduler.DISCOVERY_SCRIPT, self.getRunPy(), json.dumps(p), params, cacheFile],
+                extract_fn = extract,
+                workdir = "build",
+                env=self.env,
+                hideStepIf=hideStepIfSuccessSkipFn))
+
+    @defer.inlineCallbacks
+    def selectImpactedTests(self):
+        '''
+        Precommit builds: set 'test_impact_modules' to tests of modules affected by changes (see test_impact.py).
+        Returns False if there are no tests to run.
+        '''
+        if not self.isPrecommit or self.isPerf or not valueToBool(self.getProperty('test_impact', default=True)):
+            defer.returnValue(True)
+        for prop in ['modules_filter', 'modules_force', 'test_filter']:
+            if self.getProperty(prop, default=None):
+                print('Test impact: skipped, "{}" is specified'.format(prop))
+                defer.returnValue(True)
+        revisions = self.getProperty('got_revision', default={})
+        repos = [('opencv', '../' + self.SRC_OPENCV)] + ([('opencv_contrib', '../' + self.SRC_OPENCV_CONTRIB)] if self.buildWithContrib else [])
+        repos = [(repo, path, revisions.get(repo, None) if isinstance(revisions, dict) else None) for (repo, path) in repos]
+        result = {}
+        def extract(rc, stdout, stderr):
+            if rc == 0:
+                result['data'] = test_impact.parseImpactOutput(stdout)
+            return {}
+        yield self.processStep(
+            SetPropertyFromCommand(
+                name = "test impact",
+                command = ['python', '-c', test_impact.IMPACT_SCRIPT, 'CMakeCache.txt', json.dumps(repos)],
+                extract_fn = extract,
+                workdir = "build",
+                haltOnFailure=False, flunkOnFailure=False, warnOnFailure=False,
+                hideStepIf=hideStepIfSuccessSkipFn))
+        data = result.get('data', None)
+        if data is None:
+            print('Test impact: changes are not available, run full test suite')
+            defer.returnValue(True)
+        available = ' '.join([str(self.getProperty(p, default='')) for p in ['tests_accuracy', 'tests_performance']]).split()
+        (tests, reason) = test_impact.getImpactedTests(data['changes'], data['modules'], available)
+        print('Test impact: {} -> {}'.format(reason, 'full test suite' if tests is None else (','.join(tests) or 'no tests')))
+        self.setProperty('test_impact_reason', reason, 'Test impact')
+        if tests is None:
+            defer.returnValue(True)
+        if not tests:
+            defer.returnValue(False)
+        self.setProperty('test_impact_modules', ','.join(tests), 'Test impact')
+        defer.returnValue(True)
 
     def getTestList(self, isPerf = False):
         prop = "tests_performance" if isPerf else "tests_accuracy"
@@ -993,7 +1315,12 @@ class CommonFactory(BuilderNewStyle):
         if modulesFilter:
             modulesList = modulesFilter.split(',')
             return modules_force_list + [i for i in res if i in modulesList]
-        return modules_force_list + [i for i in res if i not in self.getTestBlacklist(isPerf)]
+        res = [i for i in res if i not in self.getTestBlacklist(isPerf)]
+        impactModules = self.getProperty('test_impact_modules', None)  # see selectImpactedTests()
+        if impactModules is not None:
+            impactList = str(impactModules).split(',')
+            res = [i for i in res if i in impactList]
+        return modules_force_list + res
 
     @defer.inlineCallbacks
     def testAll(self):
@@ -1001,6 +1328,15 @@ class CommonFactory(BuilderNewStyle):
         if self.osType == OSType.ANDROID and self.androidDevice is None:
             return
 
+        if self.isTestPhaseSkipped():
+            return
+
+        steps = yield self.addAllTestSteps()
+        yield self.runTestSteps(steps)
+
+    @defer.inlineCallbacks
+    def addAllTestSteps(self, accuracy=True, performance=True):
+        ''' Accuracy and performance test steps of the current environment '''
         steps = []
 
         @defer.inlineCallbacks
@@ -1020,11 +1356,26 @@ class CommonFactory(BuilderNewStyle):
 
             self.env = env_backup
 
-        yield add_tests(True, self.getTestList(False), self.getTestList(True))
+        yield add_tests(True, self.getTestList(False) if accuracy else None, self.getTestList(True) if performance else None)
+        defer.returnValue(steps)
+
+    def isTestPhaseSkipped(self):
+        if self.getTestFailFast() and self.bb_build.result not in [SUCCESS, WARNINGS]:
+            print('Test fail-fast: build is already failed, tests are not started')
+            return True
+        return False
 
-        parallel_N = self.getProperty('parallel_tests', 4)
-        print('Running {} tests in parallel ({})'.format(len(steps), parallel_N))
-        yield self.bb_build.processStepsInParallel(steps, parallel_N)
+    @defer.inlineCallbacks
+    def runTestSteps(self, steps, parallel_N=None, adaptiveSlots=None, devices=None, cpuSlots=None):
+        ''' See processTestSteps() '''
+        parallel_N = parallel_N or self.getParallelTests()
+        steps = test_scheduler.sortLongestFirst(self.getName(), steps)
+        self.setupTestFailFast(steps)
+        yield self.processTestSteps(steps, parallel_N, adaptiveSlots=adaptiveSlots, devices=devices, cpuSlots=cpuSlots)
+        yield self.processTestShardMerges()
+        self.releaseWorker()
+        if self.testFailFast and self.testFailFast['cancelled']:
+            print('Test fail-fast: {} test steps are cancelled'.format(len(self.testFailFast['cancelled'])))
 
 
     @defer.inlineCallbacks
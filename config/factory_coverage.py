@@ -27,6 +27,8 @@ class GenHTML(ShellCommand):
         return res
 
 class CoverageFactory(ParentClass):
+    buildWeight = 2.0  # high memory usage, see concurrency_controller.py
+
     def __init__(self, **kwargs):
         useSlave = ['linux-1']
         branch = kwargs.get('branch', 'master')
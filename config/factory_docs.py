@@ -38,6 +38,7 @@ def getWhitespaceCheckFilter(repo):
 
 
 class Docs_factory(BaseFactory):
+    buildWeight = 0.5  # light build, see concurrency_controller.py
 
     def __init__(self, *args, **kwargs):
         useName = kwargs.pop('useName', 'docs')
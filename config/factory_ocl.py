@@ -1,11 +1,16 @@
 from twisted.internet import defer
 
 from build_utils import *
+from builder_newstyle import BuildStateField
 from constants import PLATFORM_ANY, PLATFORM_DEFAULT, PLATFORM_SKYLAKE, PLATFORM_SKYLAKE_X
 from factory_ipp import IPP_factory as BaseFactory
+import test_scheduler
 
 class OCL_factory(BaseFactory):
 
+    buildOpenCL = BuildStateField('buildOpenCL')
+    testOpenCL = BuildStateField('testOpenCL')
+
     def __init__(self, *args, **kwargs):
         self.useOpenCL = kwargs.pop('useOpenCL', None)
         self.buildOpenCL = kwargs.pop('buildOpenCL', self.useOpenCL)
@@ -87,35 +92,66 @@ class OCL_factory(BaseFactory):
 
     @defer.inlineCallbacks
     def testAll(self):
-        if self.testOpenCL:
-            steps = []
-
-            env_backup = self.env.copy()
-
-            if not self.isPrecommit:
-                self.env['OPENCV_TEST_OCL_LOOP_TIMES'] = '10'
-
-            deviceMap = self.getOpenCLDeviceMap()
-            for devID in deviceMap.keys():
-                self.env['OPENCV_OPENCL_DEVICE'] = deviceMap[devID]
-                testSuffix = '-%s' % devID
-                accuracyTests = yield self.addTestSteps(False, self.getTestList(False), testSuffix=testSuffix)
-                perfTests = yield self.addTestSteps(True, self.getTestList(True), performance_samples=['--check'], testSuffix=testSuffix)
-                steps.extend(accuracyTests)
-                steps.extend(perfTests)
-
-            self.env['OPENCV_OPENCL_DEVICE'] = 'DISABLED'
-            del self.env['OPENCV_OPENCL_DEVICE']  # TODO Workaround for ocl module based tests (ocl in bioinspired/nonfree)
-
-            self.env = env_backup
-
-            parallel_N = min(int(self.getProperty('parallel_tests', 2)), 2) if branchVersionMajor(self) > 2 else 1
-            print('Running {} tests in parallel ({})'.format(len(steps), parallel_N))
-            yield self.bb_build.processStepsInParallel(steps, parallel_N)
-
-        if not self.testOpenCL or self.testOpenCLWithPlain:
+        if not self.testOpenCL:
             env_backup = self.env.copy()
             self.env['OPENCV_OPENCL_RUNTIME'] = ''
             self.env['OPENCV_OPENCL_DEVICE'] = 'disabled'  # for static OpenCL builds
             yield BaseFactory.testAll(self)
             self.env = env_backup
+            return
+
+        if self.isTestPhaseSkipped():
+            return
+
+        deviceMap = self.getOpenCLDeviceMap()
+        # without memory admission OpenCL and CPU-only steps are limited together (OpenCL devices are shared by steps)
+        parallel_N = min(int(self.getProperty('parallel_tests', 2)), 2) if branchVersionMajor(self) > 2 else 1
+
+        # accuracy tests: one step per OpenCL device, CPU-only steps are limited by worker CPUs
+        (steps, devices) = yield self.addOpenCLTestSteps(deviceMap, False)
+        if self.testOpenCLWithPlain:
+            plainTests = yield self.addPlainTestSteps(performance=False)
+            steps.extend(plainTests)
+        cpuSlots = self.getAdaptiveTestSlots() if branchVersionMajor(self) > 2 else 1
+        yield self.runTestSteps(steps, parallel_N, adaptiveSlots=cpuSlots + len(set(deviceMap.values())),
+                                devices=devices, cpuSlots=cpuSlots)
+
+        # performance tests are not mixed with accuracy tests
+        if self.isTestPhaseSkipped():
+            return
+        (steps, devices) = yield self.addOpenCLTestSteps(deviceMap, True)
+        if self.testOpenCLWithPlain:
+            plainTests = yield self.addPlainTestSteps(accuracy=False)
+            steps.extend(plainTests)
+        yield self.runTestSteps(steps, parallel_N, adaptiveSlots=parallel_N, devices=devices)
+
+    @defer.inlineCallbacks
+    def addOpenCLTestSteps(self, deviceMap, isPerf):
+        ''' Returns (steps, {step: OpenCL device}), see test_scheduler.DeviceAdmission '''
+        steps = []
+        devices = {}
+        env_backup = self.env.copy()
+        if not self.isPrecommit:
+            self.env['OPENCV_TEST_OCL_LOOP_TIMES'] = '10'
+        for devID in sorted(deviceMap.keys()):
+            self.env['OPENCV_OPENCL_DEVICE'] = deviceMap[devID]
+            testSuffix = '-%s' % devID
+            if isPerf:
+                tests = yield self.addTestSteps(True, self.getTestList(True), performance_samples=['--check'], testSuffix=testSuffix)
+            else:
+                tests = yield self.addTestSteps(False, self.getTestList(False), testSuffix=testSuffix)
+            for step in tests:
+                devices[step] = deviceMap[devID]
+            steps.extend(tests)
+        self.env = env_backup
+        defer.returnValue((steps, devices))
+
+    @defer.inlineCallbacks
+    def addPlainTestSteps(self, **kwargs):
+        ''' CPU-only test steps (OPENCV_OPENCL_DEVICE=disabled) '''
+        env_backup = self.env.copy()
+        self.env['OPENCV_OPENCL_RUNTIME'] = ''
+        self.env['OPENCV_OPENCL_DEVICE'] = 'disabled'  # for static OpenCL builds
+        steps = yield self.addAllTestSteps(**kwargs)
+        self.env = env_backup
+        defer.returnValue(steps)
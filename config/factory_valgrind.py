@@ -4,6 +4,8 @@ from build_utils import isBranch24
 from factory_ocl import OCL_factory as ParentClass
 
 class ValgrindFactory(ParentClass):
+    buildWeight = 2.0  # high memory usage, see concurrency_controller.py
+
     def __init__(self, **kwargs):
         useSlave = ['linux-2']
         cmake_parameters = kwargs.pop('cmake_parameters', {})
@@ -0,0 +1,84 @@
+'''
+Common part of SQLite history databases next to buildbot state.sqlite
+(duration_store.py, test_flakiness.py, perf_history.py).
+
+Connection is shared by master (queries) and background writer thread: INSERT / DELETE statements
+and file parsing are executed by writer thread, so build / step finish doesn't block the reactor.
+Functions of writer thread take the lock around SQL statements only.
+'''
+import sqlite3
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from constants import trace
+
+_stores = {}  # store class -> instance, see getStore()
+
+
+class SQLiteStore(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.lock = threading.RLock()  # connection is shared by writer thread and master
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='%s writer' % type(self).__name__)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def query(self, sql, args=()):
+        ''' Rows of SELECT statement '''
+        with self.lock:
+            return list(self.db.execute(sql, args))
+
+    def execute(self, sql, rows):
+        ''' Modification statement for each row of rows and commit '''
+        with self.lock:
+            self.db.executemany(sql, rows)
+            self.db.commit()
+
+    def submit(self, fn, *args):
+        ''' Call fn(*args) by writer thread, errors are logged '''
+        self.queue.put((fn, args))
+
+    def flush(self):
+        ''' Wait for submitted calls '''
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            (fn, args) = self.queue.get()
+            try:
+                fn(*args)
+            except:
+                import traceback
+                trace('%s: %s' % (self.path, traceback.format_exc()))
+            finally:
+                self.queue.task_done()
+
+
+def percentile(sortedValues, p):
+    ''' Percentile p (0..100) of sorted non-empty list: linear interpolation between closest ranks '''
+    if len(sortedValues) == 1:
+        return sortedValues[0]
+    k = (len(sortedValues) - 1) * p / 100.0
+    i = int(k)
+    if i + 1 >= len(sortedValues):
+        return sortedValues[-1]
+    return sortedValues[i] + (sortedValues[i + 1] - sortedValues[i]) * (k - i)
+
+
+def getStore(cls, path):
+    ''' Store instance of class, it is created on the first call '''
+    store = _stores.get(cls, None)
+    if store is None:
+        store = _stores[cls] = cls(path)
+    return store
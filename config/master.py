@@ -3,6 +3,8 @@
 import os
 
 import constants
+import startup_profiler
+startup_profiler.phaseStart('config import')
 
 from twisted.web.static import File
 
@@ -30,13 +32,27 @@ c['logMaxTailSize'] = 32768
 
 ####### Main config #######
 
-import project_builders
+startup_profiler.phaseStart('builders registration')
+import sys
+if 'project_builders' in sys.modules:
+    # reconfig: create builders again, unchanged builders keep their config objects (see BuilderNewStyle.register())
+    import project_builders
+    oldBuilders = set([id(b) for b in project_builders.builders])
+    reload(project_builders)
+    print('Reconfig: %d of %d builders are not changed' % (
+        len([b for b in project_builders.builders if id(b) in oldBuilders]), len(project_builders.builders)))
+else:
+    import project_builders
+startup_profiler.phaseEnd('builders registration')
 
 c['status'] = []
 c['slaves'] = project_builders.workers
 c['builders'] = project_builders.builders
 c['schedulers'] = project_builders.schedulers
 
+import build_priority
+c['prioritizeBuilders'] = build_priority.defaultPolicy.prioritizeBuilders
+
 ####### Web GUI ########
 
 from pullrequest.account import Authz
@@ -59,11 +75,16 @@ import pr_github_opencv_contrib
 
 webstatus = WebStatus(http_port=8010, authz=authz_cfg, pullrequests=[pr_github_opencv.context, pr_github_opencv_contrib.context])
 c['status'].append(webstatus)
+startup_profiler.wrapMethod(webstatus, 'startService', 'web status attach')
 
 webstatus.putChild('export', File(getExportDirectory()));
 
 for b in c['builders']:
     if type(b) == type({}):
-        b['builddir'] = '/builds/' + b['builddir']
+        if not b['builddir'].startswith('/builds/'):
+            b['builddir'] = '/builds/' + b['builddir']
     else:
-        b.builddir = '/builds/' + b.builddir
+        if not b.builddir.startswith('/builds/'):  # unchanged builders keep their config on reconfig
+            b.builddir = '/builds/' + b.builddir
+
+startup_profiler.phaseEnd('config import')
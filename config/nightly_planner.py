@@ -0,0 +1,71 @@
+'''
+Planner of nightly builds start times.
+
+Builders of SetOfBuildersWithSchedulers(nightlyPlanner=..., nightlyWindow=...) get start times inside
+[nightlyHour:nightlyMinute, +nightlyWindow minutes]. Planning is a greedy list scheduling:
+builders are processed from the longest one (historical durations from duration_store), each builder
+starts on the earliest free build slot (constants.worker 'max_builds') of its workers.
+Builders which don't fit into the window (all slots are busy until its end) are spread round-robin
+over start times of the window, they are queued on workers anyway.
+One planner instance is shared by all sets of a configuration, so they don't overlap on the same workers.
+'''
+import constants
+from constants import trace
+
+import duration_store
+
+
+class NightlyPlanner(object):
+
+    GRANULARITY = 5  # minutes, start times are rounded up to this value
+    DEFAULT_DURATION = 60  # minutes, builder without history
+
+    def __init__(self):
+        self.slots = {}  # (dayOfWeek, worker) -> list of slot free times (minutes since midnight)
+        self.durationStoreAvailable = True
+
+    def getDuration(self, builderName):
+        ''' Predicted build duration in minutes '''
+        if self.durationStoreAvailable:
+            try:
+                duration = duration_store.getStore().getP50(builderName)
+                if duration is not None:
+                    return duration / 60.0
+            except Exception as e:
+                trace('NightlyPlanner: build durations are not available: %s' % e)
+                self.durationStoreAvailable = False
+        return self.DEFAULT_DURATION
+
+    def getSlots(self, dayOfWeek, worker):
+        key = (dayOfWeek, worker)
+        if key not in self.slots:
+            self.slots[key] = [0] * constants.worker.get(worker, {}).get('max_builds', 1)
+        return self.slots[key]
+
+    def plan(self, builders, hour, minute, window, dayOfWeek='*'):
+        '''
+        builders - list of BuilderNewStyle objects
+        Returns {start time in minutes since midnight: [builder names]}
+        '''
+        windowStart = hour * 60 + minute
+        windowEnd = windowStart + window
+        items = sorted([(-self.getDuration(b.getName()), b.getName(), b.getSlaves()) for b in builders])
+        res = {}
+        overflow = 0  # builders which don't fit into the window
+        for (negDuration, name, workers) in items:
+            best = None
+            for worker in workers:
+                slots = self.getSlots(dayOfWeek, worker)
+                i = min(range(len(slots)), key=lambda i: slots[i])
+                if best is None or slots[i] < best[0]:
+                    best = (slots[i], worker, i)
+            start = max(windowStart, best[0])
+            start = windowStart + -(-(start - windowStart) // self.GRANULARITY) * self.GRANULARITY
+            if start > windowEnd:
+                start = windowStart + (overflow * self.GRANULARITY) % (window - window % self.GRANULARITY + self.GRANULARITY)
+                overflow += 1
+            self.getSlots(dayOfWeek, best[1])[best[2]] = max(start, best[0]) - negDuration
+            res.setdefault(start, []).append(name)
+        trace('NightlyPlanner: %s' % ', '.join(['%02d:%02d=%d' % ((t // 60) % 24, t % 60, len(names))
+                                                for (t, names) in sorted(res.items())]))
+        return res
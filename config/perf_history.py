@@ -0,0 +1,230 @@
+'''
+History of performance test results.
+
+Uploaded perf XML files (CommonFactory.addTestSteps(isPerf=True, uploadDir=...)) are parsed on the master
+by writer thread of PerfHistoryStore (see history_store.py) and stored into SQLite database next to buildbot state.sqlite
+(one row per test case: median / gmean / mean / min / stddev in milliseconds, samples, outliers).
+Runs are keyed by builder, platform, revision and perf module, each file is ingested once.
+
+    import perf_history
+    perf_history.getStore().getTimeSeries('OCL_ResizeFixture_Resize.Resize', '(8UC1, 640x480, 0.5)', builder='...')
+    perf_history.getStore().getPercentiles('OCL_ResizeFixture_Resize.Resize', '(8UC1, 640x480, 0.5)')
+
+Backfill of existing export directory:
+
+    python perf_history.py scan /data/artifacts/export/opencv_releases
+'''
+import os
+import re
+import time
+import xml.etree.ElementTree as ET
+
+from constants import trace
+import history_store
+
+DB_PATH = os.environ.get('BUILDBOT_PERF_HISTORY_DB', '/data/db/perf_history.sqlite')
+
+METRICS = ['median', 'gmean', 'mean', 'min', 'stddev']
+
+# see factory_common.getResultFileNameRenderer(), branch of pull request has '.' replaced by '_' (3_4, 4_x, master)
+FILE_NAME = re.compile(r'^(?P<timestamp>\d{8}-\d{6})-(?P<revision>[0-9a-fx]{7})(?:-(?P<patch>[0-9a-f]{7}))? '
+                       r'(?:(?P<platform>\S+?)-)?(?P<module>perf_\S+) (?:pr(?P<pullrequest>\d+) (?:\d+(?:_[0-9x]+)*|[^\s_]+)_)?'
+                       r'(?P<builder>\S+)_(?P<buildnumber>\d+)\.xml$')
+
+
+def parseFileName(path):
+    ''' Run information from name of uploaded file or None '''
+    m = FILE_NAME.match(os.path.basename(path))
+    if not m:
+        return None
+    info = dict([(k, v) for (k, v) in m.groupdict().items() if v is not None])
+    info['timestamp'] = time.mktime(time.strptime(info['timestamp'], '%Y%m%d-%H%M%S'))
+    info['buildnumber'] = int(info['buildnumber'])
+    if info['revision'] == 'xxxxxxx':  # unknown revision
+        del info['revision']
+    if 'pullrequest' in info:
+        info['pullrequest'] = int(info['pullrequest'])
+    return info
+
+
+def parseResults(path):
+    ''' Yields dict(test, params, status, <metrics in ms>, samples, outliers) for perf test cases of gtest XML '''
+    for (event, elem) in ET.iterparse(path):
+        if elem.tag != 'testcase':
+            continue
+        if elem.get('status', 'run') == 'run':
+            res = dict(test='%s.%s' % (elem.get('classname', ''), elem.get('name', '')),
+                       params=elem.get('value_param', '') or elem.get('type_param', ''),
+                       status='failed' if elem.find('failure') is not None else 'passed')
+            try:
+                frequency = float(elem.get('frequency', 0))
+            except ValueError:
+                frequency = 0
+            for metric in METRICS:
+                value = elem.get(metric, None)
+                res[metric] = float(value) * 1000.0 / frequency if value is not None and frequency > 0 else None
+            for k in ['samples', 'outliers']:
+                res[k] = int(elem.get(k)) if elem.get(k, '').isdigit() else None
+            if res['median'] is not None or res['gmean'] is not None:
+                yield res
+        elem.clear()
+
+
+class PerfHistoryStore(history_store.SQLiteStore):
+
+    HISTORY_LIMIT = 50  # last N runs are used for percentiles
+
+    def __init__(self, path=DB_PATH):
+        history_store.SQLiteStore.__init__(self, path)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY,
+            builder TEXT NOT NULL,
+            platform TEXT,
+            revision TEXT,
+            module TEXT NOT NULL,
+            buildnumber INTEGER,
+            pullrequest INTEGER,
+            timestamp REAL NOT NULL,
+            path TEXT UNIQUE)''')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS results (
+            run_id INTEGER NOT NULL,
+            test TEXT NOT NULL,
+            params TEXT NOT NULL,
+            status TEXT,
+            median REAL,
+            gmean REAL,
+            mean REAL,
+            min REAL,
+            stddev REAL,
+            samples INTEGER,
+            outliers INTEGER)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS runs_key ON runs (builder, platform, revision, module)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS runs_timestamp ON runs (timestamp)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS results_test ON results (test, params, run_id)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS results_run ON results (run_id)')
+        self.db.commit()
+
+    def isIngested(self, path):
+        return len(self.query('SELECT 1 FROM runs WHERE path = ?', (path,))) > 0
+
+    def ingest(self, path, info=None):
+        '''
+        Store results of perf XML file, info - dict(builder, platform, revision, module, buildnumber, pullrequest, timestamp),
+        missing values are taken from file name. Returns number of stored test cases, None if file is already stored.
+        '''
+        path = os.path.abspath(path)
+        if self.isIngested(path):  # don't parse stored files, it is checked again before INSERT
+            return None
+        info = dict(parseFileName(path) or {}, **dict([(k, v) for (k, v) in (info or {}).items() if v is not None]))
+        if 'builder' not in info or 'module' not in info:
+            raise ValueError('Unknown builder / perf module of %s' % path)
+        rows = list(parseResults(path))
+        with self.lock:
+            if self.isIngested(path):  # by another thread during parsing
+                return None
+            cursor = self.db.execute('INSERT OR IGNORE INTO runs (builder, platform, revision, module, buildnumber, pullrequest, timestamp, path) '
+                                     'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                     (info['builder'], info.get('platform', None), info.get('revision', None), info['module'],
+                                      info.get('buildnumber', None), info.get('pullrequest', None),
+                                      info.get('timestamp', None) or os.path.getmtime(path), path))
+            if cursor.rowcount == 0:  # by another process (perf_history.py scan)
+                self.db.rollback()
+                return None
+            self.db.executemany('INSERT INTO results (run_id, test, params, status, %s, samples, outliers) '
+                                'VALUES (?, ?, ?, ?, %s, ?, ?)' % (', '.join(METRICS), ', '.join(['?'] * len(METRICS))),
+                                [(cursor.lastrowid, r['test'], r['params'], r['status']) + tuple([r[m] for m in METRICS]) +
+                                 (r['samples'], r['outliers']) for r in rows])
+            self.db.commit()
+        return len(rows)
+
+    def getTimeSeries(self, test, params='', builder=None, platform=None, since=None, metric='median', pullrequests=False):
+        '''
+        Values of test case metric (ms), oldest first: list of (timestamp, revision, builder, platform, value).
+        Pull request runs are excluded by default.
+        '''
+        assert metric in METRICS
+        query = 'SELECT runs.timestamp, runs.revision, runs.builder, runs.platform, results.%s ' \
+                'FROM results JOIN runs ON runs.id = results.run_id ' \
+                'WHERE results.test = ? AND results.params = ? AND results.%s IS NOT NULL' % (metric, metric)
+        args = [test, params]
+        for (column, value) in [('builder', builder), ('platform', platform)]:
+            if value is not None:
+                query += ' AND runs.%s = ?' % column
+                args.append(value)
+        if since is not None:
+            query += ' AND runs.timestamp >= ?'
+            args.append(since)
+        if not pullrequests:
+            query += ' AND runs.pullrequest IS NULL'
+        query += ' ORDER BY runs.timestamp'
+        return self.query(query, args)
+
+    def getPercentiles(self, test, params='', builder=None, platform=None, percentiles=(50, 90), metric='median', limit=None):
+        ''' Returns {percentile: value} of last runs or None if there is no history '''
+        values = sorted([r[4] for r in self.getTimeSeries(test, params, builder, platform, metric=metric)[-(limit or self.HISTORY_LIMIT):]])
+        if not values:
+            return None
+        return dict([(p, history_store.percentile(values, p)) for p in percentiles])
+
+    def getTests(self, module=None, builder=None):
+        ''' List of (test, params) '''
+        query = 'SELECT DISTINCT results.test, results.params FROM results JOIN runs ON runs.id = results.run_id WHERE 1'
+        args = []
+        for (column, value) in [('module', module), ('builder', builder)]:
+            if value is not None:
+                query += ' AND runs.%s = ?' % column
+                args.append(value)
+        return self.query(query + ' ORDER BY 1, 2', args)
+
+    def enqueue(self, path, info=None):
+        ''' Ingest file by writer thread (XML parsing doesn't block the master) '''
+        self.submit(self._ingestLogged, path, info)
+
+    def scan(self, directory):
+        ''' Enqueue perf XML files of directory tree which are not ingested yet '''
+        count = 0
+        for (root, dirs, names) in os.walk(directory):
+            for name in sorted(names):
+                if FILE_NAME.match(name):
+                    self.enqueue(os.path.join(root, name))
+                    count += 1
+        return count
+
+    def _ingestLogged(self, path, info):
+        try:
+            count = self.ingest(path, info)
+            if count is not None:
+                trace('Perf history: %d results are stored from %s' % (count, path))
+        except:
+            import traceback
+            trace('Perf history: can\'t ingest %s: %s' % (path, traceback.format_exc()))
+
+
+def getStore(path=DB_PATH):
+    return history_store.getStore(PerfHistoryStore, path)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Perf results history')
+    parser.add_argument('--db', default=DB_PATH)
+    commands = parser.add_subparsers(dest='command')
+    scan = commands.add_parser('scan', help='ingest perf XML files of directories')
+    scan.add_argument('directories', nargs='+')
+    series = commands.add_parser('series', help='print time series of test case')
+    series.add_argument('test')
+    series.add_argument('params', nargs='?', default='')
+    series.add_argument('--builder')
+    series.add_argument('--platform')
+    series.add_argument('--metric', default='median', choices=METRICS)
+    args = parser.parse_args()
+
+    store = getStore(args.db)
+    if args.command == 'scan':
+        print('Files: %d' % sum([store.scan(d) for d in args.directories]))
+        store.flush()
+    else:
+        for (timestamp, revision, builder, platform, value) in store.getTimeSeries(
+                args.test, args.params, args.builder, args.platform, metric=args.metric):
+            print('%s %s %s %s %.3f' % (time.strftime('%Y-%m-%d %H:%M', time.localtime(timestamp)), revision, builder, platform or '-', value))
+        print(store.getPercentiles(args.test, args.params, args.builder, args.platform, metric=args.metric))
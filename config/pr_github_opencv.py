@@ -13,6 +13,7 @@ import pullrequest.context
 from pullrequest.utils import JSONClient
 
 import constants
+import supersede
 
 userAgent = 'BuildBot GitHub PullRequest v1.0'
 githubAccessToken = os.environ.pop('GITHUB_APIKEY')
@@ -241,6 +242,9 @@ class GitHubContext(pullrequest.context.Context):
         self.pushBuildProperty(properties, pr.description, 'test_bigdata[-:]' + re_builder, 'test_bigdata')
 
         _processProperty('test_module[s]?_force', 'modules_force')
+        _processProperty('test_impact', 'test_impact')
+        _processProperty('test_retry', 'test_retry')
+        _processProperty('test_failfast', 'test_failfast')
 
         self.pushBuildProperty(properties, pr.description, 'docker_image[-:]' + re_builder, 'build_image')
         self.pushBuildProperty(properties, pr.description, 'build_image[-:]' + re_builder, 'build_image')
@@ -271,6 +275,10 @@ class GitHubContext(pullrequest.context.Context):
 
         _processProperty('build_gapi_standalone', 'build_gapi_standalone')
 
+        supersedeKey = supersede.getKey(self.repo, pr.prid, b.name)
+        properties.setProperty(supersede.SUPERSEDE_KEY_PROPERTY, supersedeKey, 'Pull request')
+        supersede.scheduled(supersedeKey, pr.head_sha)
+
 
     @defer.inlineCallbacks
     def getBuildProperties(self, pr, b, properties, sourcestamps):
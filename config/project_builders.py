@@ -7,6 +7,7 @@ import constants
 from constants import trace, PLATFORM_ANY, PLATFORM_DEFAULT, PLATFORM_SKYLAKE, PLATFORM_SKYLAKE_X
 
 import buildbot_passwords
+import concurrency_controller
 from buildbot.buildslave import BuildSlave
 
 INTEL_COMPILER_TOOLSET_CURRENT=('-icc17', 'Intel C++ Compiler 17.0')
@@ -15,7 +16,9 @@ INTEL_COMPILER_DOCKER_CURRENT=('-icc17', 'ubuntu-icc:16.04')
 workers = []
 for worker in constants.worker:
     trace("Register worker: " + worker + " with passwd=*** and params=(%s)" % constants.worker[worker])
-    workers.append(BuildSlave(worker, buildbot_passwords.worker[worker], **(constants.worker[worker])))
+    params = dict(constants.worker[worker])
+    params['max_builds'] = concurrency_controller.getController().getMaxBuilds(worker, params['max_builds'])  # upper bound
+    workers.append(BuildSlave(worker, buildbot_passwords.worker[worker], **params))
 
 platforms = [
     PLATFORM_DEFAULT,
@@ -192,6 +195,7 @@ from factory_linux import LinuxPrecommitFactory
 from factory_valgrind import ValgrindFactory
 from factory_coverage import CoverageFactory
 from factory_winpack import WinPackBuild, WinPackBindings, WinPackDocs, WinPackTest, WinPackController, WinPackCreate, WinPackUpload
+from nightly_planner import NightlyPlanner
 
 # Current "top-level" factory
 OpenCVBuildFactory = factory_ocl.OCL_factory
@@ -206,6 +210,7 @@ def addConfiguration(descriptor):
     schedulers = schedulers + new_schedulers
 
 # Nightly builders
+nightlyPlanner = NightlyPlanner()
 for branch in ['2.4', '3.4', 'master', 'next']:
     genNightly = True
     if branch == '4.x' or branch == 'master':
@@ -228,6 +233,7 @@ for branch in ['2.4', '3.4', 'master', 'next']:
     addConfiguration(
         SetOfBuildersWithSchedulers(branch=branch, nameprefix='check-',
             genForce=True, genNightly=genNightly, nightlyHour=23, nightlyMinute=nightlyMinute,
+            nightlyPlanner=nightlyPlanner, nightlyWindow=90,
             builders=[
                 SetOfBuilders(
                     factory_class=OpenCVBuildFactory,
@@ -592,6 +598,7 @@ for branch in ['2.4', '3.4', 'master', 'next']:
         addConfiguration(
             SetOfBuildersWithSchedulers(branch=branch, nameprefix='checkcontrib-',
                 genForce=True, genNightly=genNightly, nightlyHour=23, nightlyMinute=20 + nightlyMinute,
+                nightlyPlanner=nightlyPlanner, nightlyWindow=90,
                 builders=[
                     # OpenCV Contrib
                     SetOfBuilders(
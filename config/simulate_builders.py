@@ -0,0 +1,468 @@
+#!/usr/bin/env python
+'''
+Offline discrete-event simulator of builds scheduling.
+
+Loads builders and nightly schedulers from project_builders.py (against stubbed buildbot modules,
+see bench_config_load.py), automatic pull request builders from pr_github_opencv*.py, workers from
+constants.worker and build durations from duration_store. Replays one day of traffic and reports
+queue times, worker utilization and makespan for each scheduling policy, so capacity changes
+(max_builds, new workers) can be evaluated without touching master.
+
+Usage (from "config" directory, with the same Python as master):
+
+    python simulate_builders.py                                # schedulers of today + 40 pull request updates
+    python simulate_builders.py --day-of-week 5 --prs 80
+    python simulate_builders.py --replay-date 2026-10-12       # builds recorded in durations database
+    python simulate_builders.py --max-builds linux-2=2 --clone-worker linux-1=linux-7
+
+Policy is a combination of build requests order and worker selection:
+- order: 'fifo' (submission time) or 'priority' (build_priority.BuildPriorityPolicy sort key),
+- worker: 'random' (buildbot default), 'first' (first worker of builder) or 'load' (worker_selection.LoadAwarePolicy).
+
+Model: a builder runs at most one build per worker, sum of builder weights (BuilderNewStyle.buildWeight)
+on a busy worker doesn't exceed its max_builds. Duration of each build is sampled from recorded history
+(the same sample for all policies), builders without history use BuildPriorityPolicy.DEFAULT_DURATION.
+Replayed builds are submitted at their recorded start time (queue time is not stored).
+'''
+import heapq
+import json
+import os
+import random
+import sys
+import time
+
+CONFIG_DIR = os.path.abspath(os.path.dirname(__file__))
+DAY = 24 * 3600
+
+ORDERS = ['fifo', 'priority']
+SELECTIONS = ['random', 'first', 'load']
+DEFAULT_POLICIES = ['fifo+random', 'priority+random', 'priority+load']
+
+
+class Builder(object):
+
+    def __init__(self, name, workers, tags, weight, requestClass):
+        self.name = name
+        self.workers = list(workers)
+        self.tags = tags
+        self.weight = weight
+        self.requestClass = requestClass
+
+
+class Worker(object):
+
+    def __init__(self, name, maxBuilds, cpus):
+        self.name = name
+        self.maxBuilds = maxBuilds
+        self.cpus = cpus
+        self.running = []  # running requests
+        self.builds = 0
+        self.busyTime = 0.0  # sum of build durations multiplied by builder weights
+
+    def canStart(self, builder, getWeight):
+        if builder.name in [r.builder for r in self.running]:
+            return False  # single slavebuilder per builder
+        if not self.running:
+            return True
+        weight = sum([getWeight(r.builder) for r in self.running]) + builder.weight
+        return weight <= self.maxBuilds + 1e-6
+
+
+class Request(object):
+
+    def __init__(self, builder, submitted, duration, source):
+        self.builder = builder
+        self.submitted = submitted  # seconds since midnight
+        self.duration = duration
+        self.source = source
+
+
+#
+# Configuration
+#
+def loadConfiguration():
+    '''
+    Loads project_builders.py in current process.
+    Returns (builders: name -> Builder, nightly schedulers: list of dict, pull request builders: list of name lists)
+    '''
+    sys.path.insert(0, CONFIG_DIR)
+    import bench_config_load
+    bench_config_load.installStubs()
+    for name in ['DEBUG', 'BUILDBOT_MANUAL']:  # schedulers and automatic pull request builders are disabled there
+        os.environ.pop(name, None)
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        import project_builders
+        import pr_github_opencv
+        import pr_github_opencv_contrib
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    import build_priority
+    import concurrency_controller
+    policy = build_priority.defaultPolicy
+    controller = concurrency_controller.getController()
+
+    builders = {}
+    for b in project_builders.builders:
+        builders[b.name] = Builder(b.name, b.slavenames, b.tags, controller.getBuilderWeight(b.name),
+                                   policy.getBuilderClass(b.tags))
+
+    nightly = []
+    for s in project_builders.schedulers:
+        if type(s).__name__ == 'Nightly':
+            nightly.append(dict(name=s.name, hour=s.hour, minute=s.minute, dayOfWeek=s.dayOfWeek,
+                                builderNames=list(s.builderNames)))
+
+    class _PullRequest(object):
+        description = ''
+        branch = 'master'
+
+    prBuilders = []
+    for module in [pr_github_opencv, pr_github_opencv_contrib]:
+        context = module.GitHubContext.__new__(module.GitHubContext)
+        # no pull request description / branch checks (pullrequest.context is not available offline)
+        context.extractParameterEx = lambda *args, **kwargs: None
+        context.isBadBranch = context.isWIP = lambda pr: False
+        names = []
+        for bid in context.getListOfAutomaticBuilders(_PullRequest()):
+            names += [n for n in context.builders[bid]['builders'] if n in builders]
+        prBuilders.append(names)
+    return (builders, nightly, prBuilders)
+
+
+def loadWorkers(maxBuilds=None, clones=None):
+    '''
+    Workers from constants.worker.
+    maxBuilds - {worker: max_builds}, 0 removes worker
+    clones - list of (existing worker, new worker), new worker has the same settings and builders
+    '''
+    import constants
+    settings = dict(constants.worker)
+    for (src, dst) in clones or []:
+        settings[dst] = settings[src]
+    workers = {}
+    for (name, s) in settings.items():
+        n = (maxBuilds or {}).get(name, s.get('max_builds', 1))
+        if n > 0:
+            workers[name] = Worker(name, n, s.get('properties', {}).get('CPUs', 1))
+    return workers
+
+
+class DurationModel(object):
+    ''' Recorded build durations (duration_store), default value for builders without history '''
+
+    def __init__(self, store=None, default=None):
+        import build_priority
+        self.store = store
+        self.default = default or build_priority.BuildPriorityPolicy.DEFAULT_DURATION
+        self.history = {}
+
+    def getHistory(self, builder):
+        if builder not in self.history:
+            self.history[builder] = self.store.getDurations(builder) if self.store is not None else []
+        return self.history[builder]
+
+    def predict(self, builder):
+        history = sorted(self.getHistory(builder))
+        return history[len(history) // 2] if history else self.default
+
+    def sample(self, builder, rng):
+        history = self.getHistory(builder)
+        return rng.choice(history) if history else self.default
+
+
+#
+# Traffic
+#
+def _asList(value, allValues):
+    if value == '*':
+        return list(allValues)
+    if isinstance(value, (list, tuple)):
+        return [int(v) for v in value]
+    return [int(value)]
+
+
+def generateDay(builders, nightly, prBuilders, durations, dayOfWeek, prs=40, contribShare=0.3, prHours=(6, 22), seed=0):
+    ''' Nightly schedulers of the day plus pull request updates uniformly distributed over prHours '''
+    rng = random.Random(seed)
+    requests = []
+    for s in nightly:
+        if s['dayOfWeek'] != '*' and dayOfWeek not in _asList(s['dayOfWeek'], range(7)):
+            continue
+        for hour in _asList(s['hour'], range(24)):
+            for minute in _asList(s['minute'], range(60)):
+                for name in s['builderNames']:
+                    if name in builders:
+                        requests.append(Request(name, (hour * 60 + minute) * 60, durations.sample(name, rng), s['name']))
+    for i in range(prs):
+        submitted = rng.uniform(prHours[0], prHours[1]) * 3600
+        names = prBuilders[1] if rng.random() < contribShare else prBuilders[0]
+        for name in names:
+            requests.append(Request(name, submitted, durations.sample(name, rng), 'pr%d' % i))
+    return requests
+
+
+def replayDay(builders, store, date):
+    ''' Builds started at date (YYYY-MM-DD, local time) from durations database '''
+    dayStart = time.mktime(time.strptime(date, '%Y-%m-%d'))
+    requests = []
+    for (builder, worker, finishedAt, duration, result) in store.getBuilds(dayStart, dayStart + 2 * DAY):
+        submitted = finishedAt - duration - dayStart
+        if builder in builders and 0 <= submitted < DAY:
+            requests.append(Request(builder, submitted, duration, 'replay'))
+    return requests
+
+
+#
+# Simulation
+#
+def _createLoadAwarePolicy():
+    import worker_selection
+
+    class SimulatedLoadAwarePolicy(worker_selection.LoadAwarePolicy):
+        ''' Worker objects instead of slavebuilders, simulation time instead of wall time '''
+
+        def __init__(self):
+            self.now = 0
+            self.recentLoad = {}
+
+        def getWorkerName(self, w):
+            return w.name
+
+        def getMaxBuilds(self, w):
+            return w.maxBuilds
+
+        def getCPUs(self, w):
+            return w.cpus
+
+        def getRunningBuilds(self, w):
+            return len(w.running)
+
+        def getRecentLoad(self, name, now=None):
+            (load, timestamp) = self.recentLoad.get(name, (0.0, 0))
+            return load * 0.5 ** ((self.now - timestamp) / float(self.RECENT_LOAD_HALF_LIFE))
+
+        def addRecentLoad(self, name, value=1.0):
+            self.recentLoad[name] = (self.getRecentLoad(name) + value, self.now)
+
+    return SimulatedLoadAwarePolicy()
+
+
+class Simulation(object):
+
+    def __init__(self, builders, workers, durations, order='fifo', selection='random', seed=0):
+        assert order in ORDERS, order
+        assert selection in SELECTIONS, selection
+        import build_priority
+        self.builders = builders
+        self.workers = workers
+        self.durations = durations
+        self.order = order
+        self.selection = selection
+        self.rng = random.Random(seed)
+        self.priorityPolicy = build_priority.BuildPriorityPolicy()
+        self.loadPolicy = _createLoadAwarePolicy() if selection == 'load' else None
+        self.predicted = {}
+
+    def getWeight(self, builderName):
+        return self.builders[builderName].weight
+
+    def getSortKey(self, r, now):
+        if self.order == 'fifo':
+            return (r.submitted, r.builder)
+        if r.builder not in self.predicted:
+            self.predicted[r.builder] = self.durations.predict(r.builder)
+        builder = self.builders[r.builder]
+        return (self.priorityPolicy.getSortKey(builder.requestClass, self.predicted[r.builder], r.submitted, now),
+                r.submitted, r.builder)
+
+    def selectWorker(self, candidates, now):
+        if self.selection == 'first':
+            return candidates[0]
+        if self.selection == 'random':
+            return self.rng.choice(candidates)
+        self.loadPolicy.now = now
+        return sorted([(self.loadPolicy.score(w), -w.cpus, w.name, w) for w in candidates])[0][-1]
+
+    def run(self, requests):
+        ''' Returns {request: (start time, worker name)}, not started requests are missing '''
+        events = []  # (time, kind, sequence, data): finished builds are processed before new requests
+        for (i, r) in enumerate(requests):
+            events.append((r.submitted, 1, i, r))
+        heapq.heapify(events)
+        sequence = len(requests)
+        pending = []
+        started = {}
+        while events:
+            now = events[0][0]
+            while events and events[0][0] == now:
+                (_, kind, _, data) = heapq.heappop(events)
+                if kind == 0:
+                    (worker, r) = data
+                    worker.running.remove(r)
+                else:
+                    pending.append(data)
+            for r in sorted(pending, key=lambda r: self.getSortKey(r, now)):
+                builder = self.builders[r.builder]
+                candidates = [self.workers[w] for w in builder.workers
+                              if w in self.workers and self.workers[w].canStart(builder, self.getWeight)]
+                if not candidates:
+                    continue
+                worker = self.selectWorker(candidates, now)
+                if self.loadPolicy is not None:
+                    self.loadPolicy.addRecentLoad(worker.name)
+                worker.running.append(r)
+                worker.builds += 1
+                worker.busyTime += r.duration * builder.weight
+                started[r] = (now, worker.name)
+                pending.remove(r)
+                heapq.heappush(events, (now + r.duration, 0, sequence, (worker, r)))
+                sequence += 1
+        return started
+
+
+def _percentile(sortedValues, p):
+    if not sortedValues:
+        return 0.0
+    return sortedValues[min(len(sortedValues) - 1, int(round((len(sortedValues) - 1) * p / 100.0)))]
+
+
+def summarize(policy, builders, workers, requests, started):
+    waits = {}
+    finished = []
+    scheduledFinished = []
+    for r in requests:
+        if r not in started:
+            continue
+        (start, _) = started[r]
+        requestClass = builders[r.builder].requestClass
+        waits.setdefault(requestClass, []).append(start - r.submitted)
+        finished.append(start + r.duration)
+        if requestClass != 'precommit':
+            scheduledFinished.append(start + r.duration)
+    first = min([r.submitted for r in requests]) if requests else 0
+    makespan = max(finished) - first if finished else 0
+    classes = {}
+    for (requestClass, values) in waits.items():
+        values = sorted(values)
+        classes[requestClass] = dict(builds=len(values), wait_avg=sum(values) / len(values),
+                                     wait_p50=_percentile(values, 50), wait_p90=_percentile(values, 90),
+                                     wait_max=values[-1])
+    return dict(
+        policy=policy,
+        requests=len(requests),
+        unserved=len(requests) - len(started),
+        makespan=makespan,
+        scheduled_done=max(scheduledFinished) if scheduledFinished else None,
+        classes=classes,
+        workers=dict([(w.name, dict(builds=w.builds, busy=w.busyTime,
+                                    utilization=w.busyTime / (w.maxBuilds * makespan) if makespan else 0.0))
+                      for w in workers.values()]),
+    )
+
+
+def simulate(builders, requests, durations, policies, maxBuilds=None, clones=None, seed=0):
+    for (src, dst) in clones or []:
+        for b in builders.values():
+            if src in b.workers and dst not in b.workers:
+                b.workers.append(dst)
+    results = []
+    for policy in policies:
+        (order, selection) = policy.split('+')
+        workers = loadWorkers(maxBuilds, clones)
+        sim = Simulation(builders, workers, durations, order, selection, seed)
+        results.append(summarize(policy, builders, workers, requests, sim.run(requests)))
+    return results
+
+
+#
+# Report
+#
+def _fmtTime(seconds):
+    if seconds is None:
+        return '-'
+    minutes = int(round(seconds / 60.0))
+    return '%d:%02d' % (minutes // 60, minutes % 60)
+
+
+def report(results):
+    print('%-18s %-10s %7s %9s %9s %9s %9s' % ('Policy', 'class', 'builds', 'wait avg', 'wait p50', 'wait p90', 'wait max'))
+    for res in results:
+        for (requestClass, c) in sorted(res['classes'].items()):
+            print('%-18s %-10s %7d %9s %9s %9s %9s' % (res['policy'], requestClass, c['builds'], _fmtTime(c['wait_avg']),
+                  _fmtTime(c['wait_p50']), _fmtTime(c['wait_p90']), _fmtTime(c['wait_max'])))
+    print('')
+    print('%-18s %9s %15s %9s' % ('Policy', 'makespan', 'scheduled done', 'unserved'))
+    for res in results:
+        print('%-18s %9s %15s %9d' % (res['policy'], _fmtTime(res['makespan']), _fmtTime(res['scheduled_done']),
+                                      res['unserved']))
+    print('')
+    names = sorted(results[0]['workers'].keys()) if results else []
+    print('%-18s %s' % ('Utilization', ' '.join(['%10s' % n for n in names])))
+    for res in results:
+        print('%-18s %s' % (res['policy'], ' '.join(['%9d%%' % int(res['workers'][n]['utilization'] * 100) for n in names])))
+
+
+def _parseAssignments(values, convert):
+    res = []
+    for v in values or []:
+        (name, value) = v.split('=', 1)
+        res.append((name, convert(value)))
+    return res
+
+
+def main():
+    import argparse
+    import duration_store
+    parser = argparse.ArgumentParser(description='Offline simulation of buildbot builds scheduling')
+    parser.add_argument('--policies', default=','.join(DEFAULT_POLICIES),
+                        help='comma separated ORDER+WORKER policies, ORDER: %s, WORKER: %s' % ('/'.join(ORDERS), '/'.join(SELECTIONS)))
+    parser.add_argument('--durations-db', default=duration_store.DB_PATH, help='durations database (duration_store.py)')
+    parser.add_argument('--replay-date', help='replay builds started at YYYY-MM-DD from durations database')
+    parser.add_argument('--day-of-week', type=int, default=time.localtime().tm_wday, help='0 - Monday (buildbot Nightly)')
+    parser.add_argument('--prs', type=int, default=40, help='pull request updates per day')
+    parser.add_argument('--contrib-share', type=float, default=0.3, help='share of opencv_contrib pull requests')
+    parser.add_argument('--pr-hours', default='6-22', help='pull request updates time range, hours')
+    parser.add_argument('--max-builds', action='append', metavar='WORKER=N', help='override max_builds (0 removes worker)')
+    parser.add_argument('--clone-worker', action='append', metavar='WORKER=NEW', help='add worker with the same settings and builders')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results into JSON file')
+    args = parser.parse_args()
+
+    policies = [p.strip() for p in args.policies.split(',') if p.strip()]
+    for p in policies:
+        if p.count('+') != 1 or p.split('+')[0] not in ORDERS or p.split('+')[1] not in SELECTIONS:
+            parser.error('invalid policy: %s' % p)
+
+    (builders, nightly, prBuilders) = loadConfiguration()
+    store = None
+    if os.path.exists(args.durations_db):
+        store = duration_store.DurationStore(args.durations_db)
+    else:
+        print('Durations database is not found: %s (default build duration is used)' % args.durations_db)
+    durations = DurationModel(store)
+
+    if args.replay_date:
+        if store is None:
+            parser.error('--replay-date requires durations database')
+        requests = replayDay(builders, store, args.replay_date)
+    else:
+        prHours = [float(v) for v in args.pr_hours.split('-')]
+        requests = generateDay(builders, nightly, prBuilders, durations, args.day_of_week,
+                               args.prs, args.contrib_share, prHours, args.seed)
+    print('Builders: %d, requests: %d' % (len(builders), len(requests)))
+
+    results = simulate(builders, requests, durations, policies,
+                       dict(_parseAssignments(args.max_builds, int)),
+                       _parseAssignments(args.clone_worker, str), args.seed)
+    report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
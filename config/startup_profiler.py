@@ -0,0 +1,138 @@
+'''
+Opt-in profiler of buildbot master startup phases.
+
+Enabled by BUILDBOT_STARTUP_PROFILE environment variable.
+Phase timestamps are written as JSON report into /data/logs (BUILDBOT_STARTUP_PROFILE_DIR)
+when all tracked phases are completed (or after REPORT_TIMEOUT seconds).
+'''
+import json
+import os
+import socket
+import time
+
+ENABLED = os.environ.get('BUILDBOT_STARTUP_PROFILE', '0') not in ['', '0', 'false', 'False']
+REPORT_DIR = os.environ.get('BUILDBOT_STARTUP_PROFILE_DIR', '/data/logs')
+REPORT_TIMEOUT = 30 * 60
+
+_startTime = None
+_phases = []  # list of dict(name, start, end), in start order
+_pending = set()
+_reported = False
+
+
+def start():
+    ''' Called once from buildbot.tac, all timestamps are relative to this call '''
+    global _startTime
+    if not ENABLED or _startTime is not None:
+        return
+    _startTime = time.time()
+    print 'Startup profiler: enabled, report directory: %s' % REPORT_DIR
+    from twisted.internet import reactor
+    reactor.callLater(REPORT_TIMEOUT, writeReport, True)
+
+
+def isActive():
+    return _startTime is not None and not _reported
+
+
+def _now():
+    return time.time() - _startTime
+
+
+def _findPhase(name):
+    for p in reversed(_phases):
+        if p['name'] == name:
+            return p
+    return None
+
+
+def phaseStart(name):
+    if not isActive() or _findPhase(name) is not None:
+        return  # only the first occurrence is measured (master.py is re-executed on reconfig)
+    _phases.append(dict(name=name, start=_now(), end=None))
+    _pending.add(name)
+
+
+def phaseEnd(name, failed=False):
+    if not isActive():
+        return
+    p = _findPhase(name)
+    if p is None or p['end'] is not None:
+        return
+    p['end'] = _now()
+    if failed:
+        p['failed'] = True
+    print 'Startup profiler: %s: %.3fs (at %.3fs)' % (name, p['end'] - p['start'], p['end'])
+    _pending.discard(name)
+    if not _pending:
+        writeReport()
+
+
+def expectPhase(name):
+    ''' Phase which is started later (from twisted callbacks), report waits for it '''
+    if isActive() and _findPhase(name) is None:
+        _pending.add(name)
+
+
+def wrapMethod(obj, methodName, name, once=True):
+    '''
+    Measure first call of obj.methodName() as 'name' phase.
+    Deferred results are measured until they are fired.
+    '''
+    if not isActive():
+        return
+    from twisted.internet import defer
+    from twisted.python import failure
+    method = getattr(obj, methodName)
+    expectPhase(name)
+
+    def onResult(res):
+        phaseEnd(name, failed=isinstance(res, failure.Failure))
+        return res
+
+    def wrapper(*args, **kwargs):
+        if once and _findPhase(name) is not None:
+            return method(*args, **kwargs)
+        phaseStart(name)
+        try:
+            res = method(*args, **kwargs)
+        except:
+            phaseEnd(name, failed=True)
+            raise
+        if isinstance(res, defer.Deferred):
+            res.addBoth(onResult)
+        else:
+            phaseEnd(name)
+        return res
+    setattr(obj, methodName, wrapper)
+
+
+def getReport(timeout=False):
+    return dict(
+        host=socket.gethostname(),
+        pid=os.getpid(),
+        start_time=_startTime,
+        complete=not timeout and not _pending,
+        pending=sorted(_pending),
+        total=max([p['end'] for p in _phases if p['end'] is not None] or [0]),
+        phases=[dict(p, duration=(p['end'] - p['start']) if p['end'] is not None else None) for p in _phases]
+    )
+
+
+def writeReport(timeout=False):
+    global _reported
+    if not isActive():
+        return
+    report = getReport(timeout)
+    _reported = True
+    fileName = os.path.join(REPORT_DIR, 'startup_profile-%s.json' % time.strftime('%Y%m%d-%H%M%S', time.localtime(_startTime)))
+    try:
+        with open(fileName, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        latest = os.path.join(REPORT_DIR, 'startup_profile.json')
+        with open(latest, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print 'Startup profiler: %.3fs total, report: %s%s' % (report['total'], fileName, ' (timeout)' if timeout else '')
+    except:
+        import traceback
+        traceback.print_exc()
@@ -0,0 +1,111 @@
+'''
+Supersession of pull request builds.
+
+When build for newer head_sha of pull request is scheduled (GitHubContext.applyBuildCommonOptions()),
+running builds of older head_sha with the same supersede key (repository, pull request, PR builder)
+are stopped, queued build requests are cancelled in BuilderNewStyle.nextBuild().
+Stopped builds get 'superseded_by' property, stopped builds and cancelled requests are listed
+in 'superseded' property of the build of the newer head_sha.
+'''
+import weakref
+
+from constants import trace
+
+SUPERSEDE_KEY_PROPERTY = 'supersede_key'
+SUPERSEDED_PROPERTY = 'superseded'
+
+# supersede key -> head_sha of the latest scheduled build
+_latestHeads = {}
+# running pull request builds: build -> (supersede key, head_sha)
+_runningBuilds = weakref.WeakKeyDictionary()
+# supersede key -> stopped builds / cancelled requests which are not reported yet (the newer build is not started)
+_pendingRecords = {}
+
+
+def getKey(repo, prid, prBuilder):
+    return '%s/%s/%s' % (repo, prid, prBuilder)
+
+
+def _getProperty(props, name):
+    try:
+        return props.getProperty(name, None)
+    except AttributeError:
+        return None
+
+
+def _addSupersededProperty(build, records):
+    value = list(_getProperty(build, SUPERSEDED_PROPERTY) or []) + records
+    build.setProperty(SUPERSEDED_PROPERTY, value, 'Supersede', runtime=True)
+
+
+def recordSuperseded(key, record):
+    ''' Report stopped build / cancelled request in the build of the latest head_sha '''
+    latest = _latestHeads.get(key, None)
+    for (build, (buildKey, buildSha)) in list(_runningBuilds.items()):
+        if buildKey == key and buildSha == latest:
+            _addSupersededProperty(build, [record])
+            return
+    _pendingRecords.setdefault(key, []).append(record)
+
+
+def isSuperseded(key, head_sha):
+    if key is None or head_sha is None:
+        return False
+    latest = _latestHeads.get(key, None)
+    return latest is not None and latest != head_sha
+
+
+def scheduled(key, head_sha):
+    ''' New build is scheduled: stop running builds of previous commits '''
+    previous = _latestHeads.get(key, None)
+    _latestHeads[key] = head_sha
+    if previous is None or previous == head_sha:
+        return
+    for (build, (buildKey, buildSha)) in list(_runningBuilds.items()):
+        if buildKey == key and buildSha != head_sha:
+            stopBuild(build, key, buildSha, head_sha)
+
+
+def stopBuild(build, key, buildSha, head_sha):
+    reason = 'Superseded by %s' % head_sha
+    trace('Supersede: stop build %s #%s: %s' % (build.builder.name, build.build_status.getNumber(), reason))
+    build.setProperty('superseded_by', head_sha, 'Supersede', runtime=True)
+    _runningBuilds.pop(build, None)
+    build.stopBuild(reason)
+    recordSuperseded(key, 'build %s #%s (%s): stopped' % (build.builder.name, build.build_status.getNumber(), buildSha))
+
+
+def buildStarted(build):
+    key = _getProperty(build, SUPERSEDE_KEY_PROPERTY)
+    head_sha = _getProperty(build, 'head_sha')
+    if key is None or head_sha is None:
+        return
+    if isSuperseded(key, head_sha):
+        stopBuild(build, key, head_sha, _latestHeads[key])  # request was taken before supersession check
+        return
+    _runningBuilds[build] = (key, head_sha)
+    records = _pendingRecords.pop(key, None)
+    if records:
+        _addSupersededProperty(build, records)
+
+
+def buildFinished(build):
+    _runningBuilds.pop(build, None)
+
+
+def filterRequests(bldr, requests):
+    ''' Cancel build requests of superseded commits, returns other requests '''
+    res = []
+    for breq in requests:
+        key = _getProperty(breq.properties, SUPERSEDE_KEY_PROPERTY)
+        head_sha = _getProperty(breq.properties, 'head_sha')
+        if not isSuperseded(key, head_sha):
+            res.append(breq)
+            continue
+        trace('Supersede: cancel build request %s on %s (%s): superseded by %s' % (
+                breq.id, bldr.name, head_sha, _latestHeads[key]))
+        d = breq.cancelBuildRequest()
+        d.addCallback(lambda _, key=key, record='build request %s on %s (%s): cancelled' % (breq.id, bldr.name, head_sha):
+                      recordSuperseded(key, record))
+        d.addErrback(lambda f: trace('Can\'t cancel build request: %s' % f))
+    return res
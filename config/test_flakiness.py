@@ -0,0 +1,93 @@
+'''
+Flaky test cases.
+
+Failed gtest cases are re-run by CommandTestCPP (see command_test_cpp.py) with --gtest_filter on the same worker.
+Results of re-runs are stored into SQLite database next to buildbot state.sqlite
+(one row per re-run test case: 'flaky' - passed on re-run, 'failed' - failed again).
+
+    import test_flakiness
+    test_flakiness.getStore().getRepeatOffenders()  # [(test, flakes, builders), ...]
+'''
+import os
+import time
+
+from constants import trace
+import history_store
+
+DB_PATH = os.environ.get('BUILDBOT_FLAKES_DB', '/data/db/flakes.sqlite')
+FLAKY = 'flaky'
+FAILED = 'failed'
+
+
+class FlakinessStore(history_store.SQLiteStore):
+
+    KEEP_DAYS = 180
+    REPEAT_DAYS = 14  # window for repeat offenders
+    REPEAT_MIN_FLAKES = 3
+
+    def __init__(self, path=DB_PATH):
+        history_store.SQLiteStore.__init__(self, path)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS reruns (
+            id INTEGER PRIMARY KEY,
+            builder TEXT NOT NULL,
+            step TEXT NOT NULL,
+            test TEXT NOT NULL,
+            result TEXT NOT NULL,
+            worker TEXT,
+            buildnumber INTEGER,
+            finished_at REAL NOT NULL)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS reruns_test ON reruns (test, finished_at)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS reruns_finished ON reruns (finished_at)')
+        self.db.commit()
+        self.submit(self._cleanup)
+
+    def _cleanup(self):
+        self.execute('DELETE FROM reruns WHERE finished_at < ?', [(time.time() - self.KEEP_DAYS * 24 * 3600,)])
+
+    def recordMany(self, rows):
+        ''' rows: list of (builder, step, test, result, worker, buildnumber, finishedAt), stored by writer thread '''
+        now = time.time()
+        self.submit(self.execute, 'INSERT INTO reruns (builder, step, test, result, worker, buildnumber, finished_at) '
+                                  'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [tuple(r[:6]) + (r[6] or now,) for r in rows])
+
+    def getFlakes(self, test, days=REPEAT_DAYS):
+        ''' Number of flaky runs of test case during last days '''
+        return self.query('SELECT COUNT(*) FROM reruns WHERE test = ? AND result = ? AND finished_at >= ?',
+                          (test, FLAKY, time.time() - days * 24 * 3600))[0][0]
+
+    def getRepeatOffenders(self, days=REPEAT_DAYS, minFlakes=REPEAT_MIN_FLAKES):
+        ''' Test cases with at least minFlakes flaky runs: list of (test, flakes, builders), most flaky first '''
+        rows = self.query('SELECT test, COUNT(*), GROUP_CONCAT(DISTINCT builder) FROM reruns '
+                          'WHERE result = ? AND finished_at >= ? GROUP BY test HAVING COUNT(*) >= ? '
+                          'ORDER BY COUNT(*) DESC, test',
+                          (FLAKY, time.time() - days * 24 * 3600, minFlakes))
+        return [(test, count, sorted(builders.split(','))) for (test, count, builders) in rows]
+
+
+def getStore(path=DB_PATH):
+    return history_store.getStore(FlakinessStore, path)
+
+
+def recordReruns(step, flaky, failed):
+    '''
+    Store re-run results of test step, errors are logged only.
+    Returns {test: flaky runs during last REPEAT_DAYS} for flaky tests.
+    '''
+    try:
+        builder = step.getProperty('buildername', None)
+        worker = step.getProperty('slavename', None)
+        number = step.getProperty('buildnumber', None)
+        store = getStore()
+        res = dict([(t, store.getFlakes(t) + 1) for t in flaky])  # current run is not stored yet
+        store.recordMany([(builder, step.name, t, FLAKY, worker, number, None) for t in flaky] +
+                         [(builder, step.name, t, FAILED, worker, number, None) for t in failed])
+        for (t, count) in sorted(res.items()):
+            if count >= FlakinessStore.REPEAT_MIN_FLAKES:
+                trace('Repeatedly flaky test: %s (%d times during %d days, last: %s / %s)' % (
+                    t, count, FlakinessStore.REPEAT_DAYS, builder, step.name))
+        return res
+    except:
+        import traceback
+        trace('Can\'t store test re-runs: %s' % traceback.format_exc())
+        return {}
@@ -0,0 +1,108 @@
+'''
+Test impact selection for precommit builds (CommonFactory.selectImpactedTests).
+
+Changed files of merged pull request (git diff of got_revision..HEAD in opencv / opencv_contrib sources)
+are mapped to OpenCV modules via module locations from CMake cache of the build. Tests of changed modules,
+modules depending on them (flattened OPENCV_MODULE_<m>_DEPS) and bindings tests of wrapped modules
+are selected into 'test_impact_modules' property (CommonFactory.getTestList() applies it after tests blacklist).
+Changes of core, test framework, build system or unknown locations fall back to the full test suite.
+'''
+import json
+import re
+
+IMPACT_MARKER = 'TEST-IMPACT '  # see IMPACT_SCRIPT
+
+# Python script for worker (argv: CMakeCache.txt path, JSON list of [repository, source directory, base revision]).
+# Prints changed files per repository and OpenCV modules (location, dependencies, wrappers).
+IMPACT_SCRIPT = r'''
+import json, os, re, subprocess, sys
+(cmakeCache, repos) = (sys.argv[1], json.loads(sys.argv[2]))
+changes = {}
+roots = {}
+for (repo, path, base) in repos:
+    roots[repo] = os.path.realpath(path)
+    if not base:
+        continue
+    p = subprocess.Popen(['git', 'diff', '--name-only', base, 'HEAD'], cwd=path, stdout=subprocess.PIPE)
+    (out, _) = p.communicate()
+    if p.returncode == 0:
+        changes[repo] = [l.strip() for l in out.decode('utf-8', 'replace').splitlines() if l.strip()]
+modules = {}
+rx = re.compile(r'^OPENCV_MODULE_opencv_(\w+?)_(LOCATION|DEPS|WRAPPERS):INTERNAL=(.*)$')
+with open(cmakeCache) as f:
+    for line in f:
+        m = rx.match(line.strip())
+        if m:
+            modules.setdefault(m.group(1), {})[m.group(2).lower()] = m.group(3)
+res = {}
+for (name, m) in modules.items():
+    location = os.path.realpath(m.get('location', ''))
+    for (repo, root) in roots.items():
+        if location.startswith(root + os.sep):
+            res[name] = dict(repo=repo, path=os.path.relpath(location, root).replace(os.sep, '/'),
+                             deps=[d[len('opencv_'):] for d in m.get('deps', '').split(';') if d.startswith('opencv_')],
+                             wrappers=[w for w in m.get('wrappers', '').split(';') if w])
+print('TEST-IMPACT ' + json.dumps(dict(changes=changes, modules=res)))
+'''
+
+# files without influence on tests
+NO_TESTS_PATHS = re.compile(r'^(doc/|samples/|apps/|\.github/|(modules/)?[^/]*\.(md|txt)$|modules/[^/]+/(doc|samples|tutorials)/)')
+# files with influence on all tests
+FULL_SUITE_PATHS = re.compile(r'^(cmake/|3rdparty/|platforms/|include/|hal/|CMakeLists\.txt$|modules/CMakeLists\.txt$)')
+FULL_SUITE_MODULES = ['core', 'ts', 'world']
+BINDINGS_TESTS = dict(python=['python2', 'python3'], java=['java'])
+
+
+def parseImpactOutput(stdout):
+    ''' Returns dict(changes, modules) from IMPACT_SCRIPT output or None '''
+    for line in str(stdout).splitlines():
+        if line.startswith(IMPACT_MARKER):
+            try:
+                return json.loads(line[len(IMPACT_MARKER):])
+            except ValueError:
+                return None
+    return None
+
+
+def getImpactedTests(changes, modules, availableTests):
+    '''
+    changes - {repository: [changed files]}
+    modules - {module: dict(repo, path, deps, wrappers)}
+    Returns (list of tests or None for full test suite, reason)
+    '''
+    if not changes or not [f for files in changes.values() for f in files]:
+        return (None, 'no changes are detected')
+    changed = set()
+    bindings = set()
+    for (repo, files) in changes.items():
+        for f in files:
+            if repo == 'opencv' and FULL_SUITE_PATHS.match(f):
+                return (None, 'build system change: %s' % f)
+            if NO_TESTS_PATHS.match(f):
+                continue
+            module = None
+            for (name, m) in modules.items():
+                if m['repo'] == repo and f.startswith(m['path'] + '/'):
+                    module = name
+                    break
+            if module is None:
+                match = re.match(r'^modules/(python|java)/', f)
+                if match:
+                    bindings.add(match.group(1))
+                    continue
+                return (None, 'unknown location: %s/%s' % (repo, f))
+            if module in FULL_SUITE_MODULES:
+                return (None, '%s module change: %s' % (module, f))
+            changed.add(module)
+    reason = 'changed modules: %s' % (', '.join(sorted(changed.union(bindings))) or 'none')
+    affected = set(changed)
+    for (name, m) in modules.items():
+        if changed.intersection(m['deps']):
+            affected.add(name)
+    for name in affected:
+        bindings.update([w for w in modules.get(name, {}).get('wrappers', []) if w in BINDINGS_TESTS])
+    selected = set(affected)
+    for w in bindings:
+        selected.update(BINDINGS_TESTS[w])
+    tests = sorted([t for t in availableTests if t in selected])
+    return (tests, reason)
@@ -0,0 +1,363 @@
+'''
+Planning of test steps (CommonFactory.determineTests / testAll, OCL_factory.testAll).
+
+processStepsInParallel() starts steps in list order when a test slot is free. Steps are sorted by
+historical duration from duration_store (longest processing time first), so long test_dnn / perf_imgproc
+steps don't start last and don't extend the test phase. Steps without history start first.
+
+Long gtest modules are split into GTEST_SHARD_INDEX / GTEST_TOTAL_SHARDS shard steps (getShardCount()),
+shard results are merged by MERGE_SCRIPT into one XML and one tests summary per module.
+
+Lists of tests (determineTests) are collected by DISCOVERY_SCRIPT in one worker command.
+
+Parallel test steps are admitted by MemoryAdmission: a step is started while projected memory
+(peak RSS history of running steps and the step, MEMORY_SCRIPT) fits available memory of the worker.
+DeviceAdmission (OCL_factory.testAll) runs one step per OpenCL device, CPU-only steps fill other slots (cpuSlots).
+'''
+import json
+import math
+import re
+
+import duration_store
+from constants import trace
+
+
+def getStepDuration(store, builderName, stepName):
+    duration = store.getP50(builderName, stepName)
+    if duration is None:
+        duration = store.getP50(None, stepName)  # the same step of other builders
+    return duration
+
+
+def sortLongestFirst(builderName, steps):
+    ''' Returns new list of steps '''
+    try:
+        store = duration_store.getStore()
+        durations = [getStepDuration(store, builderName, s.name) for s in steps]
+    except Exception as e:
+        trace('Test steps are not reordered, build durations are not available: %s' % e)
+        return list(steps)
+    order = sorted(range(len(steps)), key=lambda i: -durations[i] if durations[i] is not None else -float('inf'))
+    print('Test steps order: {}'.format(', '.join(['{}={}'.format(steps[i].name, '%.0fs' % durations[i] if durations[i] is not None else '?')
+                                                   for i in order])))
+    return [steps[i] for i in order]
+
+
+#
+# Sharding of long gtest modules (CommonFactory.addTestSteps)
+#
+SHARD_MIN_DURATION = 10 * 60  # seconds, shorter modules are not split
+SHARD_TARGET_DURATION = 5 * 60  # expected duration of one shard
+MAX_SHARDS = 4
+
+# Python script for worker: merges shard XML files into one gtest XML (argv: output, inputs...)
+# and prints gtest-like output for GoogleUnitTestsObserver of merge step
+MERGE_SCRIPT = r'''
+import os, sys
+import xml.etree.ElementTree as ET
+(output, inputs) = (sys.argv[1], sys.argv[2:])
+root = None
+suites = {}
+errors = []
+
+def applyRerun(shard, path):
+    # test cases passed on re-run of failed ones (CommandTestCPP.rerunFailedTests) are not failed
+    rerunPath = os.path.splitext(path)[0] + '-rerun.xml'
+    if not os.path.exists(rerunPath) or os.path.getmtime(rerunPath) < os.path.getmtime(path):
+        return
+    passed = set()
+    for suite in ET.parse(rerunPath).getroot().findall('testsuite'):
+        for case in suite.findall('testcase'):
+            if case.get('status') != 'notrun' and not case.findall('failure'):
+                passed.add((suite.get('name'), case.get('name')))
+    for suite in shard.findall('testsuite'):
+        for case in suite.findall('testcase'):
+            failures = case.findall('failure')
+            if failures and (suite.get('name'), case.get('name')) in passed:
+                for f in failures:
+                    case.remove(f)
+                case.set('flaky', '1')
+                for e in [suite, shard]:
+                    e.set('failures', str(max(0, int(e.get('failures', 0)) - 1)))
+
+for path in inputs:
+    try:
+        shard = ET.parse(path).getroot()
+        applyRerun(shard, path)
+    except Exception as e:
+        errors.append('%s: %s' % (path, e))
+        continue
+    if root is None:
+        root = ET.Element(shard.tag, dict(shard.attrib))
+    else:
+        for k in ['tests', 'failures', 'disabled', 'errors']:
+            root.set(k, str(int(root.get(k, 0)) + int(shard.get(k, 0))))
+        root.set('time', str(float(root.get('time', 0)) + float(shard.get('time', 0))))
+    for suite in shard.findall('testsuite'):
+        name = suite.get('name')
+        if name not in suites:
+            suites[name] = ET.SubElement(root, 'testsuite', dict(suite.attrib))
+        else:
+            for k in ['tests', 'failures', 'disabled', 'errors']:
+                suites[name].set(k, str(int(suites[name].get(k, 0)) + int(suite.get(k, 0))))
+            suites[name].set('time', str(float(suites[name].get('time', 0)) + float(suite.get('time', 0))))
+        for case in suite.findall('testcase'):
+            suites[name].append(case)
+if root is None:
+    root = ET.Element('testsuites')
+ET.ElementTree(root).write(output, encoding='UTF-8', xml_declaration=True)
+(passed, failed) = (0, 0)
+for suite in root.findall('testsuite'):
+    for case in suite.findall('testcase'):
+        if case.get('status') == 'notrun':
+            continue
+        name = '%s.%s' % (suite.get('name'), case.get('name'))
+        ms = int(float(case.get('time', 0)) * 1000)
+        print('[ RUN      ] ' + name)
+        failures = case.findall('failure')
+        for f in failures:
+            print(f.get('message', '') or f.text or '')
+        if failures:
+            failed += 1
+            param = case.get('value_param', '')
+            if param:
+                param = ', where GetParam() = ' + (param if param.startswith('(') else '(%s)' % param)
+            print('[  FAILED  ] %s%s (%d ms)' % (name, param, ms))
+        else:
+            passed += 1
+            print('[       OK ] %s (%d ms)' % (name, ms))
+print('[==========] %d tests from %d test cases ran. (%d ms total)' % (passed + failed, len(suites), float(root.get('time', 0)) * 1000))
+if int(root.get('disabled', 0)):
+    print('  YOU HAVE %d DISABLED TESTS' % int(root.get('disabled', 0)))
+for e in errors:
+    print('ERROR: Can\'t read shard results: ' + e)
+if failed == 0 and not errors:
+    print('[  PASSED  ] %d tests.' % passed)
+sys.exit(1 if errors else 0)
+'''
+
+
+def getShardStepName(stepName, index, count):
+    return '%s-shard%dof%d' % (stepName, index + 1, count)
+
+
+def getModuleDuration(store, builderName, stepName):
+    ''' Sum of shard durations (last sharded runs) or duration of the whole module step '''
+    for count in range(2, MAX_SHARDS + 1):
+        durations = [store.getP50(builderName, getShardStepName(stepName, 0, count))]
+        if durations[0] is None:
+            continue
+        durations += [store.getP50(builderName, getShardStepName(stepName, i, count)) for i in range(1, count)]
+        if None not in durations:
+            return sum(durations)
+    return getStepDuration(store, builderName, stepName)
+
+
+def getShardCount(builderName, stepName, slots):
+    ''' Number of shards for module test step, 1 - no sharding '''
+    slots = int(slots)
+    if slots < 2:
+        return 1
+    try:
+        duration = getModuleDuration(duration_store.getStore(), builderName, stepName)
+    except Exception as e:
+        trace('Test sharding is not available, build durations are not available: %s' % e)
+        return 1
+    if duration is None or duration < SHARD_MIN_DURATION:
+        return 1
+    return max(1, min(MAX_SHARDS, slots, int(math.ceil(duration / float(SHARD_TARGET_DURATION)))))
+
+
+#
+# Test discovery (CommonFactory.determineTests)
+#
+DISCOVERY_MARKER = 'TEST-LISTS '  # see DISCOVERY_SCRIPT
+
+# Python script for worker, runs all run.py list queries in one command (argv: run.py, queries JSON, cache key JSON,
+# cache file or ''). Results are cached in build directory, key is list of binaries plus cmake parameters.
+DISCOVERY_SCRIPT = r'''
+import hashlib, json, os, subprocess, sys
+(run_py, queries, params, cacheFile) = (sys.argv[1], json.loads(sys.argv[2]), sys.argv[3], sys.argv[4])
+files = []
+for d in ['bin', 'lib']:
+    for (root, dirs, names) in os.walk(d):
+        files += [os.path.join(root, n).replace(os.sep, '/') for n in names]
+key = hashlib.sha1(json.dumps([sorted(files), params, run_py, queries], sort_keys=True).encode('utf-8')).hexdigest()
+lists = None
+if cacheFile:
+    try:
+        with open(cacheFile) as f:
+            cache = json.load(f)
+        if cache.get('key') == key:
+            lists = cache['lists']
+            sys.stderr.write('Test lists are loaded from cache (%s)\n' % key)
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+if lists is None:
+    (lists, ok) = ({}, True)
+    for (prop, args) in sorted(queries.items()):
+        p = subprocess.Popen([sys.executable, run_py] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        (out, err) = p.communicate()
+        sys.stderr.write('%s: %s (rc=%d)\n' % (prop, ' '.join(args), p.returncode))
+        if p.returncode != 0:
+            sys.stderr.write(err.decode('utf-8', 'replace'))
+            ok = False
+        lists[prop] = ' '.join(sorted(err.decode('utf-8', 'replace').split())) if p.returncode == 0 else ''
+    if cacheFile and ok:
+        with open(cacheFile, 'w') as f:
+            json.dump(dict(key=key, lists=lists), f)
+print('TEST-LISTS ' + json.dumps(lists))
+'''
+
+
+def parseDiscoveryOutput(stdout):
+    ''' Returns {property: tests list} from DISCOVERY_SCRIPT output or None '''
+    for line in str(stdout).splitlines():
+        if line.startswith(DISCOVERY_MARKER):
+            try:
+                return json.loads(line[len(DISCOVERY_MARKER):])
+            except ValueError:
+                return None
+    return None
+
+
+#
+# Memory-aware parallelism (CommonFactory.processTestSteps)
+#
+MEMORY_MARKER = 'TEST-PEAK-RSS '  # see MEMORY_SCRIPT
+
+# Python script for worker: runs shell command (argv joined) and prints peak RSS of its processes (bytes)
+MEMORY_SCRIPT = r'''
+import subprocess, sys
+rc = subprocess.call(' '.join(sys.argv[1:]), shell=True)
+try:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    sys.stderr.write('TEST-PEAK-RSS %d\n' % (rss if sys.platform == 'darwin' else rss * 1024))
+except (ImportError, AttributeError):
+    pass
+sys.exit(rc if 0 <= rc < 256 else 1)
+'''
+
+
+class MemoryAdmission(object):
+    '''
+    Admission control of parallel test steps.
+    Steps are started in list order while the number of running steps is less than slots (CPUs)
+    and projected memory fits the budget, the next steps are checked if the first one doesn't fit.
+    One step is always allowed to run.
+    '''
+
+    MEMORY_BUDGET = 0.8  # part of available memory
+    DEFAULT_STEP_MEMORY = 1024 * 1024 * 1024  # steps without history
+
+    def __init__(self, builderName, memAvailable, slots, defaultMemory=DEFAULT_STEP_MEMORY):
+        '''
+        defaultMemory - projected memory of steps without history, None - such steps run alone
+        '''
+        self.builderName = builderName
+        self.budget = memAvailable * self.MEMORY_BUDGET
+        self.slots = max(1, int(slots))
+        self.defaultMemory = defaultMemory
+        self.running = {}  # step -> projected memory
+        self.memory = {}
+        try:
+            self.store = duration_store.getStore()
+        except Exception as e:
+            trace('Peak memory history is not available: %s' % e)
+            self.store = None
+
+    def getStepMemory(self, step):
+        if step not in self.memory:
+            memory = None
+            if self.store is not None:
+                module = re.sub(r'-shard\d+of\d+$', '', step.name)  # shards: module peak RSS as upper bound
+                for (builder, name) in [(self.builderName, step.name), (None, step.name), (self.builderName, module), (None, module)]:
+                    memory = self.store.getPeakMemory(builder, name)
+                    if memory is not None:
+                        break
+            self.memory[step] = int(memory if memory is not None else (self.defaultMemory or self.budget))
+        return self.memory[step]
+
+    def getRunningMemory(self):
+        return int(sum(self.running.values()))
+
+    def canAdmit(self, step):
+        if not self.running:
+            return True
+        if len(self.running) >= self.slots:
+            return False
+        return self.getRunningMemory() + self.getStepMemory(step) <= self.budget
+
+    def select(self, pending):
+        ''' The first step which can be started now or None '''
+        for step in pending:
+            if self.canAdmit(step):
+                return step
+            if len(self.running) >= self.slots:
+                break
+        return None
+
+    def admit(self, step):
+        self.running[step] = self.getStepMemory(step)
+        print('Test {} started: {} MiB projected, {} MiB of {} MiB are used by {} running steps'.format(
+                step.name, self.running[step] >> 20, self.getRunningMemory() >> 20, int(self.budget) >> 20, len(self.running)))
+
+    def release(self, step):
+        self.running.pop(step, None)
+
+
+class DeviceAdmission(object):
+    '''
+    Admission control of OpenCL test steps: steps of the same device (OPENCV_OPENCL_DEVICE) are serialized,
+    steps of different devices and CPU-only steps (device None) run together up to slots.
+    Optional memory admission is checked too.
+    '''
+
+    def __init__(self, devices, slots, memoryAdmission=None, stepsPerDevice=1, cpuSlots=None):
+        '''
+        devices - {step: device or None}
+        cpuSlots - limit of running CPU-only steps (None - slots)
+        '''
+        self.devices = devices
+        self.slots = max(1, int(slots))
+        self.memoryAdmission = memoryAdmission
+        self.stepsPerDevice = stepsPerDevice
+        self.cpuSlots = max(1, int(cpuSlots)) if cpuSlots is not None else self.slots
+        self.running = {}  # step -> device
+
+    def getDeviceSteps(self, device):
+        return len([d for d in self.running.values() if d == device])
+
+    def canAdmit(self, step):
+        if not self.running:
+            return True
+        if len(self.running) >= self.slots:
+            return False
+        device = self.devices.get(step, None)
+        if device is not None and self.getDeviceSteps(device) >= self.stepsPerDevice:
+            return False
+        if device is None and self.getDeviceSteps(None) >= self.cpuSlots:
+            return False
+        return self.memoryAdmission is None or self.memoryAdmission.canAdmit(step)
+
+    def select(self, pending):
+        ''' The first step which can be started now or None '''
+        for step in pending:
+            if self.canAdmit(step):
+                return step
+            if len(self.running) >= self.slots:
+                break
+        return None
+
+    def admit(self, step):
+        self.running[step] = self.devices.get(step, None)
+        if self.memoryAdmission is not None:
+            self.memoryAdmission.admit(step)
+        else:
+            print('Test {} started: device {}, {} running steps'.format(step.name, self.running[step] or 'CPU', len(self.running)))
+
+    def release(self, step):
+        self.running.pop(step, None)
+        if self.memoryAdmission is not None:
+            self.memoryAdmission.release(step)
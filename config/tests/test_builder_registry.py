@@ -0,0 +1,69 @@
+import os
+import sys
+import unittest
+
+CONFIG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CONFIG_DIR)
+
+import bench_config_load
+bench_config_load.installStubs()
+
+import builder_newstyle
+
+
+class FakeBuilder(builder_newstyle.BuilderNewStyle):
+
+    def getName(self):
+        return self.builderName
+
+
+class RegisterTest(unittest.TestCase):
+
+    def setUp(self):
+        builder_newstyle._registeredBuilders.clear()
+
+    def test_unchanged_builder_keeps_config(self):
+        old = FakeBuilder(builderName='b1', useSlave=['linux-1'], tags=['nightly'], builder_properties=dict(a=1))
+        cfg = old.register()
+        new = FakeBuilder(builderName='b1', useSlave=['linux-1'], tags=['nightly'], builder_properties=dict(a=1))
+        self.assertIs(new.register(), cfg)
+        self.assertIs(cfg.factory.me_, new)
+        self.assertIs(cfg.canStartBuild.im_self, new)
+        self.assertIs(cfg.nextBuild.im_self, new)
+
+    def test_changed_builder(self):
+        cfg = FakeBuilder(builderName='b1', useSlave=['linux-1'], tags=['nightly']).register()
+        for kwargs in [dict(useSlave=['linux-2'], tags=['nightly']),
+                       dict(useSlave=['linux-1'], tags=['weekly']),
+                       dict(useSlave=['linux-1'], tags=['nightly'], builder_properties=dict(a=1))]:
+            new = FakeBuilder(builderName='b1', **kwargs)
+            self.assertIsNot(new.register(), cfg)
+            self.assertIs(new.bb_config.factory.me_, new)
+
+
+class ReconfigTest(unittest.TestCase):
+
+    def loadConfig(self):
+        namespace = dict(__file__=os.path.join(CONFIG_DIR, 'master.py'), __name__='__config__')
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            execfile(namespace['__file__'], namespace)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        return namespace['BuildmasterConfig']
+
+    def test_reconfig_reuses_builders(self):
+        builders = self.loadConfig()['builders']
+        descriptors = [b.factory.me_ for b in builders]
+        reconfigured = self.loadConfig()['builders']
+        self.assertEqual(len(reconfigured), len(builders))
+        for (old, new, descriptor) in zip(builders, reconfigured, descriptors):
+            self.assertIs(new, old)
+            self.assertIsNot(new.factory.me_, descriptor)  # bound to the new descriptor
+            self.assertEqual(new.builddir.count('/builds/'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
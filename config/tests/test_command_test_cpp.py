@@ -0,0 +1,115 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bench_config_load
+bench_config_load.installStubs()
+
+import command_test_cpp
+import factory_common
+import test_flakiness
+from buildbot.status.results import WARNINGS, FAILURE
+
+
+class RerunTest(unittest.TestCase):
+
+    def setUp(self):
+        self.recordReruns = test_flakiness.recordReruns
+        test_flakiness.recordReruns = lambda step, flaky, failed: dict([(t, 1) for t in flaky])
+
+    def tearDown(self):
+        test_flakiness.recordReruns = self.recordReruns
+
+    def createStep(self, failed):
+        step = command_test_cpp.CommandTestCPP.__new__(command_test_cpp.CommandTestCPP)
+        step.name = 'test_imgproc'
+        step.command = 'opencv_test_imgproc --gtest_output=xml:results_imgproc.xml'
+        step.testsLogs = {}
+        step.testsPassed = ['Imgproc.a', 'Imgproc.b']
+        step.testsFailed = list(failed)
+        step.testsFlaky = []
+        step.testsDurations = {}
+        step.all_tests_passed = True
+        step.disabledTestsCount = 0
+        step.caseCount = 1
+        step.testCount = 2 + len(failed)
+        step.valgrindSummary = ''
+        step.valgrindErrors = 0
+        step.valgrindLog = []
+        step.retryFailedTests = 5
+        step.rerunPassed = []
+        step.rerunFailed = []
+        step.rerun_tests_passed = False
+        step.flakyTests = {}
+        step.testsSummaryDeferred = False
+        step.logs = {}
+        step.buildCommandKwargs = lambda warnings: dict(command=step.command)
+        step.addLog = lambda name: name
+        step.addHTMLLog = lambda name, html: step.logs.__setitem__(name, html)
+        step.addCompleteLog = lambda name, text: step.logs.__setitem__(name, text)
+        return step
+
+    def rerun(self, step, passed, failed):
+        gen = step.rerunFailedTests(None)
+        next(gen)  # runCommand()
+        step.rerunPassed = passed
+        step.rerunFailed = failed
+        step.rerun_tests_passed = not failed
+        try:
+            gen.send(None)
+        except bench_config_load._DefGen_Return as e:
+            return e.value
+        self.fail('no result')
+
+    def test_all_passed_on_rerun(self):
+        step = self.createStep(['Imgproc.c', 'Imgproc.d'])
+        step.createSummary(None)
+        self.assertNotIn('tests summary', step.logs)  # created after re-run
+        step.runCommand = lambda cmd: setattr(cmd, 'rc', 0)
+        self.assertEqual(self.rerun(step, ['Imgproc.c', 'Imgproc.d'], []), WARNINGS)
+        self.assertEqual(step.testsFailed, [])
+        self.assertEqual(step.testsFlaky, ['Imgproc.c', 'Imgproc.d'])
+        desc = step.describe(done=True)
+        self.assertFalse([s for s in desc if s.startswith('failed')])
+        self.assertIn('flaky (passed on re-run): 2 ;', desc)
+        self.assertIn('Tests failed: 0<br>', step.logs['tests summary'])
+        self.assertIn('Tests flaky (passed on re-run): 2<br>', step.logs['tests summary'])
+        self.assertIn('flaky tests', step.logs)
+
+    def test_failed_again_on_rerun(self):
+        step = self.createStep(['Imgproc.c', 'Imgproc.d'])
+        step.createSummary(None)
+        step.runCommand = lambda cmd: setattr(cmd, 'rc', 1)
+        self.assertEqual(self.rerun(step, ['Imgproc.c'], ['Imgproc.d']), FAILURE)
+        self.assertEqual(step.testsFailed, ['Imgproc.d'])
+        desc = step.describe(done=True)
+        self.assertIn('failed: 1 ;', desc)
+        self.assertIn('flaky (passed on re-run): 1 ;', desc)
+        self.assertIn('Tests failed: 1<br>', step.logs['tests summary'])
+
+
+class RetryDefaultsTest(unittest.TestCase):
+
+    def createFactory(self, isPrecommit, properties):
+        factory = factory_common.CommonFactory.__new__(factory_common.CommonFactory)
+        factory.getProperty = lambda name, default=None: properties.get(name, default)
+        factory.isPrecommit = isPrecommit
+        return factory
+
+    def test_precommit_accuracy_only(self):
+        factory = self.createFactory(True, {})
+        self.assertEqual(factory.getTestRetries(), factory.TEST_RETRY_MAX)
+        self.assertEqual(factory.getTestRetries(isPerf=True), 0)
+        self.assertEqual(factory.getTestRetries(exclusive=True), 0)
+        self.assertEqual(self.createFactory(False, {}).getTestRetries(), 0)
+
+    def test_property(self):
+        self.assertEqual(self.createFactory(False, dict(test_retry='3')).getTestRetries(), 3)
+        self.assertEqual(self.createFactory(True, dict(test_retry='0')).getTestRetries(), 0)
+        self.assertEqual(self.createFactory(True, dict(test_retry='3')).getTestRetries(isPerf=True), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import duration_store
+import history_store
+import test_flakiness
+
+
+class HistoryStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_durations(self):
+        store = duration_store.DurationStore(os.path.join(self.dir, 'durations.sqlite'))
+        store.recordMany([('linux64', 'compile', d, 'linux-1', 1, 0, None, None) for d in [10, 20, 30]])
+        store.flush()
+        self.assertEqual(sorted(store.getDurations('linux64', 'compile')), [10, 20, 30])
+        store.close()
+
+    def test_writes_in_writer_thread(self):
+        store = test_flakiness.FlakinessStore(os.path.join(self.dir, 'flakes.sqlite'))
+        threads = []
+        store.execute = lambda sql, rows: threads.append(threading.current_thread())
+        store.recordMany([('linux64', 'test_core', 'Core.a', test_flakiness.FLAKY, 'linux-1', 1, None)])
+        store.flush()
+        self.assertEqual(set(threads), set([store.thread]))  # cleanup and insert
+        store.close()
+
+    def test_percentile(self):
+        self.assertEqual(history_store.percentile([5], 90), 5)
+        self.assertEqual(history_store.percentile([10, 20, 30], 50), 20)
+        self.assertEqual(history_store.percentile([10, 20], 90), 19.0)
+        self.assertEqual(history_store.percentile([10, 20, 30], 100), 30)
+
+    def test_get_store(self):
+        path = os.path.join(self.dir, 'flakes.sqlite')
+        stores = history_store._stores
+        history_store._stores = {}
+        try:
+            store = test_flakiness.getStore(path)
+            self.assertIs(test_flakiness.getStore(), store)
+            self.assertIsNot(duration_store.getStore(os.path.join(self.dir, 'durations.sqlite')), store)
+        finally:
+            for s in history_store._stores.values():
+                s.close()
+            history_store._stores = stores
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import constants
+from nightly_planner import NightlyPlanner
+
+
+class FakeBuilder(object):
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+
+    def getName(self):
+        return self.name
+
+    def getSlaves(self):
+        return self.workers
+
+
+class NightlyPlannerTest(unittest.TestCase):
+
+    def createPlanner(self):
+        planner = NightlyPlanner()
+        planner.durationStoreAvailable = False  # no history, DEFAULT_DURATION for all builders
+        return planner
+
+    def test_builders_without_history_are_spread(self):
+        workers = sorted([w for w in constants.worker.keys() if w.startswith('linux-')])
+        builders = [FakeBuilder('builder-%d' % i, workers) for i in range(65)]
+        plan = self.createPlanner().plan(builders, 23, 0, 90)
+        self.assertEqual(sorted(sum(plan.values(), [])), sorted([b.getName() for b in builders]))
+        self.assertIn(23 * 60, plan)
+        for start in plan.keys():
+            self.assertTrue(23 * 60 <= start <= 23 * 60 + 90, start)
+        self.assertGreaterEqual(len(plan), 10)
+        self.assertLessEqual(max([len(names) for names in plan.values()]), 65 // 4)
+
+    def test_builders_fitting_into_window(self):
+        builders = [FakeBuilder('builder-%d' % i, ['linux-1']) for i in range(2)]
+        plan = self.createPlanner().plan(builders, 23, 0, 90)
+        self.assertEqual(plan, {23 * 60: ['builder-0', 'builder-1']})  # linux-1 has 2 build slots
+
+
+if __name__ == '__main__':
+    unittest.main()
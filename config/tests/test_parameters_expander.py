@@ -0,0 +1,135 @@
+import functools
+import os
+import sys
+import unittest
+
+CONFIG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CONFIG_DIR)
+
+import bench_config_load
+bench_config_load.installStubs()
+
+import factory_builders_aggregator
+
+
+def referenceGenerator(init_params, variate):
+    ''' ParametersGenerator before ParametersExpander (full enumeration, no caching) '''
+    size = len(variate)
+    state = size * [-1]
+    pos = 0
+    while True:
+        if pos == -1:
+            break
+        if pos == 0:
+            params = init_params.copy()
+        vset = variate[pos]
+        assert len(vset.keys()) == 1
+        pname = list(vset.keys())[0]
+        pval = vset[pname]
+        if hasattr(pval, '__call__'):
+            pval = pval(**params)
+        elif (hasattr(pval, '__name__') and pval.__name__ == '<lambda>'):
+            pval = pval(params)
+        state[pos] += 1
+        if (state[pos] >= len(pval)):
+            state[pos] = -1
+            pos -= 1
+            continue
+        params[pname] = pval[state[pos]]
+        if pos == size - 1:
+            yield params.copy()
+        else:
+            pos += 1
+
+
+def _compilers(osType, isDebug=False, **params):
+    return ['gcc', 'clang'] if osType == 'linux' else ['msvc']
+
+
+class ExpansionTest(unittest.TestCase):
+
+    def check(self, init_params, variate):
+        expected = list(referenceGenerator(init_params, variate))
+        self.assertEqual(list(factory_builders_aggregator.ParametersGenerator(init_params, variate)), expected)
+        return expected
+
+    def test_example(self):
+        res = self.check(dict(isPrecommit=False), [
+            dict(branch=['master', '2.4']),
+            dict(isWin=[True, False]),
+            dict(is64=lambda isWin, **params: [True, False] if isWin else [True]),
+        ])
+        self.assertEqual(len(res), 6)
+
+    def test_kwargs_constants(self):
+        ''' Dependencies are read from co_consts of callable and nested code objects '''
+        self.check(dict(branch='master', tags=['nightly']), [
+            dict(osType=['linux', 'windows', 'android']),
+            dict(is64=[True, False]),
+            dict(compiler=lambda **params: ['gcc', 'clang'] if params['osType'] == 'linux' else ['msvc']),
+            dict(useIPP=lambda **params: [True, False] if params.get('is64') and params['branch'] != '2.4' else [False]),
+            dict(useOpenCL=lambda **params: [v for v in [True, False] if (lambda: params['compiler'] != 'msvc' or v)()]),
+            dict(isDebug=lambda **params: [False, True] if all(params[n] for n in ['is64', 'useIPP']) else [False]),
+        ])
+
+    def test_named_arguments_and_defaults(self):
+        self.check(dict(isDebug=True), [
+            dict(osType=['linux', 'windows']),
+            dict(compiler=_compilers),
+            dict(buildShared=lambda compiler, osType='linux', **params: [True] if compiler == 'msvc' else [True, False]),
+        ])
+
+    def test_empty_values_prune_subtree(self):
+        res = self.check(dict(branch='2.4'), [
+            dict(platform=['default', 'ocl']),
+            dict(osType=['linux', 'windows', 'android']),
+            dict(compiler=['gcc', 'msvc']),
+            dict(useOpenCL=lambda platform, **params: [] if platform == 'ocl' else [True]),
+            dict(dockerImage=lambda osType, compiler, **params: [] if (osType == 'linux') != (compiler == 'gcc') else [None]),
+        ])
+        self.assertEqual(len(res), 3)
+
+    def test_overridden_init_param(self):
+        self.check(dict(branch='master', useIPP=False), [
+            dict(useIPP=lambda branch, **params: [True, False] if branch == 'master' else []),
+            dict(useSSE=lambda useIPP, **params: [useIPP]),
+        ])
+
+    def test_uncacheable(self):
+        ''' Unhashable values and callables without code object '''
+        self.check(dict(tags=['nightly']), [
+            dict(modules=[['core'], ['core', 'imgproc']]),
+            dict(shard=lambda modules, **params: range(len(modules))),
+            dict(extra=functools.partial(lambda n, **params: [n, params['shard']], 1)),
+            dict(all=lambda *args, **params: [params['extra']]),
+        ])
+
+
+class ProjectBuildersTest(unittest.TestCase):
+
+    def test_project_builders(self):
+        ''' All variate configurations of master.cfg expand as before '''
+        calls = []
+        generator = factory_builders_aggregator.ParametersGenerator
+
+        def recordingGenerator(init_params, variate):
+            calls.append((init_params.copy(), list(variate)))
+            return generator(init_params, variate)
+
+        namespace = dict(__file__=os.path.join(CONFIG_DIR, 'master.py'), __name__='__config__')
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        factory_builders_aggregator.ParametersGenerator = recordingGenerator
+        try:
+            execfile(namespace['__file__'], namespace)
+            self.assertTrue(calls)
+            for (init_params, variate) in calls:
+                self.assertEqual(list(generator(init_params, variate)), list(referenceGenerator(init_params, variate)))
+        finally:
+            factory_builders_aggregator.ParametersGenerator = generator
+            sys.stdout.close()
+            sys.stdout = stdout
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import perf_history
+
+
+class ParseFileNameTest(unittest.TestCase):
+
+    def test_nightly(self):
+        info = perf_history.parseFileName('/export/20261012-231503-0123abc skl-perf_imgproc linux64_00345.xml')
+        self.assertEqual(info['revision'], '0123abc')
+        self.assertEqual(info['platform'], 'skl')
+        self.assertEqual(info['module'], 'perf_imgproc')
+        self.assertEqual(info['builder'], 'linux64')
+        self.assertEqual(info['buildnumber'], 345)
+        self.assertNotIn('pullrequest', info)
+
+    def test_pullrequest(self):
+        for (branch, builder) in [('4_x', 'precommit_linux64'), ('3_4', 'precommit_linux64'),
+                                  ('master', 'precommit_linux64'), ('4_x', 'linux64')]:
+            info = perf_history.parseFileName('20261012-231503-0123abc-4567def perf_imgproc pr1234 %s_%s_00012.xml' % (branch, builder))
+            self.assertEqual(info['pullrequest'], 1234)
+            self.assertEqual(info['patch'], '4567def')
+            self.assertEqual(info['builder'], builder)
+            self.assertEqual(info['buildnumber'], 12)
+
+    def test_unknown_revision(self):
+        info = perf_history.parseFileName('20261012-231503-xxxxxxx perf_core linux64_00001.xml')
+        self.assertNotIn('revision', info)
+        self.assertEqual(info['builder'], 'linux64')
+
+    def test_not_perf(self):
+        self.assertIsNone(perf_history.parseFileName('20261012-231503-0123abc test_core linux64_00001.xml'))
+
+
+PERF_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<testsuites>
+  <testsuite name="OCL_ResizeFixture_Resize" tests="2">
+    <testcase name="Resize/0" classname="OCL_ResizeFixture_Resize" value_param="(8UC1, 640x480, 0.5)" status="run"
+              frequency="1000000000" median="2000000" gmean="2100000" mean="2200000" min="1900000" stddev="100000" samples="10" outliers="0" />
+    <testcase name="Resize/1" classname="OCL_ResizeFixture_Resize" value_param="(8UC4, 640x480, 0.5)" status="run"
+              frequency="1000000000" median="4000000" gmean="4100000" mean="4200000" min="3900000" stddev="200000" samples="10" outliers="1" />
+  </testsuite>
+</testsuites>
+'''
+
+
+class IngestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, '20261012-231503-0123abc perf_imgproc linux64_00345.xml')
+        with open(self.path, 'w') as f:
+            f.write(PERF_XML)
+        self.store = perf_history.PerfHistoryStore(os.path.join(self.dir, 'perf_history.sqlite'))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.dir)
+
+    def test_ingest_once(self):
+        self.assertEqual(self.store.ingest(self.path), 2)
+        self.assertIsNone(self.store.ingest(self.path))
+        self.assertEqual(self.store.getPercentiles('OCL_ResizeFixture_Resize.Resize/0', '(8UC1, 640x480, 0.5)'), {50: 2.0, 90: 2.0})
+
+    def test_concurrent_ingest(self):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.store.ingest(self.path))) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sorted(results, key=lambda r: r is not None), [None, None, None, 2])
+        self.assertEqual(len(self.store.getTests()), 2)
+
+    def test_ingested_by_another_process(self):
+        other = perf_history.PerfHistoryStore(self.store.path)
+        try:
+            other.isIngested = lambda path: False
+            self.assertEqual(self.store.ingest(self.path), 2)
+            self.assertIsNone(other.ingest(self.path))
+            self.assertEqual(len(other.getTests()), 2)
+        finally:
+            other.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import supersede
+
+
+class FakeProperties(dict):
+
+    def getProperty(self, name, default=None):
+        return self.get(name, default)
+
+    def setProperty(self, name, value, source, runtime=False):
+        self[name] = value
+
+
+class FakeBuild(object):
+
+    class builder(object):
+        name = 'precommit_linux64'
+
+    def __init__(self, number, **properties):
+        self.properties = FakeProperties(properties)
+        self.getProperty = self.properties.getProperty
+        self.setProperty = self.properties.setProperty
+        self.number = number
+        self.build_status = self
+        self.stopped = None
+
+    def getNumber(self):
+        return self.number
+
+    def stopBuild(self, reason):
+        self.stopped = reason
+
+
+class FakeDeferred(object):
+
+    def addCallback(self, fn):
+        fn(None)
+
+    def addErrback(self, fn):
+        pass
+
+
+class FakeRequest(object):
+
+    def __init__(self, id, **properties):
+        self.id = id
+        self.properties = FakeProperties(properties)
+        self.cancelled = False
+
+    def cancelBuildRequest(self):
+        self.cancelled = True
+        return FakeDeferred()
+
+
+class SupersedeTest(unittest.TestCase):
+
+    KEY = supersede.getKey('opencv', 123, 'Linux64')
+
+    def setUp(self):
+        supersede._latestHeads.clear()
+        supersede._runningBuilds.clear()
+        supersede._pendingRecords.clear()
+
+    def props(self, head_sha):
+        return {supersede.SUPERSEDE_KEY_PROPERTY: self.KEY, 'head_sha': head_sha}
+
+    def test_cancelled_request_is_recorded_in_newer_build(self):
+        supersede.scheduled(self.KEY, 'aaa')
+        supersede.scheduled(self.KEY, 'bbb')
+        old = FakeRequest(1, **self.props('aaa'))
+        new = FakeRequest(2, **self.props('bbb'))
+        self.assertEqual(supersede.filterRequests(FakeBuild.builder, [old, new]), [new])
+        self.assertTrue(old.cancelled)
+        build = FakeBuild(10, **self.props('bbb'))
+        supersede.buildStarted(build)
+        self.assertEqual(build.properties[supersede.SUPERSEDED_PROPERTY], ['build request 1 on precommit_linux64 (aaa): cancelled'])
+
+    def test_stopped_build_is_recorded_in_running_newer_build(self):
+        supersede.scheduled(self.KEY, 'aaa')
+        old = FakeBuild(10, **self.props('aaa'))
+        supersede.buildStarted(old)
+        supersede.scheduled(self.KEY, 'bbb')
+        self.assertEqual(old.stopped, 'Superseded by bbb')
+        self.assertEqual(old.properties['superseded_by'], 'bbb')
+        new = FakeBuild(11, **self.props('bbb'))
+        supersede.buildStarted(new)
+        self.assertEqual(new.properties[supersede.SUPERSEDED_PROPERTY], ['build precommit_linux64 #10 (aaa): stopped'])
+        supersede.scheduled(self.KEY, 'bbb')
+        request = FakeRequest(3, **self.props('aaa'))
+        supersede.filterRequests(FakeBuild.builder, [request])
+        self.assertEqual(len(new.properties[supersede.SUPERSEDED_PROPERTY]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
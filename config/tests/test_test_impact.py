@@ -0,0 +1,54 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bench_config_load
+bench_config_load.installStubs()
+
+import factory_common
+import test_impact
+
+
+MODULES = {
+    'imgproc': dict(repo='opencv', path='modules/imgproc', deps=['core'], wrappers=['python']),
+    'shape': dict(repo='opencv', path='modules/shape', deps=['core', 'imgproc'], wrappers=[]),
+    'video': dict(repo='opencv', path='modules/video', deps=['core', 'imgproc'], wrappers=[]),
+}
+TESTS = 'imgproc shape video python3'
+
+
+class TestListTest(unittest.TestCase):
+
+    def createFactory(self, properties):
+        factory = factory_common.CommonFactory.__new__(factory_common.CommonFactory)
+        factory.getProperty = lambda name, default=None: properties.get(name, default)
+        factory.isContrib = False
+        factory.runPython = True
+        factory.getTestBlacklist = lambda isPerf=False: ['viz', 'shape']
+        return factory
+
+    def test_impact_selection_keeps_blacklist(self):
+        (tests, reason) = test_impact.getImpactedTests({'opencv': ['modules/imgproc/src/resize.cpp']}, MODULES, TESTS.split())
+        self.assertEqual(tests, ['imgproc', 'python3', 'shape', 'video'])
+        factory = self.createFactory(dict(tests_accuracy_main=TESTS, test_impact_modules=','.join(tests)))
+        self.assertEqual(factory.getTestList(False), ['imgproc', 'video', 'python3'])
+
+    def test_impact_selection_limits_tests(self):
+        (tests, reason) = test_impact.getImpactedTests({'opencv': ['modules/video/src/a.cpp']}, MODULES, TESTS.split())
+        factory = self.createFactory(dict(tests_accuracy_main=TESTS, test_impact_modules=','.join(tests)))
+        self.assertEqual(factory.getTestList(False), ['video'])
+
+    def test_full_suite_without_selection(self):
+        factory = self.createFactory(dict(tests_accuracy_main=TESTS))
+        self.assertEqual(factory.getTestList(False), ['imgproc', 'video', 'python3'])
+
+    def test_full_suite_for_core_changes(self):
+        modules = dict(MODULES, core=dict(repo='opencv', path='modules/core', deps=[], wrappers=['python']))
+        (tests, reason) = test_impact.getImpactedTests({'opencv': ['modules/core/src/matrix.cpp']}, modules, TESTS.split())
+        self.assertIsNone(tests)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import test_scheduler
+
+
+class FakeStep(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+class DeviceAdmissionTest(unittest.TestCase):
+
+    def createSteps(self):
+        gpu = [FakeStep('test_core-opencl'), FakeStep('test_imgproc-opencl')]
+        cpu = [FakeStep('test_core-plain'), FakeStep('test_imgproc-plain'), FakeStep('test_video-plain')]
+        devices = dict([(s, ':GPU:') for s in gpu] + [(s, None) for s in cpu])
+        return (gpu, cpu, devices)
+
+    def startAll(self, admission, pending):
+        started = []
+        while True:
+            step = admission.select(pending)
+            if step is None:
+                return started
+            pending.remove(step)
+            admission.admit(step)
+            started.append(step)
+
+    def test_cpu_slots(self):
+        (gpu, cpu, devices) = self.createSteps()
+        admission = test_scheduler.DeviceAdmission(devices, 3, cpuSlots=2)
+        started = self.startAll(admission, gpu + cpu)
+        self.assertEqual(started, [gpu[0], cpu[0], cpu[1]])  # one step of GPU device, CPU-only steps up to cpuSlots
+        admission.release(cpu[0])
+        self.assertEqual(self.startAll(admission, [gpu[1], cpu[2]]), [cpu[2]])
+        admission.release(gpu[0])
+        self.assertEqual(self.startAll(admission, [gpu[1]]), [gpu[1]])
+
+    def test_shared_slots(self):
+        (gpu, cpu, devices) = self.createSteps()
+        admission = test_scheduler.DeviceAdmission(devices, 2)
+        self.assertEqual(self.startAll(admission, gpu + cpu), [gpu[0], cpu[0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
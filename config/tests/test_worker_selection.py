@@ -0,0 +1,38 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import worker_selection
+
+
+class FakeBuilder(object):
+
+    def __init__(self, name, branch):
+        self.name = name
+        self.config = type('Config', (object,), dict(properties=dict(branch=branch)))()
+
+
+class AffinityTest(unittest.TestCase):
+
+    def setUp(self):
+        for d in [worker_selection._recentLoad, worker_selection._lastBuilderWorker, worker_selection._lastBranchWorker,
+                  worker_selection._startedCacheState, worker_selection._affinityStats]:
+            d.clear()
+
+    def test_build_started(self):
+        policy = worker_selection.WarmCacheAffinityPolicy()
+        bldr = FakeBuilder('linux64', '4.x')
+        policy.buildStarted(bldr, 'linux-1')
+        self.assertEqual(worker_selection.getCacheState('linux64', 'linux-1'), worker_selection.CACHE_COLD)
+        self.assertAlmostEqual(policy.getRecentLoad('linux-1'), 1.0, places=2)
+        policy.buildStarted(FakeBuilder('linux64-debug', '4.x'), 'linux-1')
+        self.assertEqual(worker_selection.getCacheState('linux64-debug', 'linux-1'), worker_selection.CACHE_BRANCH)
+        policy.buildStarted(bldr, 'linux-1')
+        self.assertEqual(worker_selection.getCacheState('linux64', 'linux-1'), worker_selection.CACHE_BUILDER)
+        self.assertEqual(worker_selection._affinityStats['linux64'], {'cold': 1, 'builder': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+'''
+Master-side exclusive reservation of worker (perf and big data tests).
+
+BuilderNewStyle.reserveWorker() waits until other builds on the worker are finished.
+New builds are not started on the worker while reservation is requested or held
+(BuilderNewStyle.canStartBuild). Builds which are waiting for reservation themselves
+don't block the current reservation holder. Reservation is released by releaseWorker()
+or when the build is finished.
+
+Wait times are collected per worker, see getStats().
+'''
+import time
+
+from twisted.internet import defer, reactor
+
+from constants import trace
+
+
+class _Request(object):
+
+    def __init__(self, build, reason):
+        self.build = build
+        self.reason = reason
+        self.requested = time.time()
+        self.granted = None
+        self.d = defer.Deferred()
+        self.timeoutCall = None
+
+
+class WorkerReservations(object):
+
+    MAX_WAIT = 3 * 3600  # seconds, reservation is granted anyway (with warning) after this time
+
+    def __init__(self):
+        self.running = {}  # worker -> set of running builds
+        self.queues = {}  # worker -> list of _Request, the first one can be granted (holder)
+        self.stats = {}  # worker -> dict(count, total_wait, max_wait, last_wait)
+
+    def buildStarted(self, worker, build):
+        self.running.setdefault(worker, set()).add(build)
+
+    def buildFinished(self, worker, build):
+        self.running.get(worker, set()).discard(build)
+        self.release(worker, build)
+        self._update(worker)
+
+    def isReserved(self, worker):
+        return bool(self.queues.get(worker, None))
+
+    def getHolder(self, worker):
+        queue = self.queues.get(worker, None)
+        if queue and queue[0].granted is not None:
+            return queue[0].build
+        return None
+
+    def reserve(self, worker, build, reason=''):
+        ''' Returns Deferred with wait time in seconds '''
+        queue = self.queues.setdefault(worker, [])
+        for r in queue:
+            if r.build is build:
+                return r.d if r.granted is None else defer.succeed(0)
+        r = _Request(build, reason)
+        queue.append(r)
+        trace('Worker reservation: %s is requested (%s), queue length %d' % (worker, reason, len(queue)))
+        r.timeoutCall = reactor.callLater(self.MAX_WAIT, self._timeout, worker, r)
+        self._update(worker)
+        return r.d
+
+    def release(self, worker, build):
+        queue = self.queues.get(worker, [])
+        for r in list(queue):
+            if r.build is build:
+                queue.remove(r)
+                if r.timeoutCall is not None and r.timeoutCall.active():
+                    r.timeoutCall.cancel()
+                if r.granted is not None:
+                    trace('Worker reservation: %s is released (%s), held %.0fs' % (worker, r.reason, time.time() - r.granted))
+        if not queue:
+            self.queues.pop(worker, None)
+        self._update(worker)
+
+    def _update(self, worker):
+        queue = self.queues.get(worker, None)
+        if not queue or queue[0].granted is not None:
+            return
+        r = queue[0]
+        waiting = set([q.build for q in queue])
+        others = [b for b in self.running.get(worker, set()) if b is not r.build and b not in waiting]
+        if not others:
+            self._grant(worker, r)
+
+    def _timeout(self, worker, r):
+        r.timeoutCall = None
+        if r.granted is None:
+            trace('Worker reservation: WARNING: %s is not drained in %ds, grant reservation anyway (%s)' % (worker, self.MAX_WAIT, r.reason))
+            queue = self.queues.get(worker, [])
+            if r in queue:  # move ahead, otherwise it would wait for the current holder
+                queue.remove(r)
+                queue.insert(0, r)
+            self._grant(worker, r)
+
+    def _grant(self, worker, r):
+        r.granted = time.time()
+        if r.timeoutCall is not None and r.timeoutCall.active():
+            r.timeoutCall.cancel()
+        wait = r.granted - r.requested
+        s = self.stats.setdefault(worker, dict(count=0, total_wait=0.0, max_wait=0.0, last_wait=0.0))
+        s['count'] += 1
+        s['total_wait'] += wait
+        s['max_wait'] = max(s['max_wait'], wait)
+        s['last_wait'] = wait
+        trace('Worker reservation: %s is granted (%s) after %.0fs' % (worker, r.reason, wait))
+        r.d.callback(wait)
+
+    def getStats(self):
+        ''' Wait time metrics: worker -> dict(count, total_wait, max_wait, last_wait, avg_wait, queue) '''
+        res = {}
+        for (worker, s) in self.stats.items():
+            res[worker] = dict(s, avg_wait=s['total_wait'] / s['count'] if s['count'] else 0.0,
+                               queue=len(self.queues.get(worker, [])))
+        return res
+
+
+_reservations = None
+
+
+def getReservations():
+    global _reservations
+    if _reservations is None:
+        _reservations = WorkerReservations()
+    return _reservations
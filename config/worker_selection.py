@@ -0,0 +1,186 @@
+'''
+Worker selection policies for BuilderConfig(nextSlave=...).
+
+Buildbot picks a random available worker by default. LoadAwarePolicy prefers the least loaded one:
+running builds relative to max_builds, declared CPUs and builds started recently on the worker
+(exponentially decayed, they still load the worker even if the build slot is free now).
+
+WarmCacheAffinityPolicy additionally prefers the worker which ran the same builder (or the same branch)
+last time: ccache, docker image layers and git objects are warm there. Cache state of each build
+('builder', 'branch' or 'cold') is stored as 'worker_cache' build property, see getAffinityReport().
+'''
+import math
+import time
+
+import constants
+from constants import trace
+
+# worker name -> (load, timestamp)
+_recentLoad = {}
+# builder name / branch -> last worker
+_lastBuilderWorker = {}
+_lastBranchWorker = {}
+# (builder name, worker) -> cache state of the last started build
+_startedCacheState = {}
+# builder name -> {cache state: count}
+_affinityStats = {}
+
+CACHE_BUILDER = 'builder'
+CACHE_BRANCH = 'branch'
+CACHE_COLD = 'cold'
+
+
+class WorkerSelectionPolicy(object):
+    ''' Base policy: the first available worker '''
+
+    def nextSlave(self, bldr, slavebuilders):
+        if not slavebuilders:
+            return None
+        return slavebuilders[0]
+
+    def buildStarted(self, bldr, name, breq=None):
+        ''' Called when the build is started on the worker (BuilderNewStyle.run_()) '''
+        pass
+
+
+class LoadAwarePolicy(WorkerSelectionPolicy):
+
+    RECENT_LOAD_HALF_LIFE = 15 * 60  # seconds
+    RECENT_LOAD_WEIGHT = 0.5
+
+    def getWorkerName(self, sb):
+        return sb.slave.slavename
+
+    def getMaxBuilds(self, sb):
+        max_builds = getattr(sb.slave, 'max_builds', None)
+        if not max_builds:
+            max_builds = constants.worker.get(self.getWorkerName(sb), {}).get('max_builds', None)
+        return max_builds or 1
+
+    def getCPUs(self, sb):
+        cpus = None
+        try:
+            cpus = sb.slave.properties.getProperty('CPUs', None)
+        except AttributeError:
+            pass
+        if not cpus:
+            cpus = constants.worker.get(self.getWorkerName(sb), {}).get('properties', {}).get('CPUs', None)
+        return cpus or 1
+
+    def getRunningBuilds(self, sb):
+        slavebuilders = getattr(sb.slave, 'slavebuilders', None) or {}
+        return len([s for s in slavebuilders.values() if s.isBusy()])
+
+    def getRecentLoad(self, name, now=None):
+        (load, timestamp) = _recentLoad.get(name, (0.0, 0))
+        now = now or time.time()
+        return load * math.pow(0.5, (now - timestamp) / float(self.RECENT_LOAD_HALF_LIFE))
+
+    def addRecentLoad(self, name, value=1.0):
+        now = time.time()
+        _recentLoad[name] = (self.getRecentLoad(name, now) + value, now)
+
+    def score(self, sb):
+        ''' Lower is better: utilization of build slots plus load per CPU '''
+        load = self.getRunningBuilds(sb) + self.RECENT_LOAD_WEIGHT * self.getRecentLoad(self.getWorkerName(sb))
+        return load / float(self.getMaxBuilds(sb)) + load / float(self.getCPUs(sb))
+
+    def nextSlave(self, bldr, slavebuilders):
+        if not slavebuilders:
+            return None
+        # equal scores: prefer more CPUs
+        scores = sorted([(self.score(sb), -self.getCPUs(sb), self.getWorkerName(sb), sb) for sb in slavebuilders])
+        (_, _, name, sb) = scores[0]
+        if len(scores) > 1:
+            trace('nextSlave: %s -> %s (%s)' % (bldr.name, name, ', '.join(['%s=%.2f' % (n, s) for (s, _, n, _) in scores])))
+        return sb
+
+    def buildStarted(self, bldr, name, breq=None):
+        self.addRecentLoad(name)
+
+
+def _getBranch(bldr, breq=None):
+    branch = None
+    if breq is not None:
+        try:
+            branch = breq.properties.getProperty('branch', None)
+        except AttributeError:
+            pass
+    if branch is None:
+        branch = (getattr(bldr.config, 'properties', None) or {}).get('branch', None)
+    return branch
+
+
+class WarmCacheAffinityPolicy(LoadAwarePolicy):
+
+    AFFINITY_MAX_SCORE = 1.0  # load of preferred worker is acceptable
+    AFFINITY_TOLERANCE = 0.5  # score difference with the least loaded worker
+
+    def getPreferredWorkers(self, bldr):
+        res = [_lastBuilderWorker.get(bldr.name, None)]
+        branch = _getBranch(bldr)
+        if branch is not None:
+            res.append(_lastBranchWorker.get(branch, None))
+        return [w for w in res if w is not None]
+
+    def nextSlave(self, bldr, slavebuilders):
+        best = LoadAwarePolicy.nextSlave(self, bldr, slavebuilders)
+        if best is None:
+            return None
+        bestScore = self.score(best)
+        for name in self.getPreferredWorkers(bldr):
+            if name == self.getWorkerName(best):
+                return best
+            for sb in slavebuilders:
+                if self.getWorkerName(sb) != name:
+                    continue
+                score = self.score(sb)
+                if score <= self.AFFINITY_MAX_SCORE and score <= bestScore + self.AFFINITY_TOLERANCE:
+                    trace('nextSlave: %s -> %s (warm cache, score=%.2f)' % (bldr.name, name, score))
+                    return sb
+        return best
+
+    def buildStarted(self, bldr, name, breq=None):
+        LoadAwarePolicy.buildStarted(self, bldr, name, breq)
+        branch = _getBranch(bldr, breq)
+        if _lastBuilderWorker.get(bldr.name, None) == name:
+            state = CACHE_BUILDER
+        elif branch is not None and _lastBranchWorker.get(branch, None) == name:
+            state = CACHE_BRANCH
+        else:
+            state = CACHE_COLD
+        _lastBuilderWorker[bldr.name] = name
+        if branch is not None:
+            _lastBranchWorker[branch] = name
+        _startedCacheState[(bldr.name, name)] = state
+        stats = _affinityStats.setdefault(bldr.name, {})
+        stats[state] = stats.get(state, 0) + 1
+        total = sum(stats.values())
+        trace('Worker affinity: %s on %s: %s cache (builder hit rate %.0f%%, %d builds)' % (
+                bldr.name, name, state, 100.0 * stats.get(CACHE_BUILDER, 0) / total, total))
+
+
+def getCacheState(builderName, worker):
+    ''' Cache state of the build, which is started on the worker ('builder', 'branch', 'cold' or None) '''
+    return _startedCacheState.get((builderName, worker), None)
+
+
+def getAffinityReport(steps=('Fetch opencv', 'cmake', 'compile release', 'compile debug')):
+    '''
+    Hit rates per builder and median durations of checkout/compile steps on warm and cold workers
+    (from duration_store)
+    '''
+    import duration_store
+    report = {}
+    for (builder, stats) in sorted(_affinityStats.items()):
+        total = sum(stats.values())
+        entry = dict(builds=total, hit_rate=float(stats.get(CACHE_BUILDER, 0)) / total,
+                     branch_hit_rate=float(stats.get(CACHE_BRANCH, 0)) / total, steps={})
+        for step in steps:
+            entry['steps'][step] = dict([(state, duration_store.getStore().getP50(builder, step, workerCache=state))
+                                         for state in [CACHE_BUILDER, CACHE_BRANCH, CACHE_COLD]])
+        report[builder] = entry
+    return report
+
+
+defaultPolicy = WarmCacheAffinityPolicy()